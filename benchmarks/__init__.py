@@ -0,0 +1,15 @@
+"""
+Throughput benchmarks for zoho_crm_connector, run against the local stand-in Zoho server used by the tests
+(zoho_crm_connector/tests/fake_zoho.py), so no real org is touched and no API credits are spent.
+
+Each scenario drives the real Zoho_crm code paths and reports records per second, p50 and p99 call latency and
+peak RSS. From a source checkout:
+
+    python -m benchmarks                        # every scenario, with default sizes
+    python -m benchmarks export upsert_criteria --size 5000 --latency 0.05 --jitter 0.02
+    python -m benchmarks --list
+
+Compare the numbers before and after a change, with the same options; absolute values depend on the machine.
+"""
+
+from .scenarios import SCENARIOS, BenchmarkResult, run_scenario
@@ -0,0 +1,47 @@
+import argparse
+import sys
+
+from .scenarios import SCENARIOS, run_isolated, run_scenario
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Benchmark zoho_crm_connector against a local stand-in Zoho server.')
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', help='scenarios to run (default: all)')
+    parser.add_argument('--list', action='store_true', help='list the scenarios and exit')
+    parser.add_argument('--size', type=int, default=10000, help='records per scenario (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every server response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds, at random')
+    parser.add_argument('--token-lifetime', type=float, default=None,
+                        help='expire access tokens after this many seconds, to include 401 refreshes')
+    parser.add_argument('--rate-limit', type=int, default=None,
+                        help='calls allowed per --rate-limit-window seconds; beyond them the server replies 429')
+    parser.add_argument('--rate-limit-window', type=float, default=60)
+    parser.add_argument('--max-workers', type=int, default=8)
+    parser.add_argument('--in-process', action='store_true',
+                        help='run every scenario in this process (peak RSS is then cumulative)')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            print(f'{name:16} {scenario.__doc__.strip().splitlines()[0]}')
+        return 0
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    run = run_scenario if args.in_process else run_isolated
+    print(f"{'scenario':16} {'records':>8} {'seconds':>8} {'records/s':>10} {'calls':>6} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'peak MB':>8}")
+    for name in args.scenarios or list(SCENARIOS):
+        result = run(name, size=args.size, latency=args.latency, jitter=args.jitter,
+                     token_lifetime=args.token_lifetime, rate_limit=args.rate_limit,
+                     rate_limit_window=args.rate_limit_window, max_workers=args.max_workers)
+        peak = f'{result.peak_rss_mb:8.1f}' if result.peak_rss_mb is not None else f"{'-':>8}"
+        print(f'{result.name:16} {result.records:8} {result.seconds:8.2f} {result.records_per_second:10.0f} '
+              f'{result.calls:6} {result.p50 * 1000:8.1f} {result.p99 * 1000:8.1f} {peak}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Benchmark scenarios. A scenario sets up the stand-in server's data, exercises a Zoho_crm and returns the number of
+records it handled; run_scenario times it and collects call latencies with a request hook.
+"""
+
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from zoho_crm_connector import CreditGovernor, RequestEvent, Zoho_crm
+from zoho_crm_connector.metrics import _percentile
+from zoho_crm_connector.tests.fake_zoho import FakeZoho, make_records
+
+try:
+    import resource
+except ImportError:  # pragma: no cover (Windows)
+    resource = None
+
+
+class BenchmarkResult(NamedTuple):
+    name: str
+    records: int
+    seconds: float
+    calls: int
+    p50: float  # call latency, seconds
+    p99: float
+    peak_rss_mb: Optional[float]  # peak resident memory of the process running the scenario
+
+    @property
+    def records_per_second(self) -> float:
+        return self.records / self.seconds if self.seconds else 0.0
+
+
+def export(fake: FakeZoho, zoho_crm: Zoho_crm, size: int) -> int:
+    """ A full module export, a page at a time. """
+    fake.modules['Contacts'] = make_records('Contacts', size)
+    return sum(len(page) for page in zoho_crm.yield_page_from_module(module_name='Contacts'))
+
+
+def export_prefetch(fake: FakeZoho, zoho_crm: Zoho_crm, size: int) -> int:
+    """ A full module export, fetching four pages ahead. """
+    fake.modules['Contacts'] = make_records('Contacts', size)
+    return sum(len(page) for page in zoho_crm.yield_page_from_module(module_name='Contacts', prefetch=4))
+
+
+def export_partitioned(fake: FakeZoho, zoho_crm: Zoho_crm, size: int) -> int:
+    """ A full module export in Modified_Time slices fetched concurrently (export_module). """
+    records = make_records('Contacts', size)
+    for i, record in enumerate(records):
+        record['Modified_Time'] = f'2020-01-{1 + i % 28:02}T{i % 24:02}:{i % 60:02}:00+00:00'
+    fake.modules['Contacts'] = records
+    return sum(1 for _ in zoho_crm.export_module('Contacts', partitions=zoho_crm.max_workers))
+
+
+def upsert_criteria(fake: FakeZoho, zoho_crm: Zoho_crm, size: int) -> int:
+    """ The one-record-at-a-time upsert loop: search by criteria, then insert or update, then re-fetch.
+    Half the records already exist. """
+    count = max(size // 20, 1)
+    fake.modules['Accounts'] = [{'id': str(1000000 + i), 'Account_Name': f'Account {i}'} for i in range(0, count, 2)]
+    for i in range(count):
+        zoho_crm.upsert_zoho_module('Accounts', payload={'data': [{'Account_Name': f'Account {i}'}]},
+                                    criteria=f'(Account_Name:equals:Account {i})')
+    return count
+
+
+def upsert_batched(fake: FakeZoho, zoho_crm: Zoho_crm, size: int) -> int:
+    """ The same upserts as upsert_criteria, through the native upsert endpoint 100 at a time. """
+    count = max(size // 20, 1)
+    fake.modules['Accounts'] = [{'id': str(1000000 + i), 'Account_Name': f'Account {i}'} for i in range(0, count, 2)]
+    zoho_crm.upsert_many_zoho_module('Accounts', [{'Account_Name': f'Account {i}'} for i in range(count)],
+                                     duplicate_check_fields=['Account_Name'])
+    return count
+
+
+def related_fanout(fake: FakeZoho, zoho_crm: Zoho_crm, size: int) -> int:
+    """ The related contacts of many accounts, fetched concurrently. """
+    accounts = make_records('Accounts', max(size // 20, 1))
+    fake.modules['Accounts'] = accounts
+    for account in accounts:
+        fake.related[('Accounts', account['id'], 'Contacts')] = make_records('Contacts', 5, start_id=int(account['id']))
+    related = zoho_crm.map_related_records('Accounts', 'Contacts', [account['id'] for account in accounts])
+    return sum(len(contacts) for contacts in related.values())
+
+
+def user_lookup(fake: FakeZoho, zoho_crm: Zoho_crm, size: int) -> int:
+    """ Resolving a sales rep by name for every line of an order import. """
+    fake.users = [{'id': str(i), 'full_name': f'User {i}', 'email': f'user{i}@example.com', 'status': 'active'}
+                  for i in range(500)]
+    for i in range(size):
+        zoho_crm.finduser_by_name(f'User {i % 500}')
+    return size
+
+
+SCENARIOS = {scenario.__name__: scenario for scenario in (
+    export, export_prefetch, export_partitioned, upsert_criteria, upsert_batched, related_fanout, user_lookup)
+}  # type: Dict[str, Callable[[FakeZoho, Zoho_crm, int], int]]
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024  # bytes on macOS, KiB elsewhere
+
+
+def run_scenario(name: str, size: int = 10000, latency: float = 0.0, jitter: float = 0.0,
+                 token_lifetime: float = None, rate_limit: int = None, rate_limit_window: float = 60,
+                 max_workers: int = 8) -> BenchmarkResult:
+    """ Run one scenario in this process against a fresh stand-in server.
+
+    token_lifetime makes the server expire access tokens, so the refresh-on-401 path is included.
+    rate_limit makes the server allow that many calls per rate_limit_window seconds and reply 429 beyond them;
+    the client then gets a CreditGovernor, which follows the rate-limit headers."""
+    fake = FakeZoho()
+    fake.latency, fake.jitter, fake.token_lifetime = latency, jitter, token_lifetime
+    if rate_limit:
+        fake.rate_limit, fake.rate_limit_window, fake.rate_limit_remaining = rate_limit, rate_limit_window, rate_limit
+    fake.start()
+    latencies = []  # type: List[float]
+
+    def record_latency(event: RequestEvent):
+        latencies.append(event.latency)
+
+    try:
+        with tempfile.TemporaryDirectory() as token_dir:
+            with Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake.base_url,
+                          accounts_url=fake.accounts_url, token_file_dir=Path(token_dir), max_workers=max_workers,
+                          governor=CreditGovernor() if rate_limit else None,
+                          request_hooks=[record_latency]) as zoho_crm:
+                zoho_crm.current_token  # the first token isn't part of the measurement
+                started = time.perf_counter()
+                records = SCENARIOS[name](fake, zoho_crm, size)
+                seconds = time.perf_counter() - started
+    finally:
+        fake.stop()
+    latencies.sort()
+    return BenchmarkResult(name=name, records=records, seconds=seconds, calls=len(latencies),
+                           p50=_percentile(latencies, 0.5), p99=_percentile(latencies, 0.99),
+                           peak_rss_mb=_peak_rss_mb())
+
+
+def run_isolated(name: str, **kwargs) -> BenchmarkResult:
+    """ run_scenario in a new process, so that peak RSS belongs to this scenario alone. """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(run_scenario, (name,), kwargs)
@@ -229,10 +229,8 @@ class Zoho_crm_enhanced(Zoho_crm):
         if r.ok:
             # get the accounts
             try:
-                zoho_accounts = []
                 account_ids = [data_item["details"]["id"] for data_item in r.json()['data']]
-                for account_id in account_ids:
-                    zoho_accounts.append(self.get_record_by_id(module_name=module_name, id=account_id))
+                zoho_accounts = self.get_records_by_ids(module_name=module_name, ids=account_ids)
                 return True, zoho_accounts
             # account_id = r.json()['data'][0]['details']['id']
             except KeyError:
@@ -20,9 +20,13 @@ setup(
     keywords=keywords,
     version=version,
     packages=['zoho_crm_connector'],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=['requests',
                       ],
+    extras_require={'async': ['httpx'],
+                    'arrow': ['pyarrow'],
+                    'fast': ['orjson'],
+                    },
     setup_requires=["pytest-runner", ],
     tests_require=["pytest", ],
     classifiers=[
@@ -1 +1,13 @@
 from .zoho_crm_api import Zoho_crm
+from .async_api import AsyncZoho_crm
+from .bulk import BulkRead, BulkWrite
+from .token_store import FileTokenStore, SQLiteTokenStore, TokenStore
+from .mirror import ZohoMirror
+from .governor import CreditGovernor
+from .metrics import MetricsAggregator, RequestEvent
+from .transport import RecordingAdapter, ReplayAdapter
+from .metadata import MetadataCache
+from .users import UserDirectory
+from .export_writers import ArrowExportWriter, CSVExportWriter, ParquetExportWriter
+from .records import Record
+from .pool import ZohoClientPool
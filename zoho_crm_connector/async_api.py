@@ -0,0 +1,436 @@
+"""
+zoho_crm_connector.async_api
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+An asyncio version of Zoho_crm, built on httpx.
+
+It has the same surface as Zoho_crm, but methods are coroutines and the multi-page methods are async generators.
+All requests share one httpx.AsyncClient, so its connection pool is shared too: many calls can be in flight
+at once (for example with asyncio.gather) without a thread per call.
+
+httpx is an optional dependency: pip install zoho_crm_connector[async]
+
+    async with AsyncZoho_crm(refresh_token=..., client_id=..., client_secret=..., token_file_dir=...) as zoho_crm:
+        async for page in zoho_crm.yield_page_from_module(module_name="Contacts"):
+            ...
+
+"""
+
+import asyncio
+import functools
+import logging
+import time
+import urllib.parse
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncGenerator, Dict, List, Optional, Tuple, Union
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+from .coql import OFFSET_LIMIT, ensure_order, page_query, query_after, split_limit
+from .decoding import Decoder, get_decoder
+from .token_store import FileTokenStore, TokenStore
+from .zoho_crm_api import (DEFAULT_API_VERSION, PAGE_TOKEN_VERSION, APIQuotaExceeded, Zoho_crm, api_base_url,
+                           api_version_of, convert_datetime_to_zoho_crm_time, with_api_version)
+
+logger = logging.getLogger()
+
+
+class AsyncZoho_crm:
+    """ An authenticated asyncio connection to zoho crm.
+
+    Construct it with the same authentication details as Zoho_crm. Tokens are kept in the same token store as
+    Zoho_crm's (token_file_dir/access_token.json unless a token_store is given, see token_store.py), and are refreshed
+    token_refresh_margin seconds before they expire, so sync and async clients can be used side by side and still
+    refresh only once. accounts_url overrides the Zoho accounts server, as for Zoho_crm.
+
+    max_connections bounds the shared connection pool, and therefore how many requests are in flight at once.
+    As with Zoho_crm, GET, PUT and DELETE requests answered with a 5xx are retried up to retries times,
+    waiting backoff_factor * 2 ** attempt seconds (at most BACKOFF_MAX) in between; a 429 is retried too when
+    it says with Retry-After how soon, within BACKOFF_MAX, otherwise it raises APIQuotaExceeded.
+    json_decoder picks how responses are decoded, as for Zoho_crm.
+    Call aclose() when finished, or use the client as an async context manager."""
+
+    ACCOUNTS_HOST = Zoho_crm.ACCOUNTS_HOST
+    RETRY_STATUSES = (500, 502, 503, 504)
+    RETRY_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+    BACKOFF_MAX = 120
+
+    def __init__(self, refresh_token: str, client_id: str, client_secret: str, token_file_dir: Path = None,
+                 base_url=None,
+                 hosting=".COM",
+                 default_zoho_user_name: str = None,
+                 default_zoho_user_id: str = None,
+                 max_connections: int = 20,
+                 timeout: float = 60,
+                 api_version: str = None,
+                 json_decoder: Union[str, Decoder] = None,
+                 token_refresh_margin: float = 300,
+                 accounts_url: str = None,
+                 token_store: TokenStore = None,
+                 retries: int = 10,
+                 backoff_factor: float = 2,
+                 ):
+        if httpx is None:
+            raise RuntimeError("AsyncZoho_crm needs httpx: pip install zoho_crm_connector[async]")
+        token_file_name = 'access_token.json'
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout,
+            transport=httpx.AsyncHTTPTransport(retries=3))  # retries connection errors only
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.refresh_token = refresh_token
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.hosting = hosting.upper() or ".COM"
+        if base_url is None:
+            base_url = api_base_url(self.hosting, api_version or DEFAULT_API_VERSION)
+        elif api_version:
+            base_url = with_api_version(base_url, api_version)
+        self.base_url = base_url
+        self.api_version = api_version_of(base_url)
+        self.decode_json = get_decoder(json_decoder)
+        self.zoho_user_cache = {}  # type: Dict[str, dict]  # user type: {'users': [...]}
+        self.default_zoho_user_name = default_zoho_user_name
+        self.default_zoho_user_id = default_zoho_user_id
+        if token_store is None:
+            if token_file_dir is None:
+                raise RuntimeError("Provide a token_file_dir or a token_store")
+            token_store = FileTokenStore(token_file_dir / token_file_name)
+        self.token_store = token_store
+        self.token_file_path = getattr(token_store, 'token_file_path', None)  # type: Optional[Path]
+        self.token_refresh_margin = token_refresh_margin
+        self.accounts_url = accounts_url
+        self.__token = None  # type: Optional[dict]
+        # made by the first coroutine that needs it: before Python 3.10 a Lock belongs to the event loop current
+        # when it is made, which isn't the one asyncio.run starts if the client was made outside it
+        self.__token_lock = None  # type: Optional[asyncio.Lock]
+
+    async def __aenter__(self) -> 'AsyncZoho_crm':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.http_client.aclose()
+
+    def _token_is_fresh(self, token: Optional[dict]) -> bool:
+        return bool(token) and time.time() < token.get('expires_at', 0) - self.token_refresh_margin
+
+    def _token_lock(self) -> asyncio.Lock:
+        if self.__token_lock is None:
+            self.__token_lock = asyncio.Lock()
+        return self.__token_lock
+
+    async def _get_token(self) -> dict:
+        """ The access token, refreshed if it expires within token_refresh_margin seconds."""
+        if not self._token_is_fresh(self.__token):
+            async with self._token_lock():
+                if not self._token_is_fresh(self.__token):
+                    self.__token = await self._stored_token()
+        return self.__token
+
+    async def _refresh_access_token(self, stale_token: dict) -> dict:
+        """ Replace a token that Zoho rejected. Concurrent callers which saw the same stale token share one refresh."""
+        async with self._token_lock():
+            if self.__token is not stale_token:
+                return self.__token  # another task has already refreshed it
+            self.__token = await self._stored_token(stale_token)
+            return self.__token
+
+    async def _stored_token(self, stale_token: dict = None) -> dict:
+        """ A usable token from the token store, which asks Zoho for a new one only if no other client, thread or
+        process has already done so. The store's locks block, so it is used from a worker thread; the refresh
+        itself runs on this event loop."""
+        loop = asyncio.get_running_loop()
+
+        def refresh() -> dict:
+            return asyncio.run_coroutine_threadsafe(self._fetch_access_token(), loop).result()
+
+        return await loop.run_in_executor(None, functools.partial(
+            self.token_store.get_token, is_fresh=self._token_is_fresh, refresh=refresh, stale_token=stale_token))
+
+    async def _fetch_access_token(self) -> dict:
+        """ Ask Zoho for a new access token. Use _stored_token, which stores it and avoids duplicate requests."""
+        if self.accounts_url:
+            accounts_url = self.accounts_url.rstrip('/')
+        else:
+            auth_host = self.ACCOUNTS_HOST[self.hosting]
+            if not auth_host:
+                raise RuntimeError(f"Zoho hosting {self.hosting} is not implemented")
+            accounts_url = f"https://{auth_host}"
+        requested_at = time.time()
+        r = await self.http_client.post(url=f"{accounts_url}/oauth/v2/token",
+                                        params={'refresh_token': self.refresh_token,
+                                                'client_id': self.client_id,
+                                                'client_secret': self.client_secret,
+                                                'grant_type': 'refresh_token'})
+        if r.status_code == 200:
+            new_token = self._json(r)
+            if 'access_token' not in new_token:
+                logger.error(f"Token is not valid")
+                raise RuntimeError(f"Zoho refresh token is not valid: {new_token}")
+            new_token['expires_at'] = requested_at + new_token.get('expires_in', 3600)
+            return new_token
+        else:
+            raise RuntimeError(f"API failure trying to get access token: {r.reason_phrase}")
+
+    async def _request(self, method: str, url: str, headers: dict = None, **kwargs) -> 'httpx.Response':
+        """ Send a request with the current access token; on a 401, refresh the token once and resend."""
+        token = await self._get_token()
+        request_headers = dict(headers or {})
+        request_headers['Authorization'] = 'Zoho-oauthtoken ' + token['access_token']
+        r = await self._send_with_retries(method, url, request_headers, kwargs)
+        if r.status_code == 401:
+            token = await self._refresh_access_token(stale_token=token)
+            request_headers['Authorization'] = 'Zoho-oauthtoken ' + token['access_token']
+            r = await self._send_with_retries(method, url, request_headers, kwargs)
+        return r
+
+    async def _send_with_retries(self, method: str, url: str, headers: dict, kwargs: dict) -> 'httpx.Response':
+        attempt = 0
+        while True:
+            r = await self.http_client.request(method, url, headers=headers, **kwargs)
+            wait = self._retry_wait(method, r, attempt)
+            if wait is None:
+                return r
+            logger.info(f"{method} {url} failed with {r.status_code}; retrying in {wait:.0f}s")
+            await asyncio.sleep(wait)
+            attempt += 1
+
+    def _retry_wait(self, method: str, r: 'httpx.Response', attempt: int) -> Optional[float]:
+        """ How long to wait before sending the request again, or None if it shouldn't be."""
+        if attempt >= self.retries or method not in self.RETRY_METHODS:
+            return None
+        if r.status_code in self.RETRY_STATUSES:
+            return min(self.backoff_factor * 2 ** attempt, self.BACKOFF_MAX)
+        retry_after = r.headers.get('Retry-After', '')
+        if r.status_code == 429 and retry_after.isdigit() and int(retry_after) <= self.BACKOFF_MAX:
+            return float(retry_after)
+        return None
+
+    def _json(self, r: 'httpx.Response'):
+        return self.decode_json(r.content)
+
+    def _validate_response(self, r: 'httpx.Response') -> Optional[dict]:
+        """ The async equivalent of Zoho_crm._validate_response. 401 is handled by _request."""
+        if r.status_code == 200:
+            return self._json(r)
+        elif r.status_code == 201:
+            return {'result': True}  # insert succeeded
+        elif r.status_code == 202:  # multiple insert succeeded
+            return {'result': True}
+        elif r.status_code == 204:  # no content
+            return None
+        elif r.status_code == 304:  # nothing changed since the requested modified-since timestamp
+            return None
+        elif r.status_code == 429:
+            raise APIQuotaExceeded("API Quota exceeded, error 429")
+        else:
+            raise RuntimeError(
+                f"API failure trying: {r.reason_phrase} and status code: {r.status_code} and text {r.text}, attempted url was: {r.url}, unquoted is: {urllib.parse.unquote(str(r.url))}")
+
+    async def _yield_pages(self, url: str, headers: dict, parameters: dict) -> AsyncGenerator[List[dict], None]:
+        page = 1
+        page_token = None
+        while True:
+            if page_token:  # record lists from API v2.1 link pages by token
+                parameters.pop('page', None)
+                parameters['page_token'] = page_token
+            else:
+                parameters['page'] = page
+            r = await self._request('GET', url, headers=headers, params=urllib.parse.urlencode(parameters))
+            r_json = self._validate_response(r)
+            if not r_json:
+                return
+            if 'data' in r_json:
+                yield r_json['data']
+            else:
+                raise RuntimeError(
+                    f"Did not receive the expected data format in the returned json when: url={url} parameters={parameters}")
+            if 'info' in r_json:
+                if not r_json['info']['more_records']:
+                    break
+            else:
+                break
+            page += 1
+            page_token = r_json['info'].get('next_page_token')
+
+    async def yield_page_from_module(self, module_name: str, criteria: str = None,
+                                     parameters: dict = None, modified_since: datetime = None,
+                                     fields: List[str] = None) -> AsyncGenerator[List[dict], None]:
+        """ Yields a page of results, each page being a list of dicts. See Zoho_crm.yield_page_from_module """
+        if not criteria:
+            url = self.base_url + module_name
+        else:
+            url = self.base_url + f'{module_name}/search'
+        headers = {}
+        parameters = dict(parameters or {})
+        if criteria:
+            parameters['criteria'] = criteria
+        if fields:
+            parameters['fields'] = ','.join(fields)
+        if modified_since:
+            headers['If-Modified-Since'] = convert_datetime_to_zoho_crm_time(modified_since)
+        async for page in self._yield_pages(url, headers, parameters):
+            yield page
+
+    async def iter_records(self, module_name: str, criteria: str = None, parameters: dict = None,
+                           modified_since: datetime = None, fields: List[str] = None) -> AsyncGenerator[dict, None]:
+        """ Yields one record at a time. See Zoho_crm.iter_records """
+        async for page in self.yield_page_from_module(module_name=module_name, criteria=criteria,
+                                                      parameters=parameters, modified_since=modified_since,
+                                                      fields=fields):
+            for record in page:
+                yield record
+
+    async def yield_deleted_records_from_module(self, module_name: str, type: str = 'all',
+                                                modified_since: datetime = None) -> AsyncGenerator[List[dict], None]:
+        """ Yields a page of deleted record results. See Zoho_crm.yield_deleted_records_from_module """
+        url = self.base_url + f'{module_name}/deleted'
+        headers = {}
+        if modified_since:
+            headers['If-Modified-Since'] = modified_since.isoformat()
+        async for page in self._yield_pages(url, headers, {'type': type}):
+            yield page
+
+    async def get_users(self, user_type: str = None, per_page: int = 200) -> dict:
+        """ Get zoho users, filtering by a Zoho CRM user type. See Zoho_crm.get_users """
+        user_type = user_type or 'AllUsers'
+        if user_type not in self.zoho_user_cache:
+            data = []
+            page = 0
+            while page < 999:
+                page += 1
+                url = self.base_url + f"users?type={user_type}&page={page}&per_page={per_page}"
+                r = await self._request('GET', url)
+                validated_response = self._validate_response(r)
+                if not validated_response:
+                    break
+                data.extend(validated_response['users'])
+                if not validated_response['info']['more_records']:
+                    break
+            self.zoho_user_cache[user_type] = {"users": data}
+        return self.zoho_user_cache[user_type]
+
+    async def finduser_by_name(self, full_name: str) -> Tuple[str, str]:
+        """ Returns the active user as a tuple(full_name,Zoho user id), or the default user. See Zoho_crm.finduser_by_name"""
+        users = await self.get_users()
+        for user in users['users']:
+            if user['full_name'] == full_name.strip():
+                if user['status'] == 'active':
+                    return full_name, user['id']
+                else:
+                    logger.debug(f"User is inactive in zoho crm: {full_name}")
+                    return self.default_zoho_user_name, self.default_zoho_user_id
+        logger.info(f"User not found in zoho: {full_name}")
+        return self.default_zoho_user_name, self.default_zoho_user_id
+
+    async def get_record_by_id(self, module_name, id) -> dict:
+        """ Call the get record endpoint with an id"""
+        r = await self._request('GET', self.base_url + f'{module_name}/{id}')
+        r_json = self._validate_response(r)
+        return r_json['data'][0]
+
+    async def delete_from_module(self, module_name: str, record_id: str) -> Tuple[bool, dict]:
+        """ deletes from a named Zoho CRM module"""
+        r = await self._request('DELETE', self.base_url + f"{module_name}", params={'ids': record_id})
+        if r.status_code == 200:
+            return True, self._json(r)
+        else:
+            return False, self._json(r)
+
+    async def update_zoho_module(self, module_name: str,
+                                 payload: Dict[str, List[Dict]]
+                                 ) -> Tuple[bool, Dict]:
+        """ See Zoho_crm.update_zoho_module """
+        if 'trigger' not in payload:
+            payload['trigger'] = []
+        r = await self._request('PUT', self.base_url + module_name, json=payload)
+        return r.is_success, self._json(r)
+
+    async def upsert_zoho_module(self, module_name: str, payload: Dict[str, List[Dict]],
+                                 criteria: str = None, ) -> Tuple[bool, Dict]:
+        """ Insert, or update the first record matching criteria. See Zoho_crm.upsert_zoho_module """
+        update_existing_record = False  # by default, always insert
+        if criteria:
+            if len(payload['data']) != 1:
+                raise RuntimeError("Only pass one record when using criteria")
+            matches = []
+            async for data_block in self.yield_page_from_module(module_name=module_name, criteria=criteria):
+                matches += data_block
+            if len(matches) > 0:
+                payload['data'][0]['id'] = matches[0]['id']  # and need to do a put
+                update_existing_record = True
+
+        url = self.base_url + f'{module_name}'
+        if 'trigger' not in payload:
+            payload['trigger'] = []
+        r = await self._request('PUT' if update_existing_record else 'POST', url, json=payload)
+        if r.is_success:
+            if r.status_code == 202:  # could be duplicate
+                return False, self._json(r)
+            record_id = self._json(r)['data'][0]['details']['id']
+            return True, await self.get_record_by_id(module_name=module_name, id=record_id)
+        else:
+            return False, self._json(r)
+
+    async def get_related_records(self, parent_module_name: str, child_module_name: str, parent_id: str,
+                                  modified_since: datetime = None) \
+            -> Tuple[bool, Optional[List[Dict]]]:
+        url = self.base_url + f'{parent_module_name}/{parent_id}/{child_module_name}'
+        headers = {}
+        if modified_since:
+            headers['If-Modified-Since'] = modified_since.isoformat()
+        r = await self._request('GET', url, headers=headers)
+        r_json = self._validate_response(r)
+        if r.is_success and r_json is not None:
+            return True, r_json['data']
+        elif r.is_success:
+            return True, r_json
+        else:
+            return False, r_json
+
+    async def get_records_through_coql_query(self, query: str) -> List[Dict]:
+        """ All the records a COQL query selects. See Zoho_crm.get_records_through_coql_query """
+        return [record async for page in self.yield_coql_pages(query) for record in page]
+
+    async def yield_coql_pages(self, query: str, page_size: int = None) -> AsyncGenerator[List[dict], None]:
+        """ Yields the pages of records a COQL query selects, advancing LIMIT offset, count.
+        See Zoho_crm.yield_coql_pages; to run windows concurrently, gather queries restricted with coql.add_condition."""
+        query, offset, count = split_limit(query)
+        page_base = ensure_order(query)
+        if page_size is None:
+            page_size = 2000 if self.api_version >= PAGE_TOKEN_VERSION else 200
+        fetched = 0
+        last_id = None
+        while count is None or fetched < count:
+            size = page_size if count is None else min(page_size, count - fetched)
+            if offset + size > OFFSET_LIMIT:
+                page_base, offset = query_after(query, last_id), 0
+            r = await self._request('POST', self.base_url + "coql",
+                                    json={"select_query": page_query(page_base, offset, size)})
+            r_json = self._validate_response(r)
+            if not r_json or not r_json.get('data'):
+                return
+            yield r_json['data']
+            fetched += len(r_json['data'])
+            offset += len(r_json['data'])
+            last_id = r_json['data'][-1].get('id')
+            if not (r_json.get('info') or {}).get('more_records'):
+                return
+
+    async def get_module_field_api_names(self, module_name: str) -> List[str]:
+        """ uses Fields Meta Data but just returns a list of field API names """
+        r = await self._request('GET', self.base_url + f"settings/fields?module={module_name}")
+        r_json = self._validate_response(r)
+        if r.is_success and r_json is not None:
+            return [f["api_name"] for f in r_json["fields"]]
+        else:
+            raise RuntimeError(f"did not receive valid data for get_module_field_names {module_name}")
+
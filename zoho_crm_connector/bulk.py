@@ -0,0 +1,364 @@
+"""
+zoho_crm_connector.bulk
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Zoho CRM Bulk APIs, for full exports and large imports.
+
+A bulk read job exports up to 200,000 records per result page for a fixed credit cost, instead of one API call per
+200 records. The result is a zipped CSV file; it is spooled to a temporary file and decoded a row at a time,
+so memory use does not grow with the size of the export.
+
+    bulk_read = BulkRead(zoho_crm)
+    for page in bulk_read.yield_page_from_module(module_name="Contacts", fields=["Last_Name", "Email"]):
+        ...
+
+A bulk write job imports up to 25,000 records per uploaded file. Records are streamed into a CSV inside a zip
+(spooled, like results), uploaded, and written by a job; the per-row result file then says which rows succeeded.
+
+    result = BulkWrite(zoho_crm).write_module(module_name="Products", records=products, operation="update",
+                                              find_by="id")
+    for row in result.failures():
+        ...
+
+Bulk API docs: https://www.zoho.com/crm/developer/docs/api/v2/bulk-read/overview.html
+"""
+
+import csv
+import io
+import itertools
+import logging
+import re
+import tempfile
+import time
+import urllib.parse
+import zipfile
+from abc import ABC, abstractmethod
+from typing import Dict, Generator, IO, Iterable, List, Tuple
+
+import requests
+
+from .zoho_crm_api import Zoho_crm
+
+logger = logging.getLogger()
+
+
+def bulk_url_from_base_url(base_url: str) -> str:
+    """ The bulk APIs live alongside the REST API: https://www.zohoapis.com/crm/v2/ becomes
+    https://www.zohoapis.com/crm/bulk/v2/ """
+    bulk_url, substitutions = re.subn(r'/crm/(v[\d.]+)/?$', r'/crm/bulk/\1/', base_url)
+    if not substitutions:
+        raise RuntimeError(f"Can't work out the bulk API url from the base url {base_url}")
+    return bulk_url
+
+
+def upload_url_from_base_url(base_url: str) -> str:
+    """ Bulk write files are uploaded to Zoho's content host: https://www.zohoapis.com/crm/v2/ uploads to
+    https://content.zohoapis.com/crm/v2/upload. Other base urls (a sandbox, say) are assumed to accept uploads directly."""
+    return base_url.replace('://www.zohoapis.', '://content.zohoapis.').rstrip('/') + '/upload'
+
+
+def _csv_value(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, dict):  # a lookup such as {'name': 'GrowthPath Pty Ltd', 'id': '3000000123'}
+        return value.get('id', '')
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, list):
+        return ';'.join(str(v) for v in value)  # multi-select picklists
+    return str(value)
+
+
+class _BulkAPI(ABC):
+    """ What bulk read and bulk write jobs have in common: authentication, polling with backoff, and
+    downloading zipped CSV results into spooled temporary files.
+
+    Jobs are polled, starting every poll_interval seconds and backing off by backoff_factor up to max_poll_interval.
+    If a job has not completed after timeout seconds, a RuntimeError is raised.
+
+    Results are spooled in memory up to spool_size bytes and then to a temporary file on disk."""
+
+    def __init__(self, zoho_crm: Zoho_crm, poll_interval: float = 5, max_poll_interval: float = 60,
+                 backoff_factor: float = 1.5, timeout: float = 3 * 60 * 60, spool_size: int = 10 * 1024 * 1024):
+        self.zoho_crm = zoho_crm
+        self.bulk_url = bulk_url_from_base_url(zoho_crm.base_url)
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.spool_size = spool_size
+
+    def _json(self, r: requests.Response) -> dict:
+        # the bulk APIs put the job details in 201 responses, which _validate_response discards
+        if r.ok and r.content:
+            return self.zoho_crm.decode_json(r.content)
+        return self.zoho_crm._validate_response(r)
+
+    @abstractmethod
+    def get_job(self, job_id: str) -> dict:
+        """ Fetch the details of a job."""
+
+    @staticmethod
+    @abstractmethod
+    def _job_state(job: dict) -> str:
+        """ The state of a job, from its details."""
+
+    def wait_for_job(self, job_id: str) -> dict:
+        """ Poll the job with backoff until it is completed, and return the job details."""
+        started = time.monotonic()
+        interval = self.poll_interval
+        while True:
+            job = self.get_job(job_id)
+            state = self._job_state(job)
+            if state == 'COMPLETED':
+                return job
+            if state == 'FAILED':
+                raise RuntimeError(f"Bulk job {job_id} failed: {job}")
+            if time.monotonic() - started > self.timeout:
+                raise RuntimeError(f"Bulk job {job_id} did not complete in {self.timeout} seconds, state: {state}")
+            logger.debug(f"Bulk job {job_id} is {state}, waiting {interval} seconds")
+            time.sleep(interval)
+            interval = min(interval * self.backoff_factor, self.max_poll_interval)
+
+    def _download(self, download_url: str) -> IO[bytes]:
+        """ Download a zipped result into a spooled temporary file. The caller closes it."""
+        url = urllib.parse.urljoin(self.bulk_url, download_url)
+        r = self.zoho_crm._send('GET', url, endpoint='bulk/download', stream=True)
+        spooled = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        try:
+            if not r.ok:
+                self.zoho_crm._validate_response(r)
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                spooled.write(chunk)
+        except Exception:
+            spooled.close()
+            raise
+        finally:
+            r.close()
+        spooled.seek(0)
+        return spooled
+
+    @staticmethod
+    def yield_records_from_zip(zipped: IO[bytes]) -> Generator[dict, None, None]:
+        """ Decode the CSV files in a bulk result zip a row at a time. Empty values become None."""
+        with zipfile.ZipFile(zipped) as zip_file:
+            for name in zip_file.namelist():
+                if not name.lower().endswith('.csv'):
+                    continue
+                with zip_file.open(name) as member:
+                    reader = csv.DictReader(io.TextIOWrapper(member, encoding='utf-8-sig', newline=''))
+                    for row in reader:
+                        yield {k: (v if v != '' else None) for k, v in row.items()}
+
+
+class BulkRead(_BulkAPI):
+    """ Runs Zoho Bulk Read jobs and streams back the records. """
+
+    def create_job(self, module_name: str, fields: List[str] = None, criteria: dict = None, page: int = 1) -> str:
+        """ Create a bulk read job and return its id.
+
+        criteria is the bulk read criteria structure, for example
+        {'api_name': 'Last_Name', 'comparator': 'equal', 'value': 'Smith'} or a group:
+        {'group_operator': 'and', 'group': [...]}. It is not the same as the search criteria string."""
+        query = {'module': module_name, 'page': page}
+        if fields:
+            query['fields'] = list(fields)
+        if criteria:
+            query['criteria'] = criteria
+        r = self.zoho_crm._send('POST', self.bulk_url + 'read', endpoint='bulk/read', json={'query': query})
+        r_json = self._json(r)
+        try:
+            return r_json['data'][0]['details']['id']
+        except (KeyError, IndexError, TypeError):
+            raise RuntimeError(f"Could not create a bulk read job for {module_name}: {r_json}")
+
+    def get_job(self, job_id: str) -> dict:
+        """ Returns the job details, including 'state' and, once completed, 'result' """
+        r = self.zoho_crm._send('GET', self.bulk_url + f'read/{job_id}', endpoint='bulk/read/{id}')
+        return self._json(r)['data'][0]
+
+    @staticmethod
+    def _job_state(job: dict) -> str:
+        return job.get('state')
+
+    def download_result(self, job: dict) -> IO[bytes]:
+        """ Download the zipped result of a completed job into a spooled temporary file. The caller closes it."""
+        return self._download(job['result']['download_url'])
+
+    def yield_records(self, module_name: str, fields: List[str] = None,
+                      criteria: dict = None) -> Generator[dict, None, None]:
+        """ Export a module with bulk read jobs, yielding one record (a dict of strings) at a time.
+        If Zoho reports more records than fit in one job's result, further jobs are created for the next pages.
+        Zoho's CSV calls the id column Id; here it is id, as in the records of Zoho_crm.yield_page_from_module."""
+        page = 1
+        while True:
+            job_id = self.create_job(module_name=module_name, fields=fields, criteria=criteria, page=page)
+            job = self.wait_for_job(job_id)
+            zipped = self.download_result(job)
+            try:
+                for row in self.yield_records_from_zip(zipped):
+                    yield {('id' if k == 'Id' else k): v for k, v in row.items()}
+            finally:
+                zipped.close()
+            if not job['result'].get('more_records'):
+                break
+            page += 1
+
+    def yield_page_from_module(self, module_name: str, fields: List[str] = None, criteria: dict = None,
+                               page_size: int = 200) -> Generator[List[dict], None, None]:
+        """ Yields pages (lists of dicts) like Zoho_crm.yield_page_from_module, but the records come from bulk read jobs.
+
+        Note that values are the strings from Zoho's CSV export: lookups are ids, not {name,id} objects."""
+        page = []  # type: List[dict]
+        for record in self.yield_records(module_name=module_name, fields=fields, criteria=criteria):
+            page.append(record)
+            if len(page) >= page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+
+class BulkWriteResult:
+    """ The completed jobs of one BulkWrite.write_module call.
+
+    Each job's result file repeats the uploaded columns and adds ID, STATUS and ERRORS. STATUS is ADDED or UPDATED
+    for rows that were written. The result files are downloaded again each time the rows are iterated."""
+
+    SUCCESS_STATUSES = ('ADDED', 'UPDATED')
+
+    def __init__(self, bulk_write: 'BulkWrite', jobs: List[dict]):
+        self.bulk_write = bulk_write
+        self.jobs = jobs
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        """ added_count, updated_count, skipped_count and total_count summed over the jobs """
+        counts = {}  # type: Dict[str, int]
+        for job in self.jobs:
+            for resource in job.get('resource', []):
+                for k, v in resource.get('file', {}).items():
+                    if k.endswith('_count'):
+                        counts[k] = counts.get(k, 0) + v
+        return counts
+
+    def yield_rows(self) -> Generator[dict, None, None]:
+        for job in self.jobs:
+            zipped = self.bulk_write.download_result(job)
+            try:
+                yield from self.bulk_write.yield_records_from_zip(zipped)
+            finally:
+                zipped.close()
+
+    def successes(self) -> Generator[dict, None, None]:
+        return (row for row in self.yield_rows() if row.get('STATUS') in self.SUCCESS_STATUSES)
+
+    def failures(self) -> Generator[dict, None, None]:
+        return (row for row in self.yield_rows() if row.get('STATUS') not in self.SUCCESS_STATUSES)
+
+
+class BulkWrite(_BulkAPI):
+    """ Runs Zoho Bulk Write jobs: insert, update or upsert many records for a few API calls.
+
+    org_id is the Zoho org id, which uploads need; if it is not given it is fetched once.
+    upload_url defaults to Zoho's content host for the connection's base url.
+    Records are split into files of at most records_per_file rows (Zoho allows 25,000)."""
+
+    def __init__(self, zoho_crm: Zoho_crm, org_id: str = None, upload_url: str = None,
+                 records_per_file: int = 25000, **kwargs):
+        super().__init__(zoho_crm, **kwargs)
+        self.org_id = org_id
+        self.upload_url = upload_url or upload_url_from_base_url(zoho_crm.base_url)
+        self.records_per_file = records_per_file
+
+    def get_org_id(self) -> str:
+        if not self.org_id:
+            r = self.zoho_crm._send('GET', self.zoho_crm.base_url + 'org', endpoint='org')
+            self.org_id = self._json(r)['org'][0]['id']
+        return self.org_id
+
+    def write_zipped_csv(self, records: Iterable[dict], fields: List[str]) -> Tuple[IO[bytes], int]:
+        """ Stream records into a CSV file inside a spooled zip. Returns the zip (positioned at the start)
+        and the number of rows written. Lookups are written as their id. The caller closes the zip."""
+        spooled = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        count = 0
+        with zipfile.ZipFile(spooled, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+            with zip_file.open('records.csv', 'w') as member:
+                text = io.TextIOWrapper(member, encoding='utf-8', newline='')
+                writer = csv.writer(text)
+                writer.writerow(fields)
+                for record in records:
+                    writer.writerow([_csv_value(record.get(f)) for f in fields])
+                    count += 1
+                text.flush()
+                text.detach()
+        spooled.seek(0)
+        return spooled, count
+
+    def upload_file(self, zipped: IO[bytes]) -> str:
+        """ Upload a zipped CSV and return the file id. """
+        headers = {'feature': 'bulk-write', 'X-CRM-ORG': self.get_org_id()}
+        r = self.zoho_crm._send('POST', self.upload_url, endpoint='upload', headers=headers,
+                                files={'file': ('records.zip', zipped, 'application/zip')})
+        r_json = self._json(r)
+        try:
+            return r_json['details']['file_id']
+        except (KeyError, TypeError):
+            raise RuntimeError(f"Could not upload a bulk write file: {r_json}")
+
+    def create_job(self, module_name: str, file_id: str, fields: List[str], operation: str = 'insert',
+                   find_by: str = None) -> str:
+        """ Create a bulk write job for an uploaded file and return its id.
+        operation is insert, update or upsert; update and upsert need find_by, a unique field such as id."""
+        resource = {'type': 'data', 'module': module_name, 'file_id': file_id,
+                    'field_mappings': [{'api_name': f, 'index': i} for i, f in enumerate(fields)]}
+        if find_by:
+            resource['find_by'] = find_by
+        r = self.zoho_crm._send('POST', self.bulk_url + 'write', endpoint='bulk/write',
+                                json={'operation': operation, 'resource': [resource]})
+        r_json = self._json(r)
+        try:
+            return r_json['details']['id']
+        except (KeyError, TypeError):
+            raise RuntimeError(f"Could not create a bulk write job for {module_name}: {r_json}")
+
+    def get_job(self, job_id: str) -> dict:
+        """ Returns the job details, including 'status', per-file counts and, once completed, 'result' """
+        r = self.zoho_crm._send('GET', self.bulk_url + f'write/{job_id}', endpoint='bulk/write/{id}')
+        return self._json(r)
+
+    @staticmethod
+    def _job_state(job: dict) -> str:
+        return job.get('status')
+
+    def download_result(self, job: dict) -> IO[bytes]:
+        """ Download the zipped per-row result of a completed job into a spooled temporary file. The caller closes it."""
+        return self._download(job['result']['download_url'])
+
+    def write_module(self, module_name: str, records: Iterable[dict], operation: str = 'insert',
+                     find_by: str = None, fields: List[str] = None) -> BulkWriteResult:
+        """ Write records (dicts, as in payload['data'] for upsert_zoho_module) with bulk write jobs.
+
+        fields are the columns to write; by default, the keys of the first record.
+        All the files are uploaded and their jobs created before waiting for any job to finish."""
+        records = iter(records)
+        if fields is None:
+            first = next(records, None)
+            if first is None:
+                return BulkWriteResult(self, [])
+            fields = list(first.keys())
+            records = itertools.chain([first], records)
+        job_ids = []
+        while True:
+            zipped, count = self.write_zipped_csv(itertools.islice(records, self.records_per_file), fields)
+            try:
+                if not count:
+                    break
+                file_id = self.upload_file(zipped)
+            finally:
+                zipped.close()
+            job_ids.append(self.create_job(module_name=module_name, file_id=file_id, fields=fields,
+                                           operation=operation, find_by=find_by))
+            if count < self.records_per_file:
+                break
+        return BulkWriteResult(self, [self.wait_for_job(job_id) for job_id in job_ids])
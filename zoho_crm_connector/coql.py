@@ -0,0 +1,130 @@
+"""
+zoho_crm_connector.coql
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Paging and windowing COQL queries.
+
+One COQL call returns one page of records: 200 unless the query has a LIMIT, and never more than 2000 (200 before
+API v2.1). Zoho_crm.yield_coql_pages re-issues the query with LIMIT offset, count until info.more_records is false:
+
+    for page in zoho_crm.yield_coql_pages("select Last_Name, Email from Leads where Lead_Status = 'New'"):
+        ...
+
+Zoho refuses a LIMIT reaching past OFFSET_LIMIT records. Before a page would pass it, a query ordered by id (as queries
+without an ORDER BY are) starts again from offset 0, restricted to the ids after the last one fetched; a query with an
+ORDER BY of its own can't, and raises instead.
+
+Paging by offset is one round trip at a time. With windows=n the query is
+split into n disjoint ranges of id (or of another field, such as Modified_Time, with window_field), found by asking
+Zoho for the lowest and highest values; each range is paged separately and the ranges run concurrently. The records
+are the same, but pages from different windows arrive interleaved.
+
+The functions here rewrite query text. They understand queries of the form
+select ... from <module> [where ...] [group by ...] [order by ...] [limit ...], which is all COQL allows.
+"""
+
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple, Union
+
+_LIMIT = re.compile(r'\s+limit\s+(\d+)(?:\s*,\s*(\d+))?\s*$', re.IGNORECASE)
+_WHERE = re.compile(r'\s+where\s+', re.IGNORECASE)
+_AFTER_WHERE = re.compile(r'\s+(?:group|order)\s+by\s+', re.IGNORECASE)
+_ORDER_BY = re.compile(r'\s+order\s+by\s+.*$', re.IGNORECASE | re.DOTALL)
+_SELECT = re.compile(r'^\s*select\s+.*?\s+from\s+', re.IGNORECASE | re.DOTALL)
+
+RangeValue = Union[int, datetime]
+
+OFFSET_LIMIT = 10000  # offset + count of a LIMIT can't be more than this
+
+
+def split_limit(query: str) -> Tuple[str, int, Optional[int]]:
+    """ The query without its LIMIT clause, the offset and the count it asked for (None when there was no LIMIT)."""
+    query = query.strip().rstrip(';')
+    match = _LIMIT.search(query)
+    if not match:
+        return query, 0, None
+    if match.group(2) is None:
+        return query[:match.start()], 0, int(match.group(1))
+    return query[:match.start()], int(match.group(1)), int(match.group(2))
+
+
+def add_condition(query: str, condition: str) -> str:
+    """ The query (without a LIMIT) restricted to records which also meet condition."""
+    where = _WHERE.search(query)
+    if where is None:
+        after = _AFTER_WHERE.search(query)
+        position = after.start() if after else len(query)
+        return f'{query[:position]} where {condition}{query[position:]}'
+    after = _AFTER_WHERE.search(query, where.end())
+    end = after.start() if after else len(query)
+    return f'{query[:where.end()]}({condition}) and ({query[where.end():end]}){query[end:]}'
+
+
+def ensure_order(query: str, field: str = 'id') -> str:
+    """ Offsets only mean something when the order is fixed, so order by field unless the query has an order."""
+    if has_order(query):
+        return query
+    return f'{query} order by {field} asc'
+
+
+def has_order(query: str) -> bool:
+    return bool(_ORDER_BY.search(query))
+
+
+def query_after(query: str, last_id) -> str:
+    """ The query (without a LIMIT) restricted to the ids after last_id, ordered by id, so that paging can start
+    again from offset 0 rather than pass OFFSET_LIMIT. Only a query without an ORDER BY of its own can be restarted."""
+    if has_order(query) or last_id is None:
+        raise RuntimeError(f"A COQL query can't page past offset {OFFSET_LIMIT} unless it is ordered by id "
+                           f"(leave out the ORDER BY, or use windows): {query}")
+    return ensure_order(add_condition(query, f'id > {last_id}'))
+
+
+def page_query(query: str, offset: int, count: int) -> str:
+    return f'{query} limit {offset}, {count}'
+
+
+def extreme_query(query: str, field: str, descending: bool = False) -> str:
+    """ A query for the lowest (or highest) value of field among the records the query (without a LIMIT) selects."""
+    query = _ORDER_BY.sub('', _SELECT.sub(f'select {field} from ', query, count=1))
+    return f"{query} order by {field} {'desc' if descending else 'asc'} limit 1"
+
+
+def range_value(value) -> RangeValue:
+    """ A field value as returned by Zoho, as something ranges can be cut from: ids are integers, times datetimes."""
+    if isinstance(value, (int, datetime)):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+
+def literal(value: RangeValue) -> str:
+    """ A value as written in a COQL condition."""
+    if isinstance(value, datetime):
+        return f"'{value.isoformat(timespec='seconds')}'"
+    return str(value)
+
+
+def range_condition(field: str, start: RangeValue, end: RangeValue, include_end: bool = False) -> str:
+    return f"{field} >= {literal(start)} and {field} {'<=' if include_end else '<'} {literal(end)}"
+
+
+def range_starts(low: RangeValue, high: RangeValue, windows: int) -> List[RangeValue]:
+    """ The starts of up to windows ranges of about the same width which together cover low..high."""
+    if isinstance(low, datetime):
+        step = (high - low) / windows
+        starts = [(low + step * i).replace(microsecond=0) for i in range(windows)]
+    else:
+        starts = [low + (high - low + 1) * i // windows for i in range(windows)]
+    return sorted(set(starts))
+
+
+def range_conditions(field: str, low: RangeValue, high: RangeValue, windows: int) -> List[str]:
+    """ Conditions splitting low..high (inclusive) into up to windows disjoint ranges of about the same width."""
+    starts = range_starts(low, high, windows)
+    ends = starts[1:] + [high]
+    return [range_condition(field, start, end, include_end=i == len(starts) - 1)
+            for i, (start, end) in enumerate(zip(starts, ends))]
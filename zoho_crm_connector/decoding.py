@@ -0,0 +1,155 @@
+"""
+zoho_crm_connector.decoding
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Faster JSON decoding of Zoho responses.
+
+Response bodies are decoded straight from bytes by the fastest decoder installed: orjson, then msgspec, then the
+standard library's json. Zoho_crm(json_decoder=...) picks one by name ('orjson', 'msgspec' or 'json'),
+or takes any function from bytes to Python objects. pip install zoho_crm_connector[fast] installs orjson.
+
+PageParser decodes a page while it downloads. It is fed the body a chunk at a time and returns each record of the
+page's data array as soon as the record is complete, decoded on its own; the rest of the body (info, with
+more_records) is decoded at the end. Zoho_crm.iter_records(..., incremental=True) reads pages this way, so records
+are processed while the rest of the page is still arriving, and a page is never held whole as text or as dicts.
+"""
+
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+Decoder = Callable[[bytes], Any]
+
+DECODERS = {'json': json.loads}  # type: Dict[str, Decoder]
+try:
+    import orjson
+
+    DECODERS['orjson'] = orjson.loads
+except ImportError:  # pragma: no cover
+    pass
+try:
+    import msgspec
+
+    DECODERS['msgspec'] = msgspec.json.Decoder().decode
+except ImportError:  # pragma: no cover
+    pass
+
+PREFERRED_DECODERS = ('orjson', 'msgspec', 'json')
+
+# a string (possibly cut off at the end of the buffer), or a bracket
+_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*(?:(")|\\?\Z)|[{}\[\]]')
+_QUOTE = ord('"')
+
+
+def get_decoder(decoder: Union[str, Decoder] = None) -> Decoder:
+    """ The decoder named, or the fastest installed if decoder is None; a function is returned as it is."""
+    if callable(decoder):
+        return decoder
+    if decoder is None:
+        return next(DECODERS[name] for name in PREFERRED_DECODERS if name in DECODERS)
+    if decoder not in DECODERS:
+        raise RuntimeError(f"JSON decoder {decoder} is not installed; available: {', '.join(DECODERS)}")
+    return DECODERS[decoder]
+
+
+class PageParser:
+    """ Parses a JSON object with a "data" array incrementally. Not thread-safe; use one per response.
+
+    feed() each chunk of the body and get back the data records completed by it; then finish() returns the rest
+    of the object, with "data" as an empty list. has_data says whether there was a data array."""
+
+    def __init__(self, decode: Decoder = None):
+        self.decode = decode or get_decoder()
+        self.has_data = False
+        self._buffer = b''
+        self._position = 0  # where scanning resumes in the buffer
+        self._depth = 0  # of brackets: in the body until the data array starts, then inside the array
+        self._state = 'head'  # 'head' until the data array starts, 'data' inside it, then 'tail'
+        self._after_data_key = False
+        self._head = b''  # the body up to the data array
+        self._record_start = None  # type: Optional[int]
+
+    def feed(self, chunk: bytes) -> List[dict]:
+        self._buffer += chunk
+        if self._state == 'head':
+            self._find_data()
+        if self._state != 'data':
+            return []
+        records = self._read_records()
+        if self._state == 'data':  # drop what has been parsed, keeping any record still arriving
+            keep = self._record_start if self._record_start is not None else self._position
+            self._buffer = self._buffer[keep:]
+            self._position -= keep
+            if self._record_start is not None:
+                self._record_start = 0
+        return records
+
+    def _find_data(self):
+        """ Scan tokens for a "data" key with an array value, at the top level."""
+        buffer = self._buffer
+        while True:
+            match = _TOKEN.search(buffer, self._position)
+            if match is None:
+                self._position = len(buffer)
+                return
+            token = match.group()
+            if token[0] == _QUOTE:
+                if match.group(1) is None:  # the string continues in the next chunk
+                    self._position = match.start()
+                    return
+                self._after_data_key = self._depth == 1 and token == b'"data"'
+            elif token == b'[' and self._after_data_key:
+                self._state, self.has_data = 'data', True
+                self._head = buffer[:match.start()]
+                self._position = match.end()
+                self._depth = 0  # from here, the depth inside the data array
+                return
+            else:
+                self._depth += 1 if token in (b'{', b'[') else -1
+                self._after_data_key = False
+            self._position = match.end()
+
+    def _read_records(self) -> List[dict]:
+        """ Scan the data array token by token, keeping the bracket depth inside it, and decode each record once,
+        when the brace closing it brings the depth back to the array's. Strings are matched whole, so brackets in them
+        are passed over, and each byte is scanned once however deeply records nest (subforms, line items, tags)."""
+        records = []
+        buffer = self._buffer
+        while True:
+            match = _TOKEN.search(buffer, self._position)
+            if match is None:
+                self._position = len(buffer)
+                return records
+            token = match.group()
+            if token[0] == _QUOTE:
+                if match.group(1) is None:  # the string continues in the next chunk
+                    self._position = match.start()
+                    return records
+            elif token in (b'{', b'['):
+                if self._depth == 0:
+                    self._record_start = match.start()
+                self._depth += 1
+            elif self._depth == 0:  # the end of the data array
+                self._state = 'tail'
+                self._buffer = buffer[match.end():]
+                return records
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    records.append(self.decode(buffer[self._record_start:match.end()]))
+                    self._record_start = None
+            self._position = match.end()
+
+    def finish(self) -> dict:
+        """ The object without its data records; call after the last chunk has been fed."""
+        if self._state == 'tail':
+            return self.decode(self._head + b'[]' + self._buffer)
+        if self._state == 'data':
+            raise ValueError("The JSON body ended inside its data array")
+        return self.decode(self._buffer) if self._buffer.strip() else {}
+
+
+def iter_page_records(chunks: Iterable[bytes], parser: PageParser) -> Iterator[dict]:
+    """ The records of a page's data array, decoded as the chunks arrive. Call parser.finish() afterwards."""
+    for chunk in chunks:
+        yield from parser.feed(chunk)
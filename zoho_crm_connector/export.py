@@ -0,0 +1,145 @@
+"""
+zoho_crm_connector.export
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Exporting a whole module quickly, by fetching disjoint slices of it at once.
+
+A scan with yield_page_from_module makes one call after another, and most of its time is spent waiting for Zoho.
+Zoho_crm.export_module splits the module into slices, fetches them concurrently and yields one stream of records:
+
+    for record in zoho_crm.export_module('Leads', partitions=16, workers=8):
+        ...
+
+By default the slices are ranges of Modified_Time (or of another datetime field, such as Created_Time, given as
+partition_by). The earliest and latest times are found with COQL, the time between them is cut into partitions
+slices, and each slice is counted with a COQL COUNT probe. Slices holding more records than a search can page through
+are halved until they fit, and empty slices are dropped. Each slice is then fetched with a search on its time range.
+
+With partition_by='id', the module's id range is cut and counted the same way, into ranges small enough for COQL to
+page through without passing its offset limit. Their ids are read with COQL, and the records are fetched 100 ids at a
+time through the list endpoint.
+
+The last slice has no upper end, so records modified (or, by id, created) after the export starts are fetched too,
+as long as that slice hasn't been read yet. Records arrive in no particular order. A record modified during the export
+can move from one time slice to another, so records are de-duplicated by id; the ids already yielded are kept in
+memory. A failed probe or page raises, rather than leaving records out.
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Generator, Iterable, List, NamedTuple, Tuple
+
+from .coql import OFFSET_LIMIT, RangeValue, add_condition, literal, range_condition, range_starts
+
+logger = logging.getLogger()
+
+SEARCH_LIMIT = 2000  # records one search can page through
+
+
+class TimeSlice(NamedTuple):
+    start: datetime
+    end: datetime
+    open_ended: bool  # only the last slice, which has no upper end; end is the latest time when the export started
+    count: int
+
+    def criteria(self, field: str) -> str:
+        """ Search criteria for the slice. between includes both ends, so a slice ends a second before the next."""
+        if self.open_ended:
+            return f"({field}:greater_equal:{self.start.isoformat(timespec='seconds')})"
+        end = self.end - timedelta(seconds=1)
+        return f"({field}:between:{self.start.isoformat(timespec='seconds')},{end.isoformat(timespec='seconds')})"
+
+
+def count_records(zoho_crm: 'Zoho_crm', module_name: str, condition: str) -> int:
+    """ How many records of the module meet a COQL condition. A failed probe raises."""
+    r_json = zoho_crm._coql_query(f'select COUNT(id) from {module_name} where {condition}')
+    if r_json is None:  # no content
+        return 0
+    if not r_json.get('data'):
+        raise RuntimeError(f"COQL returned no count of {module_name} records where {condition}: {r_json}")
+    return int(next(iter(r_json['data'][0].values())))
+
+
+def _condition(field: str, start: RangeValue, end: RangeValue, open_ended: bool) -> str:
+    return f'{field} >= {literal(start)}' if open_ended else range_condition(field, start, end)
+
+
+def _middle(start: RangeValue, end: RangeValue) -> RangeValue:
+    if isinstance(start, datetime):
+        return (start + (end - start) / 2).replace(microsecond=0)
+    return start + (end - start) // 2
+
+
+def counted_ranges(zoho_crm: 'Zoho_crm', module_name: str, field: str, low: RangeValue, high: RangeValue,
+                   partitions: int, max_count: int) -> List[Tuple[RangeValue, RangeValue, bool, int]]:
+    """ Disjoint ranges (start, end, open_ended, count) of field which together hold every record from low on; the last
+    is open ended. Ranges holding more than max_count records are halved until they fit, unless they can't be
+    halved any more, and empty ranges are dropped. Counts are probed concurrently."""
+    starts = range_starts(low, high, partitions)
+    ranges = [(start, end, False) for start, end in zip(starts, starts[1:])] + [(starts[-1], high, True)]
+    counted = []
+    while ranges:
+        counts = zoho_crm.map(lambda r: count_records(zoho_crm, module_name, _condition(field, *r)), ranges)
+        halved = []
+        for (start, end, open_ended), count in zip(ranges, counts):
+            middle = _middle(start, end)
+            if count > max_count and middle > start:
+                halved.extend([(start, middle, False), (middle, end, open_ended)])
+            elif count:
+                if count > max_count:
+                    logger.warning(f"{count} {module_name} records have {field} {start}; they can't all be fetched")
+                counted.append((start, end, open_ended, count))
+        ranges = halved
+    return sorted(counted)
+
+
+def time_slices(zoho_crm: 'Zoho_crm', module_name: str, field: str, partitions: int,
+                max_count: int = SEARCH_LIMIT) -> List[TimeSlice]:
+    """ Disjoint ranges of a datetime field which together hold every record with a value, none more than max_count
+    unless more than max_count records share one second. Counts are probed concurrently."""
+    bounds = zoho_crm._coql_bounds(f'select {field} from {module_name} where {field} is not null', field)
+    if bounds is None:
+        return []
+    return [TimeSlice(*counted) for counted in counted_ranges(zoho_crm, module_name, field, *bounds,
+                                                               partitions=partitions, max_count=max_count)]
+
+
+def _id_range_streams(zoho_crm: 'Zoho_crm', module_name: str, partitions: int,
+                      fields: List[str]) -> List[Callable[[], Iterable[List[dict]]]]:
+    """ A stream of pages for each id range, sized so that COQL pages through it without passing OFFSET_LIMIT."""
+    query = f'select id from {module_name} where id is not null'
+
+    def stream(condition: str) -> Generator[List[dict], None, None]:
+        for page in zoho_crm._yield_coql_query_pages(add_condition(query, condition), 0, None,
+                                                     zoho_crm._coql_page_size()):
+            ids = [record['id'] for record in page]
+            for i in range(0, len(ids), 100):
+                yield zoho_crm.get_records_by_ids(module_name, ids[i:i + 100], fields=fields)
+
+    bounds = zoho_crm._coql_bounds(query, 'id')
+    if bounds is None:
+        return []
+    ranges = counted_ranges(zoho_crm, module_name, 'id', *bounds, partitions=partitions, max_count=OFFSET_LIMIT)
+    return [lambda condition=_condition('id', start, end, open_ended): stream(condition)
+            for start, end, open_ended, count in ranges]
+
+
+def export_module(zoho_crm: 'Zoho_crm', module_name: str, partitions: int = 8, workers: int = None,
+                  partition_by: str = 'Modified_Time', fields: List[str] = None) -> Generator[dict, None, None]:
+    """ Every record of a module, fetched in partitions slices by up to workers workers. See Zoho_crm.export_module."""
+    if partition_by == 'id':
+        streams = _id_range_streams(zoho_crm, module_name, partitions, fields)
+    else:
+        slices = time_slices(zoho_crm, module_name, partition_by, partitions)
+        logger.info(f"Exporting {sum(s.count for s in slices)} {module_name} records in {len(slices)} slices")
+        streams = [lambda criteria=time_slice.criteria(partition_by):
+                   zoho_crm.yield_page_from_module(module_name=module_name, criteria=criteria, fields=fields)
+                   for time_slice in slices]
+    if not streams:
+        return
+    seen = set()
+    for page in zoho_crm._yield_concurrently(streams, workers=workers or min(len(streams), zoho_crm.max_workers)):
+        for record in page:
+            if record['id'] not in seen:
+                seen.add(record['id'])
+                yield record
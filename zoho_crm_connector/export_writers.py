@@ -0,0 +1,273 @@
+"""
+zoho_crm_connector.export_writers
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Write a stream of records to CSV, Parquet or an Arrow IPC file, one row group at a time.
+
+Records can come from any of the connector's iterators: iter_records, export_module, iter_coql_records,
+or BulkRead.yield_records. Only row_group_size rows are held in memory at once, so a module of any size
+can be written:
+
+    columns = export_columns(zoho_crm.metadata, 'Deals')
+    with ParquetExportWriter(Path('deals.parquet'), columns) as writer:
+        writer.write_records(zoho_crm.export_module('Deals'))
+
+Columns, and their types, come from the module's field metadata. A lookup (a {'name': ..., 'id': ...} object,
+or just an id in bulk read results) becomes two columns, <field>_name and <field>_id; multi-select values are joined
+with ';'. Fields a record has but the columns don't are left out.
+
+CSV needs nothing extra. Parquet and Arrow need pyarrow: pip install zoho_crm_connector[arrow]
+"""
+
+import csv
+import json
+import logging
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timezone
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, NamedTuple, Optional
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover
+    pyarrow = None
+
+logger = logging.getLogger()
+
+DEFAULT_ROW_GROUP_SIZE = 10000
+
+INTEGER_TYPES = ('integer', 'bigint')
+FLOAT_TYPES = ('double', 'percent')
+DECIMAL_TYPES = ('currency', 'decimal')
+LOOKUP_TYPES = ('lookup', 'ownerlookup', 'userlookup')
+MULTI_VALUE_TYPES = ('multiselectpicklist', 'multiselectlookup')
+
+
+class Column(NamedTuple):
+    name: str  # the column name
+    field: str  # the api name of the field it comes from
+    data_type: str  # Zoho's data_type, or 'text'
+    part: Optional[str] = None  # 'name' or 'id', for the two columns of a lookup
+    scale: int = 2  # decimal places, for currency and decimal fields
+
+
+def export_columns(metadata: 'ModuleMetadata', module_name: str, fields: List[str] = None) -> List[Column]:
+    """ The columns for a module's records: id, then each field (or each of fields) in metadata order."""
+    by_name = {field['api_name']: field for field in metadata.fields(module_name)}
+    columns = [Column('id', 'id', 'text')]
+    for api_name in fields or list(by_name):
+        if api_name == 'id':
+            continue
+        field = by_name.get(api_name, {})
+        data_type = field.get('data_type') or 'text'
+        if data_type in LOOKUP_TYPES:
+            columns.append(Column(f'{api_name}_name', api_name, data_type, part='name'))
+            columns.append(Column(f'{api_name}_id', api_name, data_type, part='id'))
+        else:
+            scale = field.get('decimal_place')
+            columns.append(Column(api_name, api_name, data_type, scale=int(scale) if scale is not None else 2))
+    return columns
+
+
+def _datetime(value) -> datetime:
+    value = value if isinstance(value, datetime) else datetime.fromisoformat(value)
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def _text(value) -> str:
+    return value if isinstance(value, str) else json.dumps(value)
+
+
+def _converter(column: Column) -> Callable[[Any], Any]:
+    """ A function from a field's value to the column's value. Empty values become None."""
+    data_type = column.data_type
+    if data_type in LOOKUP_TYPES:
+        if column.part == 'name':
+            return lambda value: value.get('name') if isinstance(value, dict) else None
+        return lambda value: str(value.get('id')) if isinstance(value, dict) else str(value)
+    if data_type in INTEGER_TYPES:
+        return int
+    if data_type in FLOAT_TYPES:
+        return float
+    if data_type in DECIMAL_TYPES:
+        exponent = Decimal(1).scaleb(-column.scale)
+        return lambda value: Decimal(str(value)).quantize(exponent)
+    if data_type == 'boolean':
+        return lambda value: value if isinstance(value, bool) else str(value).lower() == 'true'
+    if data_type == 'date':
+        return lambda value: value if isinstance(value, date) else date.fromisoformat(value)
+    if data_type == 'datetime':
+        return _datetime
+    if data_type in MULTI_VALUE_TYPES:
+        return lambda value: ';'.join(_text(v) for v in value) if isinstance(value, list) else _text(value)
+    return _text
+
+
+def arrow_type(column: Column) -> 'pyarrow.DataType':
+    if column.part is None and column.data_type in INTEGER_TYPES:
+        return pyarrow.int64()
+    if column.part is None and column.data_type in FLOAT_TYPES:
+        return pyarrow.float64()
+    if column.part is None and column.data_type in DECIMAL_TYPES:
+        return pyarrow.decimal128(38, column.scale)
+    if column.data_type == 'boolean':
+        return pyarrow.bool_()
+    if column.data_type == 'date':
+        return pyarrow.date32()
+    if column.data_type == 'datetime':
+        return pyarrow.timestamp('s', tz='UTC')
+    return pyarrow.string()
+
+
+class ExportWriter(ABC):
+    """ Buffers flattened rows a column at a time, and writes them out every row_group_size rows.
+    Subclasses write a row group in their format. Use as a context manager, or call close()."""
+
+    def __init__(self, path: Path, columns: List[Column], row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        self.path = Path(path)
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+        self._converters = [_converter(column) for column in columns]
+        self._buffer = [[] for _ in columns]  # type: List[List[Any]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _convert(self, column: Column, convert: Callable[[Any], Any], value):
+        if value is None or value == '':
+            return None
+        try:
+            return convert(value)
+        except (ValueError, TypeError, InvalidOperation):
+            logger.warning(f"Can't convert {value!r} for {column.data_type} column {column.name}; writing null")
+            return None
+
+    def write_record(self, record: dict):
+        for column, convert, values in zip(self.columns, self._converters, self._buffer):
+            values.append(self._convert(column, convert, record.get(column.field)))
+        if len(self._buffer[0]) >= self.row_group_size:
+            self.flush()
+
+    def write_records(self, records: Iterable[dict]) -> int:
+        """ Write every record; returns how many were written."""
+        count = 0
+        for record in records:
+            self.write_record(record)
+            count += 1
+        return count
+
+    def write_pages(self, pages: Iterable[List[dict]]) -> int:
+        """ Write every record of every page, as yielded by yield_page_from_module and the like."""
+        return self.write_records(record for page in pages for record in page)
+
+    def flush(self):
+        """ Write the buffered rows as a row group."""
+        if self._buffer[0]:
+            self._write_row_group(self._buffer)
+            self.rows_written += len(self._buffer[0])
+            self._buffer = [[] for _ in self.columns]
+
+    @abstractmethod
+    def _write_row_group(self, columns: List[List[Any]]):
+        """ Write one row group, given as a list of values per column."""
+
+    def close(self):
+        self.flush()
+
+
+class CSVExportWriter(ExportWriter):
+    """ A CSV file with a header row. Datetimes are written in ISO 8601, in UTC; nulls as empty values."""
+
+    def __init__(self, path: Path, columns: List[Column], row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        super().__init__(path, columns, row_group_size)
+        self._file = self.path.open('w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([column.name for column in columns])
+
+    def _write_row_group(self, columns: List[List[Any]]):
+        self._writer.writerows(zip(*([self._csv_value(v) for v in values] for values in columns)))
+
+    @staticmethod
+    def _csv_value(value):
+        if value is None:
+            return ''
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        return value
+
+    def close(self):
+        super().close()
+        self._file.close()
+
+
+class _ArrowExportWriter(ExportWriter):
+    def __init__(self, path: Path, columns: List[Column], row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        if pyarrow is None:
+            raise RuntimeError(f"{type(self).__name__} needs pyarrow: pip install zoho_crm_connector[arrow]")
+        super().__init__(path, columns, row_group_size)
+        self.schema = pyarrow.schema([(column.name, arrow_type(column)) for column in columns])
+
+    def _record_batch(self, columns: List[List[Any]]) -> 'pyarrow.RecordBatch':
+        return pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array(values, type=field.type) for values, field in zip(columns, self.schema)],
+            schema=self.schema)
+
+
+class ParquetExportWriter(_ArrowExportWriter):
+    """ A Parquet file, one Parquet row group per row group."""
+
+    def __init__(self, path: Path, columns: List[Column], row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+                 compression: str = 'snappy'):
+        super().__init__(path, columns, row_group_size)
+        self._writer = pyarrow.parquet.ParquetWriter(str(self.path), self.schema, compression=compression)
+
+    def _write_row_group(self, columns: List[List[Any]]):
+        self._writer.write_table(pyarrow.Table.from_batches([self._record_batch(columns)]))
+
+    def close(self):
+        super().close()
+        self._writer.close()
+
+
+class ArrowExportWriter(_ArrowExportWriter):
+    """ An Arrow IPC file (Feather v2), one record batch per row group."""
+
+    def __init__(self, path: Path, columns: List[Column], row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        super().__init__(path, columns, row_group_size)
+        self._sink = pyarrow.OSFile(str(self.path), 'wb')
+        self._writer = pyarrow.ipc.new_file(self._sink, self.schema)
+
+    def _write_row_group(self, columns: List[List[Any]]):
+        self._writer.write_batch(self._record_batch(columns))
+
+    def close(self):
+        super().close()
+        self._writer.close()
+        self._sink.close()
+
+
+WRITERS = {'csv': CSVExportWriter, 'parquet': ParquetExportWriter, 'arrow': ArrowExportWriter}
+
+
+def write_module(zoho_crm: 'Zoho_crm', module_name: str, path: Path, format: str = 'parquet',
+                 records: Iterable[dict] = None, fields: List[str] = None,
+                 row_group_size: int = DEFAULT_ROW_GROUP_SIZE) -> int:
+    """ Write a module's records to a file in format ('csv', 'parquet' or 'arrow'), with columns from its metadata.
+    records defaults to iter_records over the whole module; pass export_module(...) or a bulk read to go faster.
+    Returns how many records were written."""
+    if format not in WRITERS:
+        raise ValueError(f"format must be one of {', '.join(WRITERS)}, not {format}")
+    columns = export_columns(zoho_crm.metadata, module_name, fields=fields)
+    if records is None:
+        records = zoho_crm.iter_records(module_name=module_name, fields=fields)
+    with WRITERS[format](path, columns, row_group_size=row_group_size) as writer:
+        return writer.write_records(records)
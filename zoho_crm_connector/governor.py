@@ -0,0 +1,194 @@
+"""
+zoho_crm_connector.governor
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Client-side pacing of Zoho CRM API calls.
+
+Zoho charges API credits per call, against an allowance for a rolling 24 hours, and limits how many calls an org can
+have in flight at once according to its edition. Once the allowance is spent every call fails with a 429 until the
+window rolls on, which waiting a minute does not fix. A CreditGovernor spreads a job's calls over the window instead:
+
+    governor = CreditGovernor(credits_per_window=50000, max_concurrency=CreditGovernor.EDITION_CONCURRENCY['PROFESSIONAL'])
+    zoho_crm = Zoho_crm(..., governor=governor)
+
+It has three parts:
+- a token bucket holding up to burst credits, refilled at credits_per_window / window_seconds credits a second;
+  a call waits until the bucket holds its cost
+- a semaphore limiting calls in flight to max_concurrency
+- credit weights per endpoint (a search costs 1 credit, a write 1 credit per 10 records, a bulk read job 50, ...)
+
+Zoho's rate-limit response headers (X-RATELIMIT-LIMIT, X-RATELIMIT-REMAINING, X-RATELIMIT-RESET) correct the bucket
+as calls are made, and a 429 empties it, so that every thread sharing the governor backs off together.
+One governor can be shared by several Zoho_crm clients for the same org.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+
+logger = logging.getLogger()
+
+# (method, endpoint template): (credits per call, records per credit), where records per credit is 0 for a flat cost.
+# Endpoint templates are the ones Zoho_crm._send is called with; see https://www.zoho.com/crm/developer/docs/api/v2/api-limits.html
+DEFAULT_WEIGHTS = {
+    ('GET', '{module}'): (1, 0),
+    ('GET', '{module}/search'): (1, 0),
+    ('GET', '{module}/{id}'): (1, 0),
+    ('GET', '{module}/deleted'): (1, 0),
+    ('GET', '{module}/{id}/{related_module}'): (1, 0),
+    ('POST', '{module}'): (1, 10),
+    ('PUT', '{module}'): (1, 10),
+    ('DELETE', '{module}'): (1, 10),
+    ('POST', '{module}/upsert'): (1, 10),
+    ('POST', 'coql'): (1, 0),  # more for larger LIMITs, see estimate_cost
+    ('GET', 'users'): (1, 0),
+    ('GET', 'settings/fields'): (1, 0),
+    ('GET', 'settings/modules'): (1, 0),
+    ('GET', 'settings/layouts'): (1, 0),
+    ('GET', 'org'): (1, 0),
+    ('POST', 'bulk/read'): (50, 0),
+    ('POST', 'bulk/write'): (500, 0),
+    ('POST', 'upload'): (0, 0),
+    ('GET', 'bulk/read/{id}'): (0, 0),
+    ('GET', 'bulk/write/{id}'): (0, 0),
+    ('GET', 'bulk/download'): (0, 0),
+}  # type: Dict[Tuple[str, str], Tuple[float, int]]
+
+_COQL_LIMIT = re.compile(r'\blimit\s+(?:\d+\s*,\s*)?(\d+)', re.IGNORECASE)
+
+
+def estimate_cost(method: str, endpoint: str = None, json: dict = None, params=None,
+                  weights: Mapping[Tuple[str, str], Tuple[float, int]] = None, default_cost: float = 1) -> float:
+    """ The estimated credit cost of a call. json and params are the request's, used to count records written.
+    COQL costs 1 credit for up to 200 records, 2 for up to 1000 and 3 for up to 2000."""
+    method = method.upper()
+    if method == 'POST' and endpoint == 'coql':
+        match = _COQL_LIMIT.search((json or {}).get('select_query', ''))
+        limit = int(match.group(1)) if match else 200
+        return 1 if limit <= 200 else 2 if limit <= 1000 else 3
+    credits, records_per_credit = (weights or DEFAULT_WEIGHTS).get((method, endpoint), (default_cost, 0))
+    if not records_per_credit:
+        return credits
+    if json and isinstance(json.get('data'), list):
+        records = len(json['data'])
+    elif isinstance(params, dict) and params.get('ids'):
+        records = len(str(params['ids']).split(','))
+    else:
+        records = 1
+    return credits * max(1, math.ceil(records / records_per_credit))
+
+
+class CreditGovernor:
+    """ Paces API calls to a credit budget and a concurrency limit. Thread-safe.
+
+    credits_per_window: the credits to spend per window_seconds, or None to leave credits unpaced (the rate-limit
+        headers and 429s are still obeyed). Set it below the org's allowance to leave room for other integrations.
+    burst: the most credits that can be spent at once after a quiet spell; by default a minute's worth, and at least
+        the cost of the largest call.
+    max_concurrency: the most calls in flight at once, or None for no limit. See EDITION_CONCURRENCY.
+    weights: overrides of DEFAULT_WEIGHTS. Calls to unknown endpoints cost default_cost.
+    cooldown: seconds to hold all calls after a 429 which doesn't say when to retry.
+    """
+
+    EDITION_CONCURRENCY = {'FREE': 5, 'STANDARD': 10, 'PROFESSIONAL': 15, 'ENTERPRISE': 20, 'ULTIMATE': 25}
+
+    def __init__(self, credits_per_window: float = None, window_seconds: float = 24 * 60 * 60,
+                 burst: float = None, max_concurrency: int = None,
+                 weights: Mapping[Tuple[str, str], Tuple[float, int]] = None, default_cost: float = 1,
+                 cooldown: float = 60):
+        self.weights = dict(DEFAULT_WEIGHTS)
+        self.weights.update(weights or {})
+        self.default_cost = default_cost
+        self.credits_per_window = credits_per_window
+        self.window_seconds = window_seconds
+        self.rate = credits_per_window / window_seconds if credits_per_window else None  # credits per second
+        largest_cost = max(credits for credits, _ in self.weights.values())
+        self.burst = burst if burst is not None else max(self.rate * 60 if self.rate else 0, largest_cost)
+        self.max_concurrency = max_concurrency
+        self.cooldown = cooldown
+        self._semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._condition = threading.Condition()
+        self._credits = self.burst  # type: float
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0  # time.monotonic() before which no calls are made
+        self.server_limit = None  # type: Optional[int]
+        self.server_remaining = None  # type: Optional[int]
+        self.credits_spent = 0.0
+
+    def cost(self, method: str, endpoint: str = None, json: dict = None, params=None) -> float:
+        """ The estimated credit cost of a call, using this governor's weights."""
+        return estimate_cost(method, endpoint, json=json, params=params, weights=self.weights,
+                             default_cost=self.default_cost)
+
+    def _refill(self, now: float):
+        if self.rate:
+            self._credits = min(self.burst, self._credits + (now - self._refilled_at) * self.rate)
+        else:
+            self._credits = self.burst
+        self._refilled_at = now
+
+    def acquire(self, credits: float):
+        """ Wait until credits can be spent, then spend them."""
+        credits = min(credits, self.burst)  # a call dearer than the bucket waits for a full bucket
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._credits >= credits:
+                    self._credits -= credits
+                    self.credits_spent += credits
+                    return
+                else:
+                    wait = (credits - self._credits) / self.rate
+                logger.debug(f"Waiting {wait:.2f}s for {credits} API credits")
+                self._condition.wait(timeout=wait)
+
+    @contextmanager
+    def slot(self, credits: float) -> Iterator[None]:
+        """ Spend credits, then hold a concurrency slot for the duration of the call."""
+        self.acquire(credits)
+        if self._semaphore is None:
+            yield
+            return
+        with self._semaphore:
+            yield
+
+    def update_from_response(self, status_code: int, headers: Mapping[str, str]):
+        """ Correct the bucket from a response: its rate-limit headers, and whether it was a 429."""
+        with self._condition:
+            limit, remaining = headers.get('X-RATELIMIT-LIMIT'), headers.get('X-RATELIMIT-REMAINING')
+            reset_in = self._seconds_until_reset(headers.get('X-RATELIMIT-RESET'))
+            if limit is not None and remaining is not None:
+                self.server_limit, self.server_remaining = int(limit), int(remaining)
+                self._credits = min(self._credits, self.server_remaining)
+                if self.server_remaining <= 0 and reset_in:
+                    self._block(reset_in)
+            if status_code == 429:
+                retry_after = headers.get('Retry-After')
+                wait = reset_in or (float(retry_after) if retry_after and retry_after.isdigit() else self.cooldown)
+                logger.warning(f"Zoho API limit reached (429); holding calls for {wait:.0f}s")
+                self._credits = 0
+                self._block(wait)
+            self._condition.notify_all()
+
+    def _block(self, seconds: float):
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    @staticmethod
+    def _seconds_until_reset(reset: Optional[str]) -> Optional[float]:
+        """ X-RATELIMIT-RESET is a time since the epoch, in milliseconds (or seconds)."""
+        if not reset:
+            return None
+        try:
+            reset_at = float(reset)
+        except ValueError:
+            return None
+        if reset_at > 1e11:
+            reset_at /= 1000
+        return max(0.0, reset_at - time.time())
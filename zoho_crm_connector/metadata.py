@@ -0,0 +1,198 @@
+"""
+zoho_crm_connector.metadata
+~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Cached Zoho CRM metadata: the module list, and each module's fields and layouts.
+
+Metadata rarely changes, but fetching it costs a call (and an API credit) every time. Zoho_crm.metadata answers
+from a cache instead, fetching each item only when it is missing or older than the cache's ttl:
+
+    for field in zoho_crm.metadata.fields('Deals'):
+        ...
+    zoho_crm.metadata.data_types('Deals')  # {'Amount': 'currency', 'Closing_Date': 'date', ...}
+    zoho_crm.metadata.picklists('Deals')   # {'Stage': ['Qualification', ...], ...}
+
+There is one MetadataCache per org, shared by every Zoho_crm for that org in the process, and it is saved as a JSON
+file (in the token_file_dir, unless another cache_dir is given) so that it survives restarts.
+Call invalidate() after changing fields or layouts in Zoho.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .records import record_class
+
+logger = logging.getLogger()
+
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def org_key(base_url: str, client_id: str, refresh_token: str) -> str:
+    """ Identifies an org (or, strictly, a grant) without revealing the refresh token."""
+    return hashlib.sha256(f'{base_url}|{client_id}|{refresh_token}'.encode()).hexdigest()[:16]
+
+
+class MetadataCache:
+    """ Metadata for one org, kept in memory and optionally in a JSON file. Thread-safe.
+
+    get(key, fetch) returns the cached value, or calls fetch if there is none or it is older than ttl seconds.
+    Only one thread fetches a key at a time; the others wait and use what it fetched.
+    Use for_org to share one cache between clients."""
+
+    _registry = {}  # type: Dict[str, MetadataCache]
+    _registry_lock = threading.Lock()
+
+    def __init__(self, cache_path: Path = None, ttl: float = DEFAULT_TTL):
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._key_locks = {}  # type: Dict[str, threading.Lock]
+        self._entries = self._load()  # type: Dict[str, dict]
+
+    @classmethod
+    def for_org(cls, key: str, cache_dir: Path = None, ttl: float = DEFAULT_TTL) -> 'MetadataCache':
+        """ The cache for the org identified by key (see org_key), created the first time it is asked for."""
+        with cls._registry_lock:
+            if key not in cls._registry:
+                cache_path = Path(cache_dir) / f'zoho_metadata_{key}.json' if cache_dir else None
+                cls._registry[key] = cls(cache_path=cache_path, ttl=ttl)
+            return cls._registry[key]
+
+    def _load(self) -> Dict[str, dict]:
+        if self.cache_path is None:
+            return {}
+        try:
+            with self.cache_path.open() as cache_file:
+                return json.load(cache_file)
+        except (ValueError, FileNotFoundError, IOError):
+            return {}
+
+    def _save(self):
+        """ Replace the file atomically, so other processes never read half of it. Called with self._lock held."""
+        if self.cache_path is None:
+            return
+        handle, temp_path = tempfile.mkstemp(dir=str(self.cache_path.parent), prefix='.zoho_metadata')
+        try:
+            with os.fdopen(handle, 'w') as outfile:
+                json.dump(self._entries, outfile)
+            os.replace(temp_path, str(self.cache_path))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _fresh(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is not None and time.time() - entry['fetched_at'] < self.ttl:
+            return entry
+        return None
+
+    def get(self, key: str, fetch: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._fresh(key)
+            if entry is not None:
+                return entry['value']
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._fresh(key)  # another thread may have fetched it while we waited
+                if entry is not None:
+                    return entry['value']
+            logger.debug(f"Fetching Zoho metadata {key}")
+            value = fetch()
+            with self._lock:
+                self._entries[key] = {'fetched_at': time.time(), 'value': value}
+                self._save()
+            return value
+
+    def invalidate(self, key: str = None):
+        """ Forget one key, or everything."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._save()
+
+
+class ModuleMetadata:
+    """ Metadata read through a MetadataCache, fetched with a Zoho_crm when needed. This is Zoho_crm.metadata."""
+
+    def __init__(self, zoho_crm: 'Zoho_crm', cache: MetadataCache):
+        self.zoho_crm = zoho_crm
+        self.cache = cache
+        self._record_classes = {}  # type: Dict[Tuple[str, Tuple[str, ...]], Tuple[List[dict], type]]
+
+    def _fetch(self, path: str, endpoint: str, key: str) -> list:
+        r = self.zoho_crm._send('GET', self.zoho_crm.base_url + path, endpoint=endpoint)
+        r_json = self.zoho_crm._validate_response(r)
+        if not r.ok:
+            raise RuntimeError(f"did not receive valid data for {path}")
+        return (r_json or {}).get(key, [])
+
+    def modules(self) -> List[dict]:
+        """ The org's modules, as returned by settings/modules."""
+        return self.cache.get('modules', lambda: self._fetch('settings/modules', 'settings/modules', 'modules'))
+
+    def module_api_names(self) -> List[str]:
+        return [module['api_name'] for module in self.modules()]
+
+    def fields(self, module_name: str) -> List[dict]:
+        """ The module's fields, as returned by settings/fields."""
+        return self.cache.get(f'fields/{module_name}', lambda: self._fetch(
+            f'settings/fields?module={module_name}', 'settings/fields', 'fields'))
+
+    def field(self, module_name: str, api_name: str) -> Optional[dict]:
+        return next((field for field in self.fields(module_name) if field['api_name'] == api_name), None)
+
+    def field_api_names(self, module_name: str) -> List[str]:
+        return [field['api_name'] for field in self.fields(module_name)]
+
+    def data_types(self, module_name: str) -> Dict[str, str]:
+        """ api_name: data_type, for example {'Amount': 'currency', 'Account_Name': 'lookup'}"""
+        return {field['api_name']: field.get('data_type') for field in self.fields(module_name)}
+
+    def lookups(self, module_name: str) -> Dict[str, str]:
+        """ api_name: the api name of the module looked up, for each lookup field."""
+        result = {}
+        for field in self.fields(module_name):
+            module = (field.get('lookup') or {}).get('module')
+            if module:
+                result[field['api_name']] = module['api_name'] if isinstance(module, dict) else module
+        return result
+
+    def picklists(self, module_name: str) -> Dict[str, List[str]]:
+        """ api_name: the allowed values, for each picklist field."""
+        return {field['api_name']: [value.get('actual_value', value.get('display_value'))
+                                    for value in field['pick_list_values']]
+                for field in self.fields(module_name) if field.get('pick_list_values')}
+
+    def record_class(self, module_name: str, fields: List[str] = None) -> type:
+        """ The compact Record class (see records.py) for the module, or for just fields of it. A class is made again
+        only when the field metadata has been refetched."""
+        module_fields = self.fields(module_name)
+        key = (module_name, tuple(fields or ()))
+        made = self._record_classes.get(key)
+        if made is None or made[0] is not module_fields:
+            made = self._record_classes[key] = (module_fields, record_class(module_name, module_fields, fields))
+        return made[1]
+
+    def layouts(self, module_name: str) -> List[dict]:
+        """ The module's layouts, as returned by settings/layouts."""
+        return self.cache.get(f'layouts/{module_name}', lambda: self._fetch(
+            f'settings/layouts?module={module_name}', 'settings/layouts', 'layouts'))
+
+    def invalidate(self, module_name: str = None):
+        """ Forget a module's fields and layouts, or (with no module_name) all metadata."""
+        if module_name is None:
+            self.cache.invalidate()
+        else:
+            self.cache.invalidate(f'fields/{module_name}')
+            self.cache.invalidate(f'layouts/{module_name}')
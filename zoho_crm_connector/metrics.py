@@ -0,0 +1,126 @@
+"""
+zoho_crm_connector.metrics
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Request-level instrumentation.
+
+Zoho_crm calls each of its request hooks once for every API call, with a RequestEvent:
+
+    metrics = MetricsAggregator()
+    zoho_crm = Zoho_crm(..., request_hooks=[metrics])
+    ...
+    for (method, endpoint), summary in metrics.summary().items():
+        print(method, endpoint, summary['count'], summary['p99'], summary['credits'])
+
+Endpoints are url templates such as '{module}/search', so calls to different modules and records are counted together.
+A hook is any callable taking a RequestEvent; hooks run in the thread which made the call, so they should be quick,
+and exceptions they raise are logged and otherwise ignored.
+
+MetricsAggregator keeps counts, totals and latencies in memory, and can write them in the Prometheus text format.
+"""
+
+import math
+import threading
+from typing import Dict, List, NamedTuple, Tuple
+
+
+class RequestEvent(NamedTuple):
+    method: str
+    endpoint: str  # the url template, e.g. '{module}/search'
+    url: str
+    status: int
+    latency: float  # seconds, including any retries and token refreshes
+    bytes_out: int  # request body
+    bytes_in: int  # response body (its Content-Length, for streamed downloads)
+    retries: int  # retries made by the session's retry policy
+    token_refreshes: int  # new access tokens fetched by this call
+    credits: float  # estimated API credit cost
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    """ Nearest-rank percentile. """
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class MetricsAggregator:
+    """ A request hook which aggregates events per (method, endpoint). Thread-safe.
+
+    Latencies are kept for percentiles, up to max_samples per endpoint (the oldest are dropped)."""
+
+    PERCENTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))
+
+    def __init__(self, max_samples: int = 10000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._totals = {}  # type: Dict[Tuple[str, str], Dict[str, float]]
+        self._latencies = {}  # type: Dict[Tuple[str, str], List[float]]
+
+    def __call__(self, event: RequestEvent):
+        key = (event.method, event.endpoint)
+        with self._lock:
+            totals = self._totals.setdefault(key, dict.fromkeys(
+                ('count', 'errors', 'latency', 'bytes_out', 'bytes_in', 'retries', 'token_refreshes', 'credits'), 0))
+            totals['count'] += 1
+            totals['errors'] += event.status >= 400
+            totals['latency'] += event.latency
+            totals['bytes_out'] += event.bytes_out
+            totals['bytes_in'] += event.bytes_in
+            totals['retries'] += event.retries
+            totals['token_refreshes'] += event.token_refreshes
+            totals['credits'] += event.credits
+            latencies = self._latencies.setdefault(key, [])
+            latencies.append(event.latency)
+            if len(latencies) > self.max_samples:
+                del latencies[:len(latencies) - self.max_samples]
+
+    def reset(self):
+        with self._lock:
+            self._totals.clear()
+            self._latencies.clear()
+
+    def summary(self) -> Dict[Tuple[str, str], Dict[str, float]]:
+        """ Per (method, endpoint): count, errors, total latency and bytes, retries, token_refreshes, credits,
+        and latency percentiles p50, p90 and p99 in seconds. Sorted by total latency, slowest first."""
+        with self._lock:
+            result = {}
+            for key, totals in self._totals.items():
+                latencies = sorted(self._latencies[key])
+                result[key] = dict(totals, **{name: _percentile(latencies, fraction)
+                                              for name, fraction in self.PERCENTILES})
+        return dict(sorted(result.items(), key=lambda item: item[1]['latency'], reverse=True))
+
+    def to_prometheus(self, prefix: str = 'zoho_crm') -> str:
+        """ The metrics in the Prometheus text exposition format. Latency is a summary with quantiles;
+        everything else is a counter. """
+        summary = self.summary()
+        lines = []
+
+        def labels(key: Tuple[str, str], **extra) -> str:
+            pairs = dict(method=key[0], endpoint=key[1], **extra)
+            return '{' + ','.join(f'{k}="{_escape_label(str(v))}"' for k, v in pairs.items()) + '}'
+
+        lines.append(f'# HELP {prefix}_request_latency_seconds Zoho CRM API call latency')
+        lines.append(f'# TYPE {prefix}_request_latency_seconds summary')
+        for key, values in summary.items():
+            for name, fraction in self.PERCENTILES:
+                lines.append(f'{prefix}_request_latency_seconds{labels(key, quantile=fraction)} {values[name]}')
+            lines.append(f'{prefix}_request_latency_seconds_sum{labels(key)} {values["latency"]}')
+            lines.append(f'{prefix}_request_latency_seconds_count{labels(key)} {values["count"]}')
+        for name, description in (('errors', 'calls with a status of 400 or more'),
+                                  ('bytes_out', 'request bytes sent'),
+                                  ('bytes_in', 'response bytes received'),
+                                  ('retries', 'retries made by the retry policy'),
+                                  ('token_refreshes', 'access token refreshes'),
+                                  ('credits', 'estimated API credits used')):
+            lines.append(f'# HELP {prefix}_{name}_total Zoho CRM API {description}')
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            for key, values in summary.items():
+                lines.append(f'{prefix}_{name}_total{labels(key)} {values[name]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
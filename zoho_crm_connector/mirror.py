@@ -0,0 +1,115 @@
+"""
+zoho_crm_connector.mirror
+~~~~~~~~~~~~~~~~~~~~~~~~~
+
+A local SQLite mirror of chosen Zoho CRM modules, kept up to date incrementally.
+
+The first sync of a module downloads all of it. After that each sync asks Zoho only for records modified since the
+module's high-water mark (yield_page_from_module with modified_since), and for records deleted since then
+(yield_deleted_records_from_module), and applies the changes. Reads are then served from SQLite.
+
+    mirror = ZohoMirror(zoho_crm, db_path=Path('zoho_mirror.sqlite'))
+    mirror.sync_modules(['Accounts', 'Contacts'])
+    account = mirror.get_record('Accounts', account_id)
+
+Records are stored as JSON, so a record read from the mirror looks like one read from the API.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Generator, Iterable, Optional, Tuple
+
+from .zoho_crm_api import Zoho_crm
+
+logger = logging.getLogger()
+
+
+class ZohoMirror:
+    """ Keeps a SQLite copy of Zoho CRM modules.
+
+    The high-water mark saved after a sync is the time the sync started, less overlap seconds, so that records
+    changed during a sync, or small differences between our clock and Zoho's, are picked up next time.
+    Applying a record twice is harmless. prefetch is passed to the paginating generators."""
+
+    def __init__(self, zoho_crm: Zoho_crm, db_path: Path, overlap: float = 60, prefetch: int = 0):
+        self.zoho_crm = zoho_crm
+        self.db_path = Path(db_path)
+        self.overlap = overlap
+        self.prefetch = prefetch
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS records ("
+                               "module TEXT NOT NULL, id TEXT NOT NULL, modified_time TEXT, data TEXT NOT NULL, "
+                               "PRIMARY KEY (module, id))")
+            connection.execute("CREATE TABLE IF NOT EXISTS sync_state ("
+                               "module TEXT PRIMARY KEY, high_water_mark TEXT NOT NULL, synced_at TEXT NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.db_path), timeout=60)
+            self._local.connection = connection
+        return connection
+
+    def high_water_mark(self, module_name: str) -> Optional[datetime]:
+        """ Changes after this time are fetched by the next sync; None if the module has never been synced."""
+        row = self._connection().execute("SELECT high_water_mark FROM sync_state WHERE module = ?",
+                                         (module_name,)).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def sync_module(self, module_name: str) -> Tuple[int, int]:
+        """ Bring the mirror of one module up to date. Returns (records upserted, records deleted from the mirror)."""
+        started = datetime.now(timezone.utc).replace(microsecond=0)
+        modified_since = self.high_water_mark(module_name)
+        connection = self._connection()
+        upserted = deleted = 0
+        for page in self.zoho_crm.yield_page_from_module(module_name=module_name, modified_since=modified_since,
+                                                         prefetch=self.prefetch):
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO records (module, id, modified_time, data) VALUES (?, ?, ?, ?)",
+                    [(module_name, record['id'], record.get('Modified_Time'), json.dumps(record)) for record in page])
+            upserted += len(page)
+        if modified_since is not None:
+            for page in self.zoho_crm.yield_deleted_records_from_module(module_name=module_name,
+                                                                        modified_since=modified_since,
+                                                                        prefetch=self.prefetch):
+                with connection:
+                    cursor = connection.executemany("DELETE FROM records WHERE module = ? AND id = ?",
+                                                    [(module_name, record['id']) for record in page])
+                deleted += cursor.rowcount  # records deleted in Zoho which were never mirrored don't count
+        high_water_mark = started - timedelta(seconds=self.overlap)
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO sync_state (module, high_water_mark, synced_at) "
+                               "VALUES (?, ?, ?)", (module_name, high_water_mark.isoformat(), started.isoformat()))
+        logger.info(f"Mirror of {module_name}: {upserted} records upserted, {deleted} deleted")
+        return upserted, deleted
+
+    def sync_modules(self, module_names: Iterable[str]) -> Dict[str, Tuple[int, int]]:
+        """ sync_module for each module. Returns a dict of module name: (records upserted, records deleted)"""
+        return {module_name: self.sync_module(module_name) for module_name in module_names}
+
+    def reset_module(self, module_name: str):
+        """ Forget a module, so that the next sync downloads all of it again."""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM records WHERE module = ?", (module_name,))
+            connection.execute("DELETE FROM sync_state WHERE module = ?", (module_name,))
+
+    def get_record(self, module_name: str, record_id: str) -> Optional[dict]:
+        row = self._connection().execute("SELECT data FROM records WHERE module = ? AND id = ?",
+                                         (module_name, record_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def yield_records(self, module_name: str) -> Generator[dict, None, None]:
+        """ All mirrored records of a module. """
+        cursor = self._connection().execute("SELECT data FROM records WHERE module = ? ORDER BY id", (module_name,))
+        for row in cursor:
+            yield json.loads(row[0])
+
+    def count_records(self, module_name: str) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM records WHERE module = ?",
+                                          (module_name,)).fetchone()[0]
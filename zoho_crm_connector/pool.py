@@ -0,0 +1,230 @@
+"""
+zoho_crm_connector.pool
+~~~~~~~~~~~~~~~~~~~~~~~
+
+Many orgs, one process: a pool of Zoho_crm clients sharing connections.
+
+Each Zoho_crm has its own connection pool, so syncing dozens of orgs opens dozens of pools to the same Zoho hosts.
+A ZohoClientPool hands out one client per org, and all of them send through one bounded HTTP adapter, which keeps a
+connection pool for each host (www.zohoapis.com, accounts.zoho.com, ...) of at most max_connections connections:
+
+    pool = ZohoClientPool(token_file_dir=Path('tokens'), max_connections=32)
+    pool.add_org('acme', refresh_token=..., client_id=..., client_secret=..., credits_per_window=50000)
+    pool.add_org('globex', refresh_token=..., client_id=..., client_secret=..., hosting='.EU')
+    contacts = pool.map_orgs(lambda org, zoho_crm: list(zoho_crm.iter_records('Contacts')))
+    pool.close()
+
+Everything else is kept apart. Each org has its own token file (in a directory of token_file_dir named after the
+org, unless a token_store is given), its own CreditGovernor when it has a credit budget or concurrency limit, and its
+own metadata and user caches.
+
+At most max_connections requests are in flight at once, across all orgs. When more are waiting, they are let through
+by a FairScheduler in turn: one for each waiting org, round robin, so an org with many busy threads can't starve one
+with a few.
+
+A streamed response (stream=True) keeps its turn until it is closed, as it keeps its connection until then: close
+it, or use it in a with statement, or other requests will wait for it.
+"""
+
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Deque, Dict, Hashable, Iterable, Iterator, List, TypeVar
+
+import requests
+from requests.adapters import BaseAdapter
+
+from .governor import CreditGovernor
+from .zoho_crm_api import Zoho_crm, _retry_adapter
+
+T = TypeVar('T')
+
+
+class FairScheduler:
+    """ Lets at most max_in_flight callers hold a slot at once. While callers are waiting, each freed slot goes to
+    the next key with a waiter, round robin, and within a key to its callers in order. Thread-safe."""
+
+    def __init__(self, max_in_flight: int):
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+        self.max_in_flight = max_in_flight
+        self._lock = threading.Lock()
+        self._free = max_in_flight
+        self._waiting = OrderedDict()  # type: OrderedDict[Hashable, Deque[threading.Event]]  # in turn order
+
+    def acquire(self, key: Hashable):
+        with self._lock:
+            if self._free and not self._waiting:
+                self._free -= 1
+                return
+            turn = threading.Event()
+            self._waiting.setdefault(key, deque()).append(turn)
+        turn.wait()  # the slot is handed over by release
+
+    def release(self):
+        with self._lock:
+            if not self._waiting:
+                self._free += 1
+                return
+            key, turns = self._waiting.popitem(last=False)
+            turn = turns.popleft()
+            if turns:
+                self._waiting[key] = turns  # to the back of the line
+        turn.set()
+
+    @contextmanager
+    def slot(self, key: Hashable) -> Iterator[None]:
+        self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def waiting(self) -> Dict[Hashable, int]:
+        """ How many callers of each key are waiting for a slot."""
+        with self._lock:
+            return {key: len(turns) for key, turns in self._waiting.items()}
+
+
+class _OrgAdapter(BaseAdapter):
+    """ Sends an org's requests through the shared adapter, each in its turn; a streamed response's turn ends when it
+    is closed. Closing the adapter leaves the shared adapter open; the pool closes that."""
+
+    def __init__(self, adapter: BaseAdapter, scheduler: FairScheduler, org: str):
+        super().__init__()
+        self.adapter = adapter
+        self.scheduler = scheduler
+        self.org = org
+
+    def send(self, request: requests.PreparedRequest, stream: bool = False, **kwargs) -> requests.Response:
+        self.scheduler.acquire(self.org)
+        try:
+            response = self.adapter.send(request, stream=stream, **kwargs)
+        except BaseException:
+            self.scheduler.release()
+            raise
+        if not stream:
+            self.scheduler.release()
+            return response
+        # a streamed response holds its connection until it is closed, so it holds its slot until then too
+        close = response.close
+        released = threading.Lock()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if released.acquire(blocking=False):
+                    self.scheduler.release()
+
+        response.close = close_and_release
+        return response
+
+    def close(self):
+        pass
+
+
+class ZohoClientPool:
+    """ Zoho_crm clients for many orgs, sharing a bounded HTTP connection pool and fairly scheduled. Thread-safe.
+
+    max_connections bounds the connections kept to each host, and the requests in flight across all orgs.
+    adapter replaces the shared retrying HTTPAdapter (for example, with a ReplayAdapter in tests).
+    max_workers sizes the thread pool map_orgs runs on. Call close() when finished, or use the pool as a context
+    manager."""
+
+    def __init__(self, token_file_dir: Path = None, max_connections: int = 32, adapter: BaseAdapter = None,
+                 max_workers: int = 8):
+        self.token_file_dir = Path(token_file_dir) if token_file_dir else None
+        self.max_connections = max_connections
+        self.adapter = adapter or _retry_adapter(pool_maxsize=max_connections, pool_block=True)
+        self.scheduler = FairScheduler(max_connections)
+        self.max_workers = max_workers
+        self._clients = {}  # type: Dict[str, Zoho_crm]
+        self._lock = threading.Lock()
+        self._executor = None  # type: ThreadPoolExecutor
+
+    def __enter__(self) -> 'ZohoClientPool':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add_org(self, org: str, refresh_token: str, client_id: str, client_secret: str,
+                credits_per_window: float = None, max_concurrency: int = None, max_workers: int = 4,
+                **client_options) -> Zoho_crm:
+        """ Make the client for an org, named by org, and return it. Construction makes no network calls.
+
+        credits_per_window and max_concurrency give the org its own CreditGovernor (see governor.py); max_workers
+        sizes the org's own thread pool. client_options are passed on to Zoho_crm: hosting, base_url, api_version,
+        token_store, governor and so on."""
+        with self._lock:
+            if org in self._clients:
+                raise ValueError(f"org {org} is already in the pool")
+        if 'token_store' not in client_options and 'token_file_dir' not in client_options:
+            if self.token_file_dir is None:
+                raise RuntimeError("Give the pool a token_file_dir, or the org a token_store")
+            client_options['token_file_dir'] = self.token_file_dir / org
+            client_options['token_file_dir'].mkdir(parents=True, exist_ok=True)
+        if 'governor' not in client_options and (credits_per_window or max_concurrency):
+            client_options['governor'] = CreditGovernor(credits_per_window=credits_per_window,
+                                                        max_concurrency=max_concurrency)
+        client = Zoho_crm(refresh_token=refresh_token, client_id=client_id, client_secret=client_secret,
+                          transport=_OrgAdapter(self.adapter, self.scheduler, org), max_workers=max_workers,
+                          **client_options)
+        with self._lock:
+            if org in self._clients:
+                client.close()
+                raise ValueError(f"org {org} is already in the pool")
+            self._clients[org] = client
+        return client
+
+    def client(self, org: str) -> Zoho_crm:
+        with self._lock:
+            try:
+                return self._clients[org]
+            except KeyError:
+                raise KeyError(f"org {org} is not in the pool") from None
+
+    __getitem__ = client
+
+    def __contains__(self, org: str) -> bool:
+        with self._lock:
+            return org in self._clients
+
+    def orgs(self) -> List[str]:
+        with self._lock:
+            return list(self._clients)
+
+    def remove_org(self, org: str):
+        """ Close an org's client and forget it; its token and metadata files are kept."""
+        with self._lock:
+            client = self._clients.pop(org)
+        client.close()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='zoho_pool')
+            return self._executor
+
+    def map_orgs(self, fn: Callable[[str, Zoho_crm], T], orgs: Iterable[str] = None) -> Dict[str, T]:
+        """ fn(org, client) for each of orgs (by default every org), run on the pool's threads.
+        Returns a dict of org: result; the first exception raised by fn is raised once all have finished."""
+        orgs = list(orgs) if orgs is not None else self.orgs()
+        futures = [self.executor.submit(fn, org, self.client(org)) for org in orgs]
+        wait(futures)
+        return {org: future.result() for org, future in zip(orgs, futures)}
+
+    def close(self):
+        """ Close every client, the thread pool and the shared connections."""
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for client in clients:
+            client.close()
+        self.adapter.close()
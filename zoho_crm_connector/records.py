@@ -0,0 +1,199 @@
+"""
+zoho_crm_connector.records
+~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Compact, typed records, as an opt-in alternative to plain dicts.
+
+A page of dicts repeats every field name in every record, and each dict carries its own hash table. Holding a whole
+module in memory (to match incoming rows against Contacts, say) costs far more than the data. With compact=True,
+iter_records and yield_page_from_module instead yield instances of a class made for the module from its field
+metadata:
+
+    contacts = list(zoho_crm.iter_records('Contacts', fields=['Email', 'Last_Name', 'Modified_Time'], compact=True))
+    contacts[0].Email, contacts[0]['Last_Name']
+    contacts[0].Modified_Time  # a datetime
+
+The class has a slot for each field, and for the $ keys Zoho adds to every record ($approved, $state, ...), so key
+names are stored once, in the class. Values are converted as records are made: datetime fields to aware datetimes,
+date fields to dates, and currency and decimal fields to Decimals. Values which repeat across records are shared:
+picklist values are interned, and equal owner lookups and $ key objects are one dict, which must not be changed.
+Keys the class doesn't know about are kept in a small dict per record.
+
+Records are read-only mappings, so code written for dicts (record['id'], record.get('Email'), 'Email' in record)
+works unchanged; to_dict() makes a plain dict again. A known field the record doesn't have reads as None as an
+attribute, and is missing as a key.
+"""
+
+import keyword
+import re
+import sys
+from collections.abc import Mapping
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
+
+DECIMAL_TYPES = ('currency', 'decimal')
+PICKLIST_TYPES = ('picklist',)
+SHARED_TYPES = ('ownerlookup', 'userlookup')
+# keys Zoho includes in the records of most modules, besides their fields
+SYSTEM_KEYS = ('$approved', '$approval', '$approval_state', '$currency_symbol', '$editable', '$in_merge',
+               '$orchestration', '$process_flow', '$review', '$review_process', '$state', '$converted')
+
+_timezones = {}  # all datetimes with the same offset share one tzinfo
+
+
+def _datetime(value: str) -> datetime:
+    value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value
+    return value.replace(tzinfo=_timezones.setdefault(value.utcoffset(), value.tzinfo))
+
+
+def _decimal(value) -> Decimal:
+    return Decimal(str(value))
+
+
+def _sharer() -> Callable[[Any], Any]:
+    """ A function returning the first of equal values it has been given, for values that repeat. Values which
+    can't be compared cheaply (those holding lists or dicts) are returned as they are."""
+    shared = {}
+
+    def share(value):
+        if isinstance(value, dict):
+            try:
+                return shared.setdefault(tuple(value.items()), value)
+            except TypeError:  # unhashable values inside
+                return value
+        return value
+
+    return share
+
+
+def _converter(data_type: Optional[str]) -> Optional[Callable[[Any], Any]]:
+    """ A function from the value Zoho returns for a field of data_type to the value kept, or None to keep it as is."""
+    if data_type == 'datetime':
+        return _datetime
+    if data_type == 'date':
+        return date.fromisoformat
+    if data_type in DECIMAL_TYPES:
+        return _decimal
+    if data_type in PICKLIST_TYPES:
+        return sys.intern
+    if data_type in SHARED_TYPES or data_type == 'system':
+        return _sharer()
+    return None
+
+
+def _slot_name(api_name: str) -> str:
+    """ The slot holding a key: its name, unless that can't be an attribute ($ keys, for example)."""
+    if api_name.isidentifier() and not keyword.iskeyword(api_name) and not api_name.startswith('_'):
+        return sys.intern(api_name)
+    return '_key_' + re.sub(r'\W', '_', api_name)
+
+
+class Record(Mapping):
+    """ The base of the record classes made by record_class. A read-only mapping of api name to value."""
+
+    __slots__ = ('_extra',)
+    module_name = None  # type: str
+    _fields = {}  # type: Dict[str, Tuple[Any, Optional[Callable[[Any], Any]]]]  # api name: (slot, converter)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Record':
+        record = cls.__new__(cls)
+        extra = None
+        fields = cls._fields
+        for key, value in data.items():
+            field = fields.get(key)
+            if field is None:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+                continue
+            slot, convert = field
+            if convert is not None and value is not None and value != '':
+                value = convert(value)
+            slot.__set__(record, value)
+        record._extra = extra
+        return record
+
+    @classmethod
+    def from_dicts(cls, data: Iterable[dict]) -> List['Record']:
+        from_dict = cls.from_dict
+        return [from_dict(record) for record in data]
+
+    def __getitem__(self, key: str):
+        field = self._fields.get(key)
+        if field is not None:
+            try:
+                return field[0].__get__(self, type(self))
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __getattr__(self, name: str):
+        # only called for names that aren't set: a known field reads as None, an unknown key comes from _extra
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._fields:
+            return None
+        extra = self._extra
+        if extra is not None and name in extra:
+            return extra[name]
+        raise AttributeError(f"{type(self).__name__} has no field {name}")
+
+    def __iter__(self):
+        for key, (slot, _) in self._fields.items():
+            if _has(self, slot):
+                yield key
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def to_dict(self) -> dict:
+        """ A plain dict of the record, with values as converted."""
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+def _has(record: Record, slot) -> bool:
+    try:
+        slot.__get__(record, type(record))
+    except AttributeError:
+        return False
+    return True
+
+
+def record_class(module_name: str, fields: List[dict], api_names: List[str] = None,
+                 system_keys: Iterable[str] = SYSTEM_KEYS) -> type:
+    """ A Record class for a module, with a slot for each of its fields (as returned by settings/fields),
+    or for each of api_names only, and for each of system_keys. id is always a field."""
+    by_name = {field['api_name']: field for field in fields}
+    by_name.update((key, {'api_name': key, 'data_type': 'system'}) for key in system_keys)
+    names = ['id'] + [name for name in (api_names or list(by_name)) if name != 'id']
+    names += [key for key in system_keys if key not in names]
+    slots = {}  # api name: slot name
+    for name in names:
+        slot = _slot_name(name)
+        if slot not in slots.values():
+            slots[name] = slot
+    namespace = {'__slots__': tuple(slots.values()), 'module_name': module_name}
+    cls = type(f'{module_name}Record', (Record,), namespace)
+    cls._fields = {sys.intern(name): (cls.__dict__[slot], _converter(by_name.get(name, {}).get('data_type')))
+                   for name, slot in slots.items()}
+    return cls
+
+
+def compact_pages(pages: Generator[List[dict], None, None], cls: type) -> Generator[List[Record], None, None]:
+    """ Pages of dicts as pages of records of cls. Closing this closes pages, so prefetching workers stop."""
+    try:
+        for page in pages:
+            yield cls.from_dicts(page)
+    finally:
+        pages.close()
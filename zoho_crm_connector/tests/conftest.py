@@ -0,0 +1,32 @@
+""" Fixtures for tests which run against the local stand-in Zoho server in fake_zoho.py, not a real Zoho org.
+Only test_zoho_crm_connector.py needs a real org."""
+
+import json
+
+import pytest
+
+from zoho_crm_connector import Zoho_crm
+from zoho_crm_connector.tests.fake_zoho import FakeZoho
+
+
+@pytest.fixture
+def fake_zoho() -> FakeZoho:
+    """ A local stand-in Zoho CRM server; its state can be set up by the test."""
+    fake = FakeZoho().start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def fake_token_dir(tmp_path, fake_zoho):
+    """ A token directory already holding the stand-in server's access token."""
+    with (tmp_path / 'access_token.json').open('w') as outfile:
+        json.dump({'access_token': fake_zoho.access_token, 'expires_in': 3600}, outfile)
+    return tmp_path
+
+
+@pytest.fixture
+def fake_zoho_crm(fake_zoho, fake_token_dir) -> Zoho_crm:
+    """ A Zoho_crm connected to the stand-in server, which also refreshes its tokens."""
+    return Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret',
+                    base_url=fake_zoho.base_url, accounts_url=fake_zoho.accounts_url, token_file_dir=fake_token_dir)
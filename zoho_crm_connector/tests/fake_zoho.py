@@ -0,0 +1,555 @@
+"""
+A small stand-in for the Zoho CRM REST API, so that connector code paths can be exercised without a real org.
+
+It understands enough of the v2 API for the tests: paginated module lists with info.more_records,
+simple equals searches, deleted records, related records, users, COQL, field metadata,
+inserts/updates/deletes, the token endpoint, bulk read jobs which serve canned states and zipped CSV results,
+and bulk write jobs which apply uploaded CSV files and report per-row results.
+It is deliberately simple and keeps everything in memory.
+
+Any API version in the path is accepted (set api_version to choose the one in base_url). Like Zoho, from v2.1 record
+lists carry a next_page_token in their info and refuse numbered pages past the 2000th record, and COQL refuses a LIMIT
+reaching past the 10000th.
+
+For benchmarks it can also behave more like the real thing: add latency (with jitter) to every call, expire access
+tokens after token_lifetime seconds so clients meet 401s, and enforce an API limit which resets every
+rate_limit_window seconds, replying 429 when it is spent. failures lists error replies for the next calls.
+"""
+
+import csv
+import functools
+import io
+import json
+import operator
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+import zipfile
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Union
+
+BULK_PREFIX = '/crm/bulk/v2/'
+_API_PATH = re.compile(r'^/crm/v(\d+(?:\.\d+)*)/')
+NUMBERED_PAGE_LIMIT = 2000  # records reachable with page= from v2.1
+COQL_OFFSET_LIMIT = 10000  # records reachable with a COQL LIMIT offset, count
+
+
+def make_records(module_name: str, count: int, start_id: int = 1000000) -> List[dict]:
+    """ Generate simple records for a module, with ids that sort numerically. """
+    return [{'id': str(start_id + i),
+             'Name': f'{module_name} {i}',
+             'Modified_Time': '2020-01-01T00:00:00+00:00',
+             } for i in range(count)]
+
+
+class FakeZoho:
+    """ The state of the stand-in server. Tests mutate the attributes directly. """
+
+    def __init__(self):
+        self.modules = {}  # type: Dict[str, List[dict]]
+        self.deleted = {}  # type: Dict[str, List[dict]]
+        self.related = {}  # type: Dict[Tuple[str, str, str], List[dict]]
+        self.fields = {}  # type: Dict[str, List[dict]]
+        self.layouts = {}  # type: Dict[str, List[dict]]
+        self.users = [{'id': '1', 'full_name': 'Default User', 'email': 'default@example.com', 'status': 'active'}]
+        self.access_token = 'fake-access-token'
+        self.api_version = 'v2'  # the version in base_url
+        self.page_tokens = {}  # type: Dict[str, int]  # next_page_token: the offset of the page it points to
+        # bulk read: the result pages each job page serves, and the states a job reports before COMPLETED
+        self.bulk_read_pages = {}  # type: Dict[str, List[List[dict]]]
+        self.bulk_read_states = ['ADDED', 'IN PROGRESS']
+        self.bulk_jobs = {}  # type: Dict[str, dict]
+        # bulk write: uploaded zip files, and fields which must have a value or the row is skipped
+        self.org_id = '555'
+        self.uploads = {}  # type: Dict[str, bytes]
+        self.required_fields = {}  # type: Dict[str, List[str]]
+        self.requests = []  # type: List[Tuple[str, str, dict]]
+        # API limit: when set, each authorised call uses one, responses carry X-RATELIMIT-* headers,
+        # and calls are refused with a 429 once none remain
+        self.rate_limit_remaining = None  # type: Optional[int]
+        self.rate_limit = 100
+        self.rate_limit_reset = 0  # milliseconds since the epoch
+        self.rate_limit_window = None  # type: Optional[float]  # seconds; when set, the limit resets every window
+        # seconds added to every response, plus a random extra of up to jitter seconds
+        self.latency = 0.0
+        self.jitter = 0.0
+        # statuses (or (status, headers)) to answer the next API calls with, one each, before serving them normally
+        self.failures = []  # type: List[Union[int, Tuple[int, dict]]]
+        # when set, access tokens stop working this many seconds after they are issued
+        self.token_lifetime = None  # type: Optional[float]
+        self.token_issued_at = time.time()
+        self.tokens_issued = 0
+        self.lock = threading.Lock()
+        self._next_id = 9000000
+        self.server = None  # type: Optional[ThreadingHTTPServer]
+        self.thread = None  # type: Optional[threading.Thread]
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/crm/{self.api_version}/'
+
+    @property
+    def accounts_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeZoho':
+        fake = self
+
+        class Handler(_FakeZohoHandler):
+            state = fake
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def new_id(self) -> str:
+        with self.lock:
+            self._next_id += 1
+            return str(self._next_id)
+
+    def count(self, method: str, path_fragment: str = '') -> int:
+        return len([r for r in self.requests if r[0] == method and path_fragment in r[1]])
+
+
+def make_zip_of_csv(file_name: str, records: List[dict]) -> bytes:
+    """ A zip holding one CSV file, like Zoho's bulk API results. """
+    text = io.StringIO()
+    fieldnames = list(records[0].keys()) if records else ['id']
+    writer = csv.DictWriter(text, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(records)
+    zipped = io.BytesIO()
+    with zipfile.ZipFile(zipped, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(file_name, text.getvalue())
+    return zipped.getvalue()
+
+
+def _paginate(items: List[dict], params: dict, key: str = 'data',
+              page_tokens: Dict[str, int] = None) -> Tuple[int, Optional[dict]]:
+    """ A page of items. With page_tokens (where issued tokens are kept), page like Zoho's record lists from v2.1:
+    info has a next_page_token, which can be sent as page_token, and page= can't reach past NUMBERED_PAGE_LIMIT."""
+    per_page = int(params.get('per_page', 200))
+    if page_tokens is not None and 'page_token' in params:
+        start = page_tokens.get(params['page_token'])
+        if start is None:
+            return 400, {'code': 'INVALID_DATA', 'message': 'invalid page_token', 'status': 'error'}
+    else:
+        start = (int(params.get('page', 1)) - 1) * per_page
+        if page_tokens is not None and start + per_page > NUMBERED_PAGE_LIMIT:
+            return 400, {'code': 'DISCRETE_PAGINATION_LIMIT_EXCEEDED',
+                         'message': f'use page_token to fetch more than {NUMBERED_PAGE_LIMIT} records',
+                         'status': 'error'}
+    chunk = items[start: start + per_page]
+    if not chunk:
+        return 204, None
+    more_records = start + per_page < len(items)
+    info = {'page': start // per_page + 1, 'per_page': per_page, 'count': len(chunk), 'more_records': more_records}
+    if page_tokens is not None and more_records:
+        info['next_page_token'] = token = uuid.uuid4().hex
+        page_tokens[token] = start + per_page
+    return 200, {key: chunk, 'info': info}
+
+
+def _matching_criteria(records: List[dict], criteria: str) -> List[dict]:
+    """ The records meeting every condition; equals compares text, the others compare numbers or datetimes."""
+    for field, op, value in re.findall(r'\(?\((\w+):(equals|between|greater_than|less_than|greater_equal|less_equal)'
+                                       r':([^()]*)\)', criteria):
+        if op == 'equals':
+            records = [r for r in records if str(r.get(field)) == value]
+        elif op == 'between':
+            low, high = (_coql_value(v) for v in value.split(','))
+            records = [r for r in records if r.get(field) is not None and low <= _coql_value(r[field]) <= high]
+        else:
+            compare, value = _COMPARISONS[_SEARCH_OPERATORS[op]], _coql_value(value)
+            records = [r for r in records if r.get(field) is not None and compare(_coql_value(r[field]), value)]
+    return records
+
+
+def _project(records: List[dict], params: dict) -> List[dict]:
+    """ Like Zoho, return only the requested fields (and the id) when there is a fields parameter."""
+    if not params.get('fields'):
+        return records
+    fields = ['id'] + params['fields'].split(',')
+    return [{field: record[field] for field in fields if field in record} for record in records]
+
+
+def _coql_value(value):
+    """ COQL compares ids as numbers and datetimes as times; others as text."""
+    return _parse_text(value) if isinstance(value, str) else value
+
+
+@functools.lru_cache(maxsize=100000)
+def _parse_text(value: str):
+    if value.isdigit():
+        return int(value)
+    if re.match(r'\d{4}-\d\d-\d\dT', value):
+        return datetime.fromisoformat(value)
+    return value
+
+
+_SEARCH_OPERATORS = {'greater_than': '>', 'less_than': '<', 'greater_equal': '>=', 'less_equal': '<='}
+_COMPARISONS = {'=': operator.eq, '!=': operator.ne, '>': operator.gt, '<': operator.lt, '>=': operator.ge,
+                '<=': operator.le}
+
+
+def _compare(left, op: str, right) -> bool:
+    return _COMPARISONS[op](left, right)
+
+
+class _FakeZohoHandler(BaseHTTPRequestHandler):
+    state = None  # type: FakeZoho
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are written separately; don't wait for delayed ACKs
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: Optional[dict] = None, content_type: str = 'application/json',
+              raw: bytes = None, headers: dict = None):
+        payload = raw if raw is not None else (json.dumps(body).encode() if body is not None else b'')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        for k, v in dict(getattr(self, 'rate_limit_headers', {}), **(headers or {})).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _dispatch(self, method: str):
+        parsed = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        body = self._read_body()
+        state = self.state
+        state.requests.append((method, parsed.path, params))
+        self.rate_limit_headers = {}
+        if state.latency or state.jitter:
+            time.sleep(state.latency + random.uniform(0, state.jitter))
+        if parsed.path.startswith('/oauth/v2/token'):
+            with state.lock:
+                if state.token_lifetime is not None:  # issue a new token, so the old one stops working
+                    state.access_token = f'fake-access-token-{state.tokens_issued + 1}'
+                    state.token_issued_at = time.time()
+                state.tokens_issued += 1
+            return self._send(200, {'access_token': state.access_token, 'expires_in': 3600,
+                                    'api_domain': 'https://www.zohoapis.com', 'token_type': 'Bearer'})
+        api_path = _API_PATH.match(parsed.path)
+        if not api_path and not parsed.path.startswith(BULK_PREFIX):
+            return self._send(404, {'code': 'INVALID_URL_PATTERN', 'status': 'error'})
+        expired = state.token_lifetime is not None and time.time() - state.token_issued_at > state.token_lifetime
+        if expired or self.headers.get('Authorization') != 'Zoho-oauthtoken ' + state.access_token:
+            return self._send(401, {'code': 'INVALID_TOKEN', 'message': 'invalid oauth token', 'status': 'error'})
+        if state.failures:
+            with state.lock:
+                failure = state.failures.pop(0) if state.failures else None
+            if failure is not None:
+                status, headers = failure if isinstance(failure, tuple) else (failure, {})
+                return self._send(status, {'code': 'INTERNAL_ERROR', 'status': 'error'}, headers=headers)
+        if state.rate_limit_remaining is not None:
+            with state.lock:
+                if state.rate_limit_window and time.time() * 1000 >= state.rate_limit_reset:
+                    state.rate_limit_remaining = state.rate_limit
+                    state.rate_limit_reset = int((time.time() + state.rate_limit_window) * 1000)
+                state.rate_limit_remaining -= 1
+                remaining = state.rate_limit_remaining
+            self.rate_limit_headers = {'X-RATELIMIT-LIMIT': str(state.rate_limit),
+                                       'X-RATELIMIT-REMAINING': str(max(remaining, 0)),
+                                       'X-RATELIMIT-RESET': str(state.rate_limit_reset)}
+            if remaining < 0:
+                return self._send(429, {'code': 'TOO_MANY_REQUESTS', 'status': 'error'})
+        if parsed.path.startswith(BULK_PREFIX):
+            parts = [p for p in parsed.path[len(BULK_PREFIX):].split('/') if p]
+            if parts[0] == 'write':
+                return self._bulk_write(method, parts, json.loads(body) if body else {})
+            return self._bulk_read(method, parts, json.loads(body) if body else {})
+        parts = [p for p in parsed.path[api_path.end():].split('/') if p]
+        self.api_version = tuple(int(part) for part in api_path.group(1).split('.'))
+        handler = getattr(self, f'_{method.lower()}', None)
+        return handler(parts, params, body)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _modified_since(self, records: List[dict], time_field: str) -> List[dict]:
+        """ Like Zoho, honour If-Modified-Since; Zoho replies 304 when nothing has changed, but 204 is simpler."""
+        since = self.headers.get('If-Modified-Since')
+        if not since:
+            return records
+        since = datetime.fromisoformat(since)
+        return [r for r in records if r.get(time_field) and datetime.fromisoformat(r[time_field]) > since]
+
+    def _get(self, parts: List[str], params: dict, body: bytes):
+        state = self.state
+        if parts == ['users']:
+            users = state.users
+            if params.get('type') == 'ActiveUsers':
+                users = [user for user in users if user['status'] == 'active']
+            elif params.get('type') == 'DeactiveUsers':
+                users = [user for user in users if user['status'] != 'active']
+            return self._send(*_paginate(users, params, key='users'))
+        if parts == ['org']:
+            return self._send(200, {'org': [{'id': state.org_id, 'company_name': 'Fake Org'}]})
+        if parts == ['settings', 'fields']:
+            return self._send(200, {'fields': state.fields.get(params.get('module'), [])})
+        if parts == ['settings', 'modules']:
+            return self._send(200, {'modules': [{'api_name': module, 'module_name': module, 'api_supported': True}
+                                                for module in sorted(set(state.modules) | set(state.fields))]})
+        if parts == ['settings', 'layouts']:
+            return self._send(200, {'layouts': state.layouts.get(params.get('module'), [])})
+        module = parts[0]
+        records = state.modules.get(module, [])
+        if len(parts) == 1:
+            if 'ids' in params:
+                wanted = params['ids'].split(',')
+                found = _project([r for r in records if r['id'] in wanted], params)
+                return self._send(200, {'data': found}) if found else self._send(204)
+            page_tokens = state.page_tokens if self.api_version >= (2, 1) else None
+            return self._send(*_paginate(_project(self._modified_since(records, 'Modified_Time'), params), params,
+                                         page_tokens=page_tokens))
+        if parts[1] == 'search':
+            found = _matching_criteria(records, params['criteria'])
+            return self._send(*_paginate(_project(found, params), params))
+        if parts[1] == 'deleted':
+            return self._send(*_paginate(self._modified_since(state.deleted.get(module, []), 'deleted_time'), params))
+        if len(parts) == 2:
+            found = [r for r in records if r['id'] == parts[1]]
+            return self._send(200, {'data': found}) if found else self._send(204)
+        related = state.related.get((module, parts[1], parts[2]), [])
+        return self._send(200, {'data': related}) if related else self._send(204)
+
+    def _post(self, parts: List[str], params: dict, body: bytes):
+        state = self.state
+        if parts == ['upload']:
+            return self._upload(body)
+        payload = json.loads(body or b'{}')
+        if parts == ['coql']:
+            return self._coql(payload['select_query'])
+        module = parts[0]
+        if parts[1:] == ['upsert']:
+            return self._upsert(module, payload)
+        results = []
+        for record in payload.get('data', []):
+            record = dict(record, id=state.new_id())
+            state.modules.setdefault(module, []).append(record)
+            results.append({'code': 'SUCCESS', 'details': {'id': record['id']}, 'status': 'success',
+                            'message': 'record added'})
+        return self._send(201, {'data': results})
+
+    def _upsert(self, module: str, payload: dict):
+        state = self.state
+        results = []
+        for record in payload['data']:
+            keys = payload.get('duplicate_check_fields') or []
+            if any(not record.get(k) for k in keys):
+                results.append({'code': 'MANDATORY_NOT_FOUND', 'details': {'api_name': keys[0]}, 'status': 'error',
+                                'message': 'required field not found'})
+                continue
+            existing = [r for r in state.modules.get(module, []) if all(r.get(k) == record[k] for k in keys)]
+            if existing:
+                existing[0].update(record)
+                results.append({'code': 'SUCCESS', 'action': 'update', 'details': {'id': existing[0]['id']},
+                                'status': 'success', 'message': 'record updated'})
+            else:
+                record = dict(record, id=state.new_id())
+                state.modules.setdefault(module, []).append(record)
+                results.append({'code': 'SUCCESS', 'action': 'insert', 'details': {'id': record['id']},
+                                'status': 'success', 'message': 'record added'})
+        return self._send(200, {'data': results})
+
+    def _put(self, parts: List[str], params: dict, body: bytes):
+        state = self.state
+        payload = json.loads(body or b'{}')
+        module = parts[0]
+        results = []
+        for change in payload.get('data', []):
+            target = [r for r in state.modules.get(module, []) if r['id'] == change.get('id')]
+            if target:
+                target[0].update(change)
+                results.append({'code': 'SUCCESS', 'details': {'id': change['id']}, 'status': 'success',
+                                'message': 'record updated'})
+            else:
+                results.append({'code': 'INVALID_DATA', 'details': {'id': change.get('id')}, 'status': 'error',
+                                'message': 'the related id given seems to be invalid'})
+        return self._send(200, {'data': results})
+
+    def _delete(self, parts: List[str], params: dict, body: bytes):
+        state = self.state
+        module = parts[0]
+        ids = params.get('ids', '').split(',')
+        results = []
+        for record_id in ids:
+            existing = [r for r in state.modules.get(module, []) if r['id'] == record_id]
+            if existing:
+                state.modules[module].remove(existing[0])
+                state.deleted.setdefault(module, []).append({'id': record_id, 'deleted_time': '2020-01-01T00:00:00+00:00'})
+                results.append({'code': 'SUCCESS', 'details': {'id': record_id}, 'status': 'success',
+                                'message': 'record deleted'})
+            else:
+                results.append({'code': 'INVALID_DATA', 'details': {'id': record_id}, 'status': 'error',
+                                'message': 'the related id given seems to be invalid'})
+        return self._send(200, {'data': results})
+
+    def _coql(self, query: str):
+        """ Enough COQL for paging and windowing: the selected fields or a COUNT, where conditions comparing a field
+        with a number or a quoted value (all of them must hold; 'or' is not understood), order by one field, and limit."""
+        module = re.search(r'\bfrom\s+(\w+)', query, re.IGNORECASE).group(1)
+        records = self.state.modules.get(module, [])
+        where = re.search(r'\bwhere\s+(.*?)(?:\s+order\s+by\b|\s+limit\b|$)', query, re.IGNORECASE)
+        if where:
+            for field, op, value in re.findall(r"(\w+)\s*(>=|<=|!=|=|>|<)\s*('[^']*'|\d+)", where.group(1)):
+                records = [r for r in records if r.get(field) is not None
+                           and _compare(_coql_value(r[field]), op, _coql_value(value.strip("'")))]
+        order = re.search(r'\border\s+by\s+(\w+)(?:\s+(asc|desc))?', query, re.IGNORECASE)
+        field, direction = (order.group(1), order.group(2) or 'asc') if order else ('id', 'asc')
+        records = sorted(records, key=lambda r: _coql_value(r.get(field, '')), reverse=direction.lower() == 'desc')
+        limit = re.search(r'\blimit\s+(\d+)(?:\s*,\s*(\d+))?', query, re.IGNORECASE)
+        offset, count = 0, 200
+        if limit and limit.group(2):
+            offset, count = int(limit.group(1)), int(limit.group(2))
+        elif limit:
+            count = int(limit.group(1))
+        if count > 2000:
+            return self._send(400, {'code': 'LIMIT_EXCEEDED', 'message': 'limit can be at most 2000', 'status': 'error'})
+        if offset + count > COQL_OFFSET_LIMIT:
+            return self._send(400, {'code': 'LIMIT_EXCEEDED', 'status': 'error',
+                                    'message': f'offset and limit can reach at most {COQL_OFFSET_LIMIT} records'})
+        selected = re.search(r'^\s*select\s+(.*?)\s+from\b', query, re.IGNORECASE).group(1)
+        if re.fullmatch(r'count\(\w+\)', selected.strip(), re.IGNORECASE):
+            return self._send(200, {'data': [{selected.strip(): len(records)}],
+                                    'info': {'count': 1, 'more_records': False}})
+        chunk = records[offset:offset + count]
+        if selected.strip() != '*':
+            chunk = _project(chunk, {'fields': ','.join(f.strip() for f in selected.split(','))})
+        if not chunk:
+            return self._send(204)
+        return self._send(200, {'data': chunk, 'info': {'count': len(chunk),
+                                                        'more_records': offset + count < len(records)}})
+
+    def _bulk_read(self, method: str, parts: List[str], payload: dict):
+        state = self.state
+        if method == 'POST' and parts == ['read']:
+            job_id = state.new_id()
+            state.bulk_jobs[job_id] = {'query': payload['query'], 'polls': 0}
+            return self._send(201, {'data': [{'status': 'success', 'code': 'ADDED_SUCCESSFULLY',
+                                              'message': 'Added successfully.',
+                                              'details': {'id': job_id, 'operation': 'read', 'state': 'ADDED'}}],
+                                    'info': {}})
+        job_id = parts[1]
+        job = state.bulk_jobs.get(job_id)
+        if job is None:
+            return self._send(400, {'code': 'INVALID_DATA', 'status': 'error'})
+        query = job['query']
+        pages = state.bulk_read_pages.get(query['module'], [[]])
+        page = query.get('page', 1)
+        records = pages[page - 1]
+        fields = query.get('fields')
+        if fields:
+            records = [{'Id': r['id'], **{f: r.get(f) for f in fields}} for r in records]
+        else:  # Zoho's CSV always calls the id column Id
+            records = [{'Id': r['id'], **{k: v for k, v in r.items() if k != 'id'}} for r in records]
+        if len(parts) == 3 and parts[2] == 'result':
+            return self._send(200, raw=make_zip_of_csv(f'{job_id}.csv', records), content_type='application/zip')
+        if job['polls'] < len(state.bulk_read_states):
+            job_state = state.bulk_read_states[job['polls']]
+            job['polls'] += 1
+            return self._send(200, {'data': [{'id': job_id, 'operation': 'read', 'state': job_state}]})
+        return self._send(200, {'data': [{
+            'id': job_id, 'operation': 'read', 'state': 'COMPLETED', 'query': query,
+            'result': {'page': page, 'count': len(records), 'per_page': 200000, 'more_records': page < len(pages),
+                       'download_url': f'{BULK_PREFIX}read/{job_id}/result'}}]})
+
+    def _upload(self, body: bytes):
+        state = self.state
+        if self.headers.get('feature') != 'bulk-write' or self.headers.get('X-CRM-ORG') != state.org_id:
+            return self._send(400, {'code': 'INVALID_REQUEST', 'status': 'error'})
+        boundary = self.headers['Content-Type'].split('boundary=')[1].encode()
+        for part in body.split(b'--' + boundary):
+            head, _, content = part.partition(b'\r\n\r\n')
+            if b'filename=' in head:
+                file_id = state.new_id()
+                state.uploads[file_id] = content[:-2]  # drop the trailing CRLF before the next boundary
+                return self._send(200, {'status': 'success', 'code': 'FILE_UPLOAD_SUCCESS',
+                                        'message': 'file uploaded.', 'details': {'file_id': file_id}})
+        return self._send(400, {'code': 'INVALID_REQUEST', 'status': 'error'})
+
+    def _bulk_write(self, method: str, parts: List[str], payload: dict):
+        state = self.state
+        if method == 'POST':
+            job_id = state.new_id()
+            state.bulk_jobs[job_id] = {'operation': payload['operation'], 'resource': payload['resource'][0],
+                                       'polls': 0, 'result_rows': None}
+            return self._send(201, {'status': 'success', 'code': 'SUCCESS', 'message': 'success',
+                                    'details': {'id': job_id}})
+        job_id = parts[1]
+        job = state.bulk_jobs[job_id]
+        if len(parts) == 3 and parts[2] == 'result':
+            return self._send(200, raw=make_zip_of_csv(f'{job_id}.csv', job['result_rows']),
+                              content_type='application/zip')
+        if job['polls'] < len(state.bulk_read_states):
+            job['polls'] += 1
+            return self._send(200, {'id': job_id, 'status': 'IN PROGRESS', 'operation': job['operation']})
+        if job['result_rows'] is None:
+            job['result_rows'] = self._apply_bulk_write(job)
+        rows = job['result_rows']
+        return self._send(200, {
+            'id': job_id, 'status': 'COMPLETED', 'operation': job['operation'],
+            'resource': [{'status': 'COMPLETED', 'type': 'data', 'module': job['resource']['module'],
+                          'file': {'status': 'COMPLETED', 'total_count': len(rows),
+                                   'added_count': len([r for r in rows if r['STATUS'] == 'ADDED']),
+                                   'updated_count': len([r for r in rows if r['STATUS'] == 'UPDATED']),
+                                   'skipped_count': len([r for r in rows if r['STATUS'] == 'SKIPPED'])}}],
+            'result': {'download_url': f'{BULK_PREFIX}write/{job_id}/result'}})
+
+    def _apply_bulk_write(self, job: dict) -> List[dict]:
+        state = self.state
+        resource = job['resource']
+        module = resource['module']
+        find_by = resource.get('find_by')
+        with zipfile.ZipFile(io.BytesIO(state.uploads[resource['file_id']])) as zip_file:
+            text = zip_file.read(zip_file.namelist()[0]).decode('utf-8')
+        rows = list(csv.reader(io.StringIO(text)))
+        header, rows = rows[0], rows[1:]
+        result_rows = []
+        for row in rows:
+            values = {m['api_name']: row[m['index']] for m in resource['field_mappings']}
+            result = dict(zip(header, row))
+            if any(not values.get(f) for f in state.required_fields.get(module, [])):
+                result_rows.append(dict(result, ID='', STATUS='SKIPPED', ERRORS='MANDATORY_NOT_FOUND'))
+                continue
+            existing = [r for r in state.modules.get(module, [])
+                        if find_by and values.get(find_by) and str(r.get(find_by)) == values[find_by]]
+            if existing and job['operation'] in ('update', 'upsert'):
+                existing[0].update(values)
+                result_rows.append(dict(result, ID=existing[0]['id'], STATUS='UPDATED', ERRORS=''))
+            elif job['operation'] == 'update':
+                result_rows.append(dict(result, ID='', STATUS='SKIPPED', ERRORS='NOT_FOUND'))
+            else:
+                record = dict(values, id=state.new_id())
+                state.modules.setdefault(module, []).append(record)
+                result_rows.append(dict(result, ID=record['id'], STATUS='ADDED', ERRORS=''))
+        return result_rows
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+pytest.importorskip('httpx')
+
+from zoho_crm_connector import AsyncZoho_crm, Zoho_crm
+from zoho_crm_connector.tests.fake_zoho import make_records
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def make_client(fake_zoho, fake_token_dir) -> AsyncZoho_crm:
+    return AsyncZoho_crm(refresh_token='refresh', client_id='id', client_secret='secret',
+                         base_url=fake_zoho.base_url, token_file_dir=fake_token_dir)
+
+
+def test_yield_page_from_module(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 450)
+
+    async def go():
+        async with make_client(fake_zoho, fake_token_dir) as zoho_crm:
+            return [page async for page in zoho_crm.yield_page_from_module(module_name='Contacts')]
+
+    pages = run(go())
+    assert [len(p) for p in pages] == [200, 200, 50]
+
+
+def test_iter_records_with_fields(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 250)
+
+    async def go():
+        async with make_client(fake_zoho, fake_token_dir) as zoho_crm:
+            return [record async for record in zoho_crm.iter_records(module_name='Contacts', fields=['Name'])]
+
+    records = run(go())
+    assert len(records) == 250
+    assert set(records[0]) == {'id', 'Name'}
+
+
+def test_page_token_pagination(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 2100)
+
+    async def go():
+        async with AsyncZoho_crm(refresh_token='refresh', client_id='id', client_secret='secret',
+                                 base_url=fake_zoho.base_url, token_file_dir=fake_token_dir,
+                                 api_version='v2.1') as zoho_crm:
+            return [record async for record in zoho_crm.iter_records(module_name='Contacts')]
+
+    assert len(run(go())) == 2100
+    assert 'page_token' in fake_zoho.requests[-1][2]
+
+
+def test_coql_pages(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Leads'] = make_records('Leads', 450)
+
+    async def go():
+        async with make_client(fake_zoho, fake_token_dir) as zoho_crm:
+            return await zoho_crm.get_records_through_coql_query("select Name from Leads where id > 0")
+
+    assert len(run(go())) == 450
+    assert fake_zoho.count('POST', '/coql') == 3
+
+
+def test_concurrent_calls_share_one_client(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 20)
+    ids = [r['id'] for r in fake_zoho.modules['Accounts']]
+
+    async def go():
+        async with make_client(fake_zoho, fake_token_dir) as zoho_crm:
+            return await asyncio.gather(*[zoho_crm.get_record_by_id('Accounts', record_id) for record_id in ids])
+
+    records = run(go())
+    assert [r['id'] for r in records] == ids
+
+
+def test_upsert_with_criteria_updates_existing(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Accounts'] = [{'id': '1', 'Account_Name': 'GrowthPath Pty Ltd', 'Description': 'old'}]
+
+    async def go():
+        async with make_client(fake_zoho, fake_token_dir) as zoho_crm:
+            return await zoho_crm.upsert_zoho_module(
+                module_name='Accounts', payload={'data': [{'Account_Name': 'GrowthPath Pty Ltd', 'Description': 'new'}]},
+                criteria='(Account_Name:equals:GrowthPath Pty Ltd)')
+
+    success, record = run(go())
+    assert success
+    assert record['id'] == '1' and record['Description'] == 'new'
+    assert len(fake_zoho.modules['Accounts']) == 1
+
+
+def test_expiring_token_refreshed_through_the_shared_store(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 1)
+    with (fake_token_dir / 'access_token.json').open('w') as outfile:
+        json.dump({'access_token': fake_zoho.access_token, 'expires_at': time.time() + 60}, outfile)
+
+    async def go():
+        async with AsyncZoho_crm(refresh_token='refresh', client_id='id', client_secret='secret',
+                                 base_url=fake_zoho.base_url, accounts_url=fake_zoho.accounts_url,
+                                 token_file_dir=fake_token_dir) as zoho_crm:
+            return await asyncio.gather(*[zoho_crm.get_record_by_id('Accounts', '1000000') for _ in range(10)])
+
+    assert len(run(go())) == 10
+    assert fake_zoho.count('POST', '/oauth/v2/token') == 1
+    with (fake_token_dir / 'access_token.json').open() as data_file:
+        assert json.load(data_file)['expires_at'] > time.time() + 3000
+    with Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                  accounts_url=fake_zoho.accounts_url, token_file_dir=fake_token_dir) as zoho_crm:
+        assert zoho_crm.get_record_by_id('Accounts', '1000000')['id'] == '1000000'
+    assert fake_zoho.count('POST', '/oauth/v2/token') == 1
+
+
+def test_server_errors_retried(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 1)
+    fake_zoho.failures = [503, (429, {'Retry-After': '0'}), 500]
+
+    async def go():
+        async with AsyncZoho_crm(refresh_token='refresh', client_id='id', client_secret='secret',
+                                 base_url=fake_zoho.base_url, token_file_dir=fake_token_dir,
+                                 backoff_factor=0) as zoho_crm:
+            return await zoho_crm.get_record_by_id('Accounts', '1000000')
+
+    assert run(go())['id'] == '1000000'
+    assert fake_zoho.count('GET', '/Accounts') == 4
+
+
+def test_client_made_outside_the_event_loop(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 1)
+    with (fake_token_dir / 'access_token.json').open('w') as outfile:
+        json.dump({'access_token': fake_zoho.access_token, 'expires_at': time.time() + 60}, outfile)
+    zoho_crm = AsyncZoho_crm(refresh_token='refresh', client_id='id', client_secret='secret',
+                             base_url=fake_zoho.base_url, accounts_url=fake_zoho.accounts_url,
+                             token_file_dir=fake_token_dir)
+
+    async def go():
+        async with zoho_crm:
+            return await asyncio.gather(*[zoho_crm.get_record_by_id('Accounts', '1000000') for _ in range(3)])
+
+    assert len(run(go())) == 3
+    assert fake_zoho.count('POST', '/oauth/v2/token') == 1
@@ -0,0 +1,13 @@
+import pytest
+
+benchmarks = pytest.importorskip('benchmarks')  # the benchmarks package is in the source checkout, beside this package
+
+""" Run each benchmark scenario at a small size, so that the scenarios keep working as the connector changes."""
+
+
+@pytest.mark.parametrize('name', sorted(benchmarks.SCENARIOS))
+def test_scenario_runs(name):
+    result = benchmarks.run_scenario(name, size=400, token_lifetime=0.2)
+    assert result.records > 0
+    assert result.calls > 0
+    assert result.p99 >= result.p50 > 0
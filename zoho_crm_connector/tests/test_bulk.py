@@ -0,0 +1,69 @@
+import pytest
+
+from zoho_crm_connector.bulk import BulkRead, BulkWrite, bulk_url_from_base_url, upload_url_from_base_url
+from zoho_crm_connector.tests.fake_zoho import make_records
+
+
+def test_bulk_url_from_base_url():
+    assert bulk_url_from_base_url("https://www.zohoapis.com/crm/v2/") == "https://www.zohoapis.com/crm/bulk/v2/"
+    assert bulk_url_from_base_url("https://crmsandbox.zoho.com/crm/v2") == "https://crmsandbox.zoho.com/crm/bulk/v2/"
+
+
+def test_bulk_read_pages(fake_zoho, fake_zoho_crm):
+    records = make_records('Contacts', 450)
+    fake_zoho.bulk_read_pages['Contacts'] = [records[:300], records[300:]]
+    bulk_read = BulkRead(fake_zoho_crm, poll_interval=0.01)
+    pages = list(bulk_read.yield_page_from_module(module_name='Contacts', page_size=200))
+    assert [len(p) for p in pages] == [200, 200, 50]
+    assert [r['id'] for page in pages for r in page] == [r['id'] for r in records]
+    assert all('Id' not in r for page in pages for r in page)
+    # two jobs, each polled until completed
+    assert fake_zoho.count('POST', '/bulk/v2/read') == 2
+    assert fake_zoho.count('GET', '/result') == 2
+
+
+def test_bulk_read_fields_and_empty_values(fake_zoho, fake_zoho_crm):
+    fake_zoho.bulk_read_pages['Leads'] = [[{'id': '1', 'Last_Name': 'Smith', 'Email': ''}]]
+    bulk_read = BulkRead(fake_zoho_crm, poll_interval=0.01)
+    records = list(bulk_read.yield_records(module_name='Leads', fields=['Last_Name', 'Email']))
+    assert records == [{'id': '1', 'Last_Name': 'Smith', 'Email': None}]
+
+
+def test_bulk_read_failed_job(fake_zoho, fake_zoho_crm):
+    fake_zoho.bulk_read_states = ['ADDED', 'FAILED']
+    bulk_read = BulkRead(fake_zoho_crm, poll_interval=0.01)
+    with pytest.raises(RuntimeError):
+        list(bulk_read.yield_records(module_name='Leads'))
+
+
+def test_bulk_write_insert_and_update(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Products'] = [{'id': '1', 'Product_Name': 'Widget', 'Unit_Price': '1.00'}]
+    fake_zoho.required_fields['Products'] = ['Product_Name']
+    bulk_write = BulkWrite(fake_zoho_crm, poll_interval=0.01, records_per_file=2)
+    records = [{'Product_Name': 'Widget', 'Unit_Price': 2.5},
+               {'Product_Name': 'Gadget', 'Unit_Price': 3},
+               {'Product_Name': None, 'Unit_Price': 4}]
+    result = bulk_write.write_module(module_name='Products', records=records, operation='upsert',
+                                     find_by='Product_Name')
+    assert len(result.jobs) == 2
+    assert fake_zoho.count('POST', '/upload') == 2
+    assert fake_zoho.count('GET', '/org') == 1
+    assert [r['STATUS'] for r in result.successes()] == ['UPDATED', 'ADDED']
+    assert [r['ERRORS'] for r in result.failures()] == ['MANDATORY_NOT_FOUND']
+    assert result.counts['total_count'] == 3
+    assert fake_zoho.modules['Products'][0]['Unit_Price'] == '2.5'
+
+
+def test_bulk_write_lookup_columns(fake_zoho_crm):
+    bulk_write = BulkWrite(fake_zoho_crm, org_id='555')
+    zipped, count = bulk_write.write_zipped_csv(
+        [{'Deal_Name': 'test deal', 'Account_Name': {'name': 'GrowthPath Pty Ltd', 'id': '42'}}],
+        fields=['Deal_Name', 'Account_Name'])
+    with zipped:
+        assert count == 1
+        assert list(bulk_write.yield_records_from_zip(zipped)) == [{'Deal_Name': 'test deal', 'Account_Name': '42'}]
+
+
+def test_upload_url_from_base_url():
+    assert upload_url_from_base_url("https://www.zohoapis.com.au/crm/v2/") == \
+        "https://content.zohoapis.com.au/crm/v2/upload"
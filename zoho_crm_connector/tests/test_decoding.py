@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from zoho_crm_connector.decoding import DECODERS, PageParser, get_decoder, iter_page_records
+
+RECORDS = [
+    {'id': '1', 'Name': 'Plain'},
+    {'id': '2', 'Name': 'Braces } { and "quotes" ] [', 'Owner': {'name': 'Jane', 'id': '9'}},
+    {'id': '3', 'Name': 'Escapes \\"}\\\\', 'Tags': [{'name': 'a'}, {'name': '}]'}], 'Amount': 1.5},
+    {'id': '4', 'Name': 'Unicode é中', 'Empty': {}},
+]
+BODY = json.dumps({'data': RECORDS, 'info': {'more_records': True, 'next_page_token': 'abc'}}, indent=1).encode()
+
+
+@pytest.mark.parametrize('decoder', sorted(DECODERS))
+def test_page_parser_any_chunking(decoder):
+    for size in (1, 2, 3, 7, 64, len(BODY)):
+        parser = PageParser(get_decoder(decoder))
+        chunks = (BODY[i:i + size] for i in range(0, len(BODY), size))
+        assert list(iter_page_records(chunks, parser)) == RECORDS
+        assert parser.has_data
+        assert parser.finish() == {'data': [], 'info': {'more_records': True, 'next_page_token': 'abc'}}
+
+
+def test_records_arrive_before_the_page_ends():
+    parser = PageParser()
+    first = json.dumps(RECORDS[0]).encode()
+    assert parser.feed(b'{"data": [' + first[:-1]) == []
+    assert parser.feed(b'}, {"id"') == [RECORDS[0]]
+    assert parser.feed(b': "2"}]}') == [{'id': '2'}]
+    assert parser.finish() == {'data': []}
+
+
+def test_nested_records_are_decoded_once():
+    records = [{'id': str(i), 'Product_Details': [{'product': {'id': str(j)}, 'quantity': j} for j in range(50)],
+                'Tag': [{'name': 'a'}, {'name': 'b'}]} for i in range(20)]
+    body = json.dumps({'data': records, 'info': {'more_records': False}}).encode()
+    decoded = []
+
+    def decode(text: bytes):
+        decoded.append(text)
+        return json.loads(text)
+
+    parser = PageParser(decode)
+    chunks = (body[i:i + 1000] for i in range(0, len(body), 1000))
+    assert list(iter_page_records(chunks, parser)) == records
+    assert len(decoded) == len(records)
+
+
+def test_page_without_data():
+    parser = PageParser()
+    assert parser.feed(b'{"info": {"data": [1]}, "status": "ok"}') == []
+    assert not parser.has_data
+    assert parser.finish() == {'info': {'data': [1]}, 'status': 'ok'}
+
+
+def test_get_decoder():
+    assert get_decoder('json') is json.loads
+    assert get_decoder(len) is len
+    assert get_decoder()(b'{"a": 1}') == {'a': 1}
+    with pytest.raises(RuntimeError):
+        get_decoder('nonesuch')
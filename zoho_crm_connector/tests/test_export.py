@@ -0,0 +1,76 @@
+from collections import Counter
+
+import pytest
+
+from zoho_crm_connector.export import counted_ranges, time_slices
+from zoho_crm_connector.zoho_crm_api import APIQuotaExceeded
+from zoho_crm_connector.tests.fake_zoho import make_records
+
+
+def make_leads(count: int):
+    leads = make_records('Leads', count)
+    for i, lead in enumerate(leads):
+        day = 1 if i < count // 2 else 2 + i % 27  # half the leads were modified on the first day
+        lead['Modified_Time'] = f'2020-01-{day:02}T{i % 24:02}:{i % 60:02}:00+00:00'
+    return leads
+
+
+def test_time_slices_are_sized_from_counts(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Leads'] = make_leads(5000)
+    slices = time_slices(fake_zoho_crm, 'Leads', 'Modified_Time', partitions=4)
+    assert sum(s.count for s in slices) == 5000
+    assert all(s.count <= 2000 for s in slices)
+    assert len(slices) > 4  # the crowded first day was halved
+    assert all(a.end == b.start for a, b in zip(slices, slices[1:])) and slices[-1].open_ended
+
+
+def test_last_time_slice_is_open_ended(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Leads'] = make_leads(100)
+    slices = time_slices(fake_zoho_crm, 'Leads', 'Modified_Time', partitions=2)
+    late = dict(make_records('Leads', 1, start_id=2000000)[0], Modified_Time='2021-01-01T00:00:00+00:00')
+    fake_zoho.modules['Leads'].append(late)  # modified after the export started
+    found = fake_zoho_crm.iter_records('Leads', criteria=slices[-1].criteria('Modified_Time'))
+    assert late['id'] in [r['id'] for r in found]
+
+
+def test_id_ranges_are_sized_from_counts(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Leads'] = make_leads(1000)
+    ranges = counted_ranges(fake_zoho_crm, 'Leads', 'id', 1000000, 1000999, partitions=1, max_count=100)
+    assert sum(count for start, end, open_ended, count in ranges) == 1000
+    assert all(count <= 100 for start, end, open_ended, count in ranges)
+    assert ranges[-1][2] and not any(open_ended for start, end, open_ended, count in ranges[:-1])
+
+
+def test_failed_count_probe_raises(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Leads'] = make_leads(100)
+    fake_zoho.rate_limit_remaining = 2  # enough for the bounds, not for the counts
+    with pytest.raises(APIQuotaExceeded):
+        list(fake_zoho_crm.export_module('Leads', partitions=4))
+
+
+def test_export_module_by_time(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Leads'] = make_leads(5000)
+    records = list(fake_zoho_crm.export_module('Leads', partitions=4, workers=3, fields=['Name']))
+    assert Counter(r['id'] for r in records) == Counter(r['id'] for r in fake_zoho.modules['Leads'])
+    assert set(records[0]) == {'id', 'Name'}
+    assert fake_zoho.count('GET', '/Leads/search') >= 25
+
+
+def test_export_module_by_id(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Leads'] = make_leads(1234)
+    records = list(fake_zoho_crm.export_module('Leads', partitions=3, partition_by='id'))
+    assert sorted(r['id'] for r in records) == [r['id'] for r in fake_zoho.modules['Leads']]
+    assert records[0]['Modified_Time']
+
+
+def test_export_module_closed_early(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Leads'] = make_leads(5000)
+    records = fake_zoho_crm.export_module('Leads', partitions=8)
+    first = next(records)
+    records.close()
+    assert first['id']
+    assert fake_zoho.count('GET', '/Leads/search') < 25
+
+
+def test_export_module_of_empty_module(fake_zoho, fake_zoho_crm):
+    assert list(fake_zoho_crm.export_module('Leads')) == []
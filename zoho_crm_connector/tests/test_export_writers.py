@@ -0,0 +1,84 @@
+import csv
+from decimal import Decimal
+
+import pytest
+
+from zoho_crm_connector.export_writers import (ArrowExportWriter, CSVExportWriter, ParquetExportWriter,
+                                               export_columns, write_module)
+from zoho_crm_connector.tests.fake_zoho import make_records
+
+DEAL_FIELDS = [
+    {'api_name': 'Deal_Name', 'data_type': 'text'},
+    {'api_name': 'Amount', 'data_type': 'currency', 'decimal_place': 2},
+    {'api_name': 'Probability', 'data_type': 'integer'},
+    {'api_name': 'Closing_Date', 'data_type': 'date'},
+    {'api_name': 'Modified_Time', 'data_type': 'datetime'},
+    {'api_name': 'Won', 'data_type': 'boolean'},
+    {'api_name': 'Account_Name', 'data_type': 'lookup', 'lookup': {'module': 'Accounts'}},
+    {'api_name': 'Tags', 'data_type': 'multiselectpicklist'},
+]
+
+
+def make_deals(count: int):
+    return [dict(record, Deal_Name=f'Deal {i}', Amount=i * 10.5, Probability=i % 100, Closing_Date='2020-02-01',
+                 Modified_Time='2020-01-01T10:00:00+10:00', Won=i % 2 == 0, Tags=['a', 'b'],
+                 Account_Name={'name': f'Account {i}', 'id': str(5000 + i)} if i % 3 else None)
+            for i, record in enumerate(make_records('Deals', count))]
+
+
+def test_columns_from_metadata(fake_zoho, fake_zoho_crm):
+    fake_zoho.fields['Deals'] = DEAL_FIELDS
+    columns = export_columns(fake_zoho_crm.metadata, 'Deals', fields=['Amount', 'Account_Name'])
+    assert [c.name for c in columns] == ['id', 'Amount', 'Account_Name_name', 'Account_Name_id']
+    assert columns[1].scale == 2
+
+
+def test_csv_written_in_row_groups(fake_zoho, fake_zoho_crm, tmp_path):
+    fake_zoho.fields['Deals'] = DEAL_FIELDS
+    columns = export_columns(fake_zoho_crm.metadata, 'Deals')
+    written = []
+
+    class CountingWriter(CSVExportWriter):
+        def _write_row_group(self, columns):
+            written.append(len(columns[0]))
+            super()._write_row_group(columns)
+
+    with CountingWriter(tmp_path / 'deals.csv', columns, row_group_size=100) as writer:
+        assert writer.write_pages([make_deals(250)]) == 250
+    assert written == [100, 100, 50]
+    with (tmp_path / 'deals.csv').open(newline='') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert len(rows) == 250
+    assert rows[1]['Amount'] == '10.50' and rows[1]['Won'] == 'false'
+    assert rows[1]['Account_Name_name'] == 'Account 1' and rows[1]['Account_Name_id'] == '5001'
+    assert rows[0]['Account_Name_id'] == ''
+    assert rows[0]['Modified_Time'] == '2020-01-01T00:00:00+00:00'
+    assert rows[0]['Tags'] == 'a;b'
+
+
+def test_write_module_streams_a_module(fake_zoho, fake_zoho_crm, tmp_path):
+    fake_zoho.fields['Deals'] = DEAL_FIELDS
+    fake_zoho.modules['Deals'] = make_deals(450)
+    assert write_module(fake_zoho_crm, 'Deals', tmp_path / 'deals.csv', format='csv', row_group_size=200) == 450
+    with pytest.raises(ValueError):
+        write_module(fake_zoho_crm, 'Deals', tmp_path / 'deals.xlsx', format='xlsx')
+
+
+def test_parquet_and_arrow(fake_zoho, fake_zoho_crm, tmp_path):
+    pyarrow = pytest.importorskip('pyarrow')
+    import pyarrow.ipc
+    import pyarrow.parquet
+    fake_zoho.fields['Deals'] = DEAL_FIELDS
+    columns = export_columns(fake_zoho_crm.metadata, 'Deals')
+    with ParquetExportWriter(tmp_path / 'deals.parquet', columns, row_group_size=100) as writer:
+        writer.write_records(make_deals(250))
+    parquet_file = pyarrow.parquet.ParquetFile(str(tmp_path / 'deals.parquet'))
+    assert parquet_file.metadata.num_row_groups == 3
+    table = parquet_file.read()
+    assert table.schema.field('Amount').type == pyarrow.decimal128(38, 2)
+    assert table.column('Amount')[1].as_py() == Decimal('10.50')
+    with ArrowExportWriter(tmp_path / 'deals.arrow', columns, row_group_size=100) as writer:
+        writer.write_records(make_deals(250))
+    with pyarrow.ipc.open_file(str(tmp_path / 'deals.arrow')) as reader:
+        assert reader.num_record_batches == 3
+        assert reader.read_all().column('Account_Name_id')[1].as_py() == '5001'
@@ -0,0 +1,86 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from zoho_crm_connector import CreditGovernor, Zoho_crm
+from zoho_crm_connector.zoho_crm_api import APIQuotaExceeded
+from zoho_crm_connector.tests.fake_zoho import make_records
+
+
+def test_cost_weights():
+    governor = CreditGovernor()
+    assert governor.cost('GET', '{module}/search') == 1
+    assert governor.cost('POST', '{module}/upsert', json={'data': [{}] * 100}) == 10
+    assert governor.cost('POST', '{module}', json={'data': [{}] * 5}) == 1
+    assert governor.cost('DELETE', '{module}', params={'ids': ','.join(map(str, range(25)))}) == 3
+    assert governor.cost('POST', 'coql', json={'select_query': 'select id from Leads limit 0, 2000'}) == 3
+    assert governor.cost('POST', 'bulk/read') == 50
+    assert governor.cost('GET', 'something/new') == 1
+    assert CreditGovernor(weights={('GET', '{module}/search'): (5, 0)}).cost('GET', '{module}/search') == 5
+
+
+def test_bucket_paces_calls():
+    governor = CreditGovernor(credits_per_window=100, window_seconds=1, burst=5)
+    started = time.monotonic()
+    for _ in range(15):
+        governor.acquire(1)
+    # 5 credits were in the bucket, the other 10 took 0.1 seconds to accrue
+    assert 0.08 < time.monotonic() - started < 1
+    assert governor.credits_spent == 15
+
+
+def test_concurrency_limit(fake_zoho, fake_zoho_crm):
+    governor = CreditGovernor(max_concurrency=2)
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+    original_request = fake_zoho_crm.requests_session.request
+
+    def counting_request(*args, **kwargs):
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.02)
+        try:
+            return original_request(*args, **kwargs)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+
+    fake_zoho_crm.requests_session.request = counting_request
+    fake_zoho_crm.governor = governor
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 10)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        records = list(executor.map(lambda r: fake_zoho_crm.get_record_by_id('Accounts', r['id']),
+                                    fake_zoho.modules['Accounts']))
+    assert len(records) == 10
+    assert peak[0] == 2
+
+
+def test_rate_limit_headers_and_429(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 3)
+    fake_zoho.rate_limit_remaining = 2
+    fake_zoho.rate_limit_reset = int((time.time() + 0.3) * 1000)
+    governor = CreditGovernor()
+    zoho_crm = Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                        token_file_dir=fake_token_dir, accounts_url=fake_zoho.accounts_url, governor=governor)
+    zoho_crm.get_record_by_id('Accounts', '1000000')
+    assert (governor.server_limit, governor.server_remaining) == (100, 1)
+    zoho_crm.get_record_by_id('Accounts', '1000001')
+    assert governor.server_remaining == 0
+    # the allowance is spent: the next call waits for the reset instead of being refused
+    fake_zoho.rate_limit_remaining = 100
+    started = time.monotonic()
+    zoho_crm.get_record_by_id('Accounts', '1000002')
+    assert time.monotonic() - started > 0.1
+
+    fake_zoho.rate_limit_remaining = 0
+    fake_zoho.rate_limit_reset = 0
+    governor.cooldown = 0.2
+    with pytest.raises(APIQuotaExceeded):
+        zoho_crm.get_record_by_id('Accounts', '1000000')
+    started = time.monotonic()
+    governor.acquire(1)  # everyone sharing the governor backs off after a 429
+    assert time.monotonic() - started > 0.1
+    zoho_crm.close()
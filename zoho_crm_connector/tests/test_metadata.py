@@ -0,0 +1,49 @@
+from zoho_crm_connector import MetadataCache, Zoho_crm
+
+DEAL_FIELDS = [
+    {'api_name': 'Deal_Name', 'data_type': 'text'},
+    {'api_name': 'Amount', 'data_type': 'currency'},
+    {'api_name': 'Account_Name', 'data_type': 'lookup', 'lookup': {'module': 'Accounts', 'id': '1'}},
+    {'api_name': 'Contact_Name', 'data_type': 'lookup', 'lookup': {'module': {'api_name': 'Contacts', 'id': '2'}}},
+    {'api_name': 'Stage', 'data_type': 'picklist',
+     'pick_list_values': [{'display_value': 'Won', 'actual_value': 'Closed Won'}, {'display_value': 'Lost'}]},
+]
+
+
+def make_client(fake_zoho, token_dir, **kwargs) -> Zoho_crm:
+    return Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                    accounts_url=fake_zoho.accounts_url, token_file_dir=token_dir, **kwargs)
+
+
+def test_metadata_shared_and_persisted(fake_zoho, fake_token_dir):
+    fake_zoho.fields['Deals'] = DEAL_FIELDS
+    fake_zoho.layouts['Deals'] = [{'id': '10', 'name': 'Standard'}]
+    first, second = make_client(fake_zoho, fake_token_dir), make_client(fake_zoho, fake_token_dir)
+    assert first.metadata.cache is second.metadata.cache
+    assert first.get_module_field_api_names('Deals') == [f['api_name'] for f in DEAL_FIELDS]
+    assert second.metadata.data_types('Deals')['Amount'] == 'currency'
+    assert second.metadata.lookups('Deals') == {'Account_Name': 'Accounts', 'Contact_Name': 'Contacts'}
+    assert second.metadata.picklists('Deals') == {'Stage': ['Closed Won', 'Lost']}
+    assert second.metadata.field('Deals', 'Stage')['data_type'] == 'picklist'
+    assert second.metadata.layouts('Deals')[0]['name'] == 'Standard'
+    assert 'Deals' in second.metadata.module_api_names()
+    assert fake_zoho.count('GET', 'settings/fields') == 1
+
+    MetadataCache._registry.clear()  # as if the process restarted
+    restarted = make_client(fake_zoho, fake_token_dir)
+    assert restarted.metadata.cache is not first.metadata.cache
+    assert restarted.get_module_field_api_names('Deals')[0] == 'Deal_Name'
+    assert fake_zoho.count('GET', 'settings/fields') == 1
+
+    restarted.metadata.invalidate('Deals')
+    restarted.metadata.fields('Deals')
+    assert fake_zoho.count('GET', 'settings/fields') == 2
+
+
+def test_metadata_ttl(fake_zoho, fake_token_dir):
+    fake_zoho.fields['Deals'] = DEAL_FIELDS
+    zoho_crm = make_client(fake_zoho, fake_token_dir, metadata_cache=MetadataCache(ttl=0))
+    zoho_crm.metadata.fields('Deals')
+    fake_zoho.fields['Deals'] = DEAL_FIELDS[:1]
+    assert zoho_crm.get_module_field_api_names('Deals') == ['Deal_Name']
+    assert fake_zoho.count('GET', 'settings/fields') == 2
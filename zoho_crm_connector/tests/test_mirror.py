@@ -0,0 +1,32 @@
+from zoho_crm_connector.mirror import ZohoMirror
+from zoho_crm_connector.tests.fake_zoho import make_records
+
+
+def test_incremental_sync(fake_zoho, fake_zoho_crm, tmp_path):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 250)
+    mirror = ZohoMirror(fake_zoho_crm, db_path=tmp_path / 'mirror.sqlite')
+    assert mirror.sync_module('Accounts') == (250, 0)
+    assert mirror.count_records('Accounts') == 250
+    assert mirror.high_water_mark('Accounts') is not None
+
+    # one change and one deletion since the last sync
+    changed, removed = fake_zoho.modules['Accounts'][0], fake_zoho.modules['Accounts'][1]
+    changed.update(Name='Changed', Modified_Time='2999-01-01T00:00:00+00:00')
+    fake_zoho.modules['Accounts'].remove(removed)
+    fake_zoho.deleted['Accounts'] = [{'id': removed['id'], 'deleted_time': '2999-01-01T00:00:00+00:00'},
+                                     {'id': 'never-mirrored', 'deleted_time': '2999-01-01T00:00:00+00:00'},
+                                     {'id': 'long-gone', 'deleted_time': '2000-01-01T00:00:00+00:00'}]
+
+    reopened = ZohoMirror(fake_zoho_crm, db_path=tmp_path / 'mirror.sqlite')
+    assert reopened.sync_module('Accounts') == (1, 1)
+    assert reopened.get_record('Accounts', changed['id'])['Name'] == 'Changed'
+    assert reopened.get_record('Accounts', removed['id']) is None
+    assert len(list(reopened.yield_records('Accounts'))) == 249
+
+
+def test_reset_module(fake_zoho, fake_zoho_crm, tmp_path):
+    fake_zoho.modules['Leads'] = make_records('Leads', 3)
+    mirror = ZohoMirror(fake_zoho_crm, db_path=tmp_path / 'mirror.sqlite')
+    mirror.sync_modules(['Leads'])
+    mirror.reset_module('Leads')
+    assert mirror.count_records('Leads') == 0 and mirror.high_water_mark('Leads') is None
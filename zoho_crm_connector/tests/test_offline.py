@@ -0,0 +1,274 @@
+import json
+import time
+
+import pytest
+import requests
+
+from zoho_crm_connector import MetricsAggregator, Zoho_crm
+from zoho_crm_connector.tests.fake_zoho import make_records
+from zoho_crm_connector.zoho_crm_api import _retry_adapter
+
+
+def test_yield_page_from_module_with_prefetch(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 1050)
+    sequential = [c for page in fake_zoho_crm.yield_page_from_module(module_name='Contacts') for c in page]
+    prefetched = [c for page in fake_zoho_crm.yield_page_from_module(module_name='Contacts', prefetch=3)
+                  for c in page]
+    assert prefetched == sequential
+    assert len(prefetched) == 1050
+
+
+def test_prefetch_stops_early(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 4000)
+    pages = fake_zoho_crm.yield_page_from_module(module_name='Contacts', prefetch=2)
+    first = next(pages)
+    pages.close()
+    assert first[0]['id'] == fake_zoho.modules['Contacts'][0]['id']
+    assert fake_zoho.count('GET', '/Contacts') <= 4
+
+
+def test_yield_deleted_records_with_prefetch(fake_zoho, fake_zoho_crm):
+    fake_zoho.deleted['Leads'] = make_records('Leads', 401)
+    deleted = [r for page in fake_zoho_crm.yield_deleted_records_from_module(module_name='Leads', prefetch=2)
+               for r in page]
+    assert [r['id'] for r in deleted] == [r['id'] for r in fake_zoho.deleted['Leads']]
+
+
+def test_upsert_many_zoho_module(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Accounts'] = [{'id': '1', 'Account_Name': 'GrowthPath Pty Ltd', 'Description': 'old'}]
+    records = [{'Account_Name': f'Account {i}'} for i in range(150)]
+    records.insert(3, {'Account_Name': 'GrowthPath Pty Ltd', 'Description': 'new'})
+    records.insert(120, {'Description': 'no name'})
+    outcomes = fake_zoho_crm.upsert_many_zoho_module(module_name='Accounts', records=records,
+                                                     duplicate_check_fields=['Account_Name'])
+    assert len(outcomes) == 152
+    assert fake_zoho.count('POST', '/Accounts/upsert') == 2
+    assert outcomes[3][0] == 'updated' and outcomes[3][1]['details']['id'] == '1'
+    assert outcomes[120][0] == 'failed'
+    assert [o for o, _ in outcomes].count('inserted') == 150
+    assert fake_zoho.modules['Accounts'][0]['Description'] == 'new'
+
+
+def test_get_records_by_ids(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 300)
+    ids = [r['id'] for r in reversed(fake_zoho.modules['Contacts'][:250])] + ['missing']
+    records = fake_zoho_crm.get_records_by_ids(module_name='Contacts', ids=ids)
+    assert [r['id'] for r in records] == ids[:-1]
+    assert fake_zoho.count('GET', '/Contacts') == 3
+
+
+def test_write_methods_return_details_or_records(fake_zoho, fake_zoho_crm):
+    payload = {'data': [{'Account_Name': 'A'}, {'Account_Name': 'B'}]}
+    success, records = fake_zoho_crm.upsert_zoho_module(module_name='Accounts', payload=payload, returns='records')
+    assert success and [r['Account_Name'] for r in records] == ['A', 'B']
+    assert fake_zoho.count('GET', '/Accounts') == 1
+
+    changes = {'data': [{'id': records[0]['id'], 'Description': 'changed'}]}
+    success, details = fake_zoho_crm.update_zoho_module(module_name='Accounts', payload=changes, returns='details')
+    assert success and details == [{'id': records[0]['id']}]
+    assert fake_zoho.count('GET', '/Accounts') == 1
+
+
+def test_delete_many_from_module(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 250)
+    ids = [r['id'] for r in fake_zoho.modules['Accounts']] + ['missing']
+    deleted = fake_zoho_crm.delete_many_from_module(module_name='Accounts', ids=ids, wf_trigger=False)
+    assert deleted == dict({record_id: True for record_id in ids[:-1]}, missing=False)
+    assert fake_zoho.modules['Accounts'] == []
+    deletes = [params for method, path, params in fake_zoho.requests if method == 'DELETE']
+    assert len(deletes) == 3 and all(params['wf_trigger'] == 'false' for params in deletes)
+
+
+def test_saved_token_costs_no_requests(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 1)
+    fake_zoho_crm.get_record_by_id('Accounts', fake_zoho.modules['Accounts'][0]['id'])
+    assert len(fake_zoho.requests) == 1
+
+
+def test_token_refreshed_before_expiry(fake_zoho, fake_token_dir):
+    with (fake_token_dir / 'access_token.json').open('w') as outfile:
+        json.dump({'access_token': fake_zoho.access_token, 'expires_at': time.time() + 60}, outfile)
+    zoho_crm = Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', token_refresh_margin=120,
+                        base_url=fake_zoho.base_url, accounts_url=fake_zoho.accounts_url,
+                        token_file_dir=fake_token_dir)
+    assert not fake_zoho.requests
+    assert zoho_crm.current_token['expires_at'] > time.time() + 3000
+    assert fake_zoho.count('POST', '/oauth/v2/token') == 1
+    with (fake_token_dir / 'access_token.json').open() as data_file:
+        assert json.load(data_file)['expires_at'] == zoho_crm.current_token['expires_at']
+
+
+def test_rejected_token_refreshed_on_401(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 1)
+    fake_zoho.access_token = 'revoked-and-replaced'
+    record = fake_zoho_crm.get_record_by_id('Accounts', fake_zoho.modules['Accounts'][0]['id'])
+    assert record['id'] == fake_zoho.modules['Accounts'][0]['id']
+    assert fake_zoho.count('POST', '/oauth/v2/token') == 1
+    assert fake_zoho_crm.current_token['access_token'] == 'revoked-and-replaced'
+
+
+def test_failed_token_refresh_raises_quickly(fake_zoho, tmp_path):
+    zoho_crm = Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                        accounts_url='http://127.0.0.1:1', token_file_dir=tmp_path)  # nothing listens there
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.ConnectionError):
+        zoho_crm.get_record_by_id('Accounts', '1')
+    assert time.monotonic() - started < 2
+    zoho_crm.close()
+
+
+def test_persistent_401_raises(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 1)
+    fake_zoho.token_lifetime = -1  # every token is rejected, even a new one
+    with pytest.raises(RuntimeError, match='rejected'):
+        fake_zoho_crm.get_record_by_id('Accounts', fake_zoho.modules['Accounts'][0]['id'])
+    assert fake_zoho.count('POST', '/oauth/v2/token') == 1
+    assert fake_zoho.count('GET', '/Accounts') == 2
+
+
+def test_streamed_401_releases_its_connection(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 3)
+    fake_zoho.access_token = 'revoked-and-replaced'
+    with Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                  accounts_url=fake_zoho.accounts_url, token_file_dir=fake_token_dir,
+                  transport=_retry_adapter(pool_maxsize=1, pool_block=True)) as zoho_crm:
+        assert len(list(zoho_crm.iter_records(module_name='Contacts', incremental=True))) == 3
+
+
+def test_shared_client_from_thread_pool(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 5)
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 450)
+    for account in fake_zoho.modules['Accounts'][:3]:
+        fake_zoho.related[('Accounts', account['id'], 'Contacts')] = fake_zoho.modules['Contacts'][:2]
+    parent_ids = [r['id'] for r in fake_zoho.modules['Accounts']]
+    with fake_zoho_crm:
+        related = fake_zoho_crm.map_related_records('Accounts', 'Contacts', parent_ids)
+        accounts, contacts = fake_zoho_crm.map_get_records([{'module_name': 'Accounts'}, {'module_name': 'Contacts'}])
+        users = fake_zoho_crm.map(lambda i: fake_zoho_crm.get_users(), range(20))
+    assert [len(related[i]) for i in parent_ids] == [2, 2, 2, 0, 0]
+    assert len(accounts) == 5 and len(contacts) == 450
+    assert all(u is users[0] for u in users)
+    assert fake_zoho.count('GET', '/users') == 1
+
+
+def test_map_nested_in_pool_runs_inline(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 300)
+    ids = [r['id'] for r in fake_zoho.modules['Contacts']]
+    with Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                  accounts_url=fake_zoho.accounts_url, token_store=fake_zoho_crm.token_store,
+                  max_workers=1) as zoho_crm:
+        results = zoho_crm.map(lambda chunk: zoho_crm.get_records_by_ids('Contacts', chunk), [ids[:150], ids[150:]])
+    assert [len(r) for r in results] == [150, 150]
+
+
+def test_request_hooks_and_metrics(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 250)
+    (fake_token_dir / 'access_token.json').write_text(json.dumps({'access_token': 'revoked', 'expires_in': 3600}))
+    metrics = MetricsAggregator()
+    events = []
+    zoho_crm = Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                        token_file_dir=fake_token_dir, accounts_url=fake_zoho.accounts_url,
+                        request_hooks=[metrics, events.append])
+    assert len(list(zoho_crm.yield_page_from_module('Accounts'))) == 2
+    zoho_crm.upsert_many_zoho_module('Accounts', [{'Name': f'New {i}'} for i in range(15)],
+                                     duplicate_check_fields=['Name'])
+    first = events[0]
+    assert (first.method, first.endpoint, first.status, first.token_refreshes) == ('GET', '{module}', 200, 1)
+    assert first.bytes_in > 0 and first.latency > 0
+    assert events[-1].endpoint == '{module}/upsert' and events[-1].credits == 2 and events[-1].bytes_out > 0
+    summary = metrics.summary()
+    assert summary[('GET', '{module}')]['count'] == 2
+    assert summary[('GET', '{module}')]['token_refreshes'] == 1
+    assert summary[('POST', '{module}/upsert')]['credits'] == 2
+    text = metrics.to_prometheus()
+    assert 'zoho_crm_request_latency_seconds_count{method="GET",endpoint="{module}"} 2' in text
+    assert 'zoho_crm_credits_total{method="POST",endpoint="{module}/upsert"} 2' in text
+    zoho_crm.close()
+
+
+def test_iter_records_with_fields(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Deals'] = [dict(record, Amount=i, Stage='Won') for i, record in
+                                  enumerate(make_records('Deals', 450))]
+    records = list(fake_zoho_crm.iter_records(module_name='Deals', fields=['Amount'], prefetch=2))
+    assert [r['Amount'] for r in records] == list(range(450))
+    assert set(records[0]) == {'id', 'Amount'}
+    assert fake_zoho.requests[-1][2]['fields'] == 'Amount'
+    searched = list(fake_zoho_crm.iter_records(module_name='Deals', criteria='(Stage:equals:Won)', fields=['Stage']))
+    assert len(searched) == 450 and set(searched[0]) == {'id', 'Stage'}
+
+
+def test_page_token_pagination_past_numbered_limit(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 2450)
+    with Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                  accounts_url=fake_zoho.accounts_url, token_file_dir=fake_token_dir,
+                  api_version='v2.1') as zoho_crm:
+        assert zoho_crm.base_url.endswith('/crm/v2.1/') and zoho_crm.api_version == (2, 1)
+        ids = [c['id'] for c in zoho_crm.iter_records(module_name='Contacts')]
+        assert ids == [c['id'] for c in fake_zoho.modules['Contacts']]
+        assert 'page_token' in fake_zoho.requests[-1][2] and 'page' not in fake_zoho.requests[-1][2]
+        prefetched = [c['id'] for c in zoho_crm.iter_records(module_name='Contacts', prefetch=4)]
+        assert prefetched == ids
+        assert fake_zoho.count('GET', '/Contacts') == 26  # no speculative pages when following tokens
+
+
+def test_version_aware_base_url(fake_token_dir):
+    zoho_crm = Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret',
+                        token_file_dir=fake_token_dir, hosting='.EU', api_version='v2.1')
+    assert zoho_crm.base_url == 'https://www.zohoapis.eu/crm/v2.1/'
+    assert Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret',
+                    token_file_dir=fake_token_dir).base_url == 'https://www.zohoapis.com/crm/v2/'
+    assert zoho_crm._pages_by_token('{module}') and not zoho_crm._pages_by_token('{module}/search')
+
+
+def test_coql_pages_advance_the_offset(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Leads'] = make_records('Leads', 450)
+    query = "select Name from Leads where Name != 'nobody'"
+    records = fake_zoho_crm.get_records_through_coql_query(query)
+    assert [r['id'] for r in records] == [r['id'] for r in fake_zoho.modules['Leads']]
+    assert set(records[0]) == {'id', 'Name'}
+    assert fake_zoho.count('POST', '/coql') == 3  # 200 a page before v2.1
+    assert len(fake_zoho_crm.get_records_through_coql_query(query + ' limit 10, 250')) == 250
+
+
+def test_coql_pages_past_the_offset_limit(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Leads'] = make_records('Leads', 10500)
+    query = "select Name from Leads where Name != 'nobody'"
+    records = list(fake_zoho_crm.iter_coql_records(query, page_size=2000))
+    assert [r['id'] for r in records] == [r['id'] for r in fake_zoho.modules['Leads']]
+    assert fake_zoho.count('POST', '/coql') == 6
+    with pytest.raises(RuntimeError, match='offset'):
+        list(fake_zoho_crm.iter_coql_records(query + ' order by Name', page_size=2000))
+
+
+def test_coql_errors_raise(fake_zoho, fake_zoho_crm):
+    fake_zoho.modules['Leads'] = make_records('Leads', 10)
+    with pytest.raises(RuntimeError, match='LIMIT_EXCEEDED'):
+        list(fake_zoho_crm.iter_coql_records('select Name from Leads', page_size=5000))
+    with pytest.raises(RuntimeError, match='offset'):
+        fake_zoho_crm.get_records_through_coql_query('select Name from Leads limit 10000, 10')
+
+
+def test_coql_windows_run_concurrently(fake_zoho, fake_zoho_crm):
+    leads = make_records('Leads', 1000)
+    for i, lead in enumerate(leads):
+        lead['Modified_Time'] = f'2020-01-{1 + i % 28:02}T{i % 24:02}:00:00+00:00'
+    fake_zoho.modules['Leads'] = leads
+    query = "select Name, Modified_Time from Leads where id > 1000099"
+    for window_field in ('id', 'Modified_Time'):
+        records = list(fake_zoho_crm.iter_coql_records(query, page_size=100, windows=4, window_field=window_field))
+        assert sorted(r['id'] for r in records) == [r['id'] for r in leads[100:]]
+    with pytest.raises(ValueError):
+        list(fake_zoho_crm.yield_coql_pages(query + ' limit 5', windows=2))
+
+
+def test_iter_records_incremental(fake_zoho, fake_token_dir):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 2450)
+    with Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                  accounts_url=fake_zoho.accounts_url, token_file_dir=fake_token_dir,
+                  api_version='v2.1', json_decoder='json') as zoho_crm:
+        records = list(zoho_crm.iter_records(module_name='Contacts', incremental=True))
+        assert records == fake_zoho.modules['Contacts']
+        assert 'page_token' in fake_zoho.requests[-1][2]
+        assert list(zoho_crm.iter_records(module_name='Contacts', criteria='(id:equals:0)', incremental=True)) == []
+        with pytest.raises(ValueError):
+            list(zoho_crm.iter_records(module_name='Contacts', incremental=True, prefetch=2))
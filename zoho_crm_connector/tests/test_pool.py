@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+
+import pytest
+
+from zoho_crm_connector import ZohoClientPool
+from zoho_crm_connector.pool import FairScheduler
+from zoho_crm_connector.tests.fake_zoho import make_records
+
+
+def add_org(pool: ZohoClientPool, fake_zoho, org: str, **kwargs):
+    (pool.token_file_dir / org).mkdir(parents=True, exist_ok=True)
+    with (pool.token_file_dir / org / 'access_token.json').open('w') as outfile:
+        json.dump({'access_token': fake_zoho.access_token, 'expires_in': 3600}, outfile)
+    return pool.add_org(org, refresh_token=f'refresh-{org}', client_id='id', client_secret='secret',
+                        base_url=fake_zoho.base_url, accounts_url=fake_zoho.accounts_url, **kwargs)
+
+
+def test_fair_scheduler_takes_turns():
+    scheduler = FairScheduler(1)
+    scheduler.acquire('big')
+    granted = []
+
+    def wait_for_slot(key: str):
+        with scheduler.slot(key):
+            granted.append(key)
+
+    threads = []
+    for key in ['big'] * 4 + ['small']:
+        threads.append(threading.Thread(target=wait_for_slot, args=(key,)))
+        threads[-1].start()
+        while sum(scheduler.waiting().values()) < len(threads):
+            time.sleep(0.001)
+    assert scheduler.waiting() == {'big': 4, 'small': 1}
+    scheduler.release()
+    for thread in threads:
+        thread.join()
+    assert granted == ['big', 'small', 'big', 'big', 'big']
+    assert scheduler.waiting() == {}
+
+
+def test_pool_shares_connections_and_isolates_orgs(fake_zoho, tmp_path):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 450)
+    fake_zoho.latency = 0.01
+    with ZohoClientPool(token_file_dir=tmp_path, max_connections=2) as pool:
+        acme = add_org(pool, fake_zoho, 'acme', credits_per_window=1000)
+        globex = add_org(pool, fake_zoho, 'globex')
+        with pytest.raises(ValueError):
+            add_org(pool, fake_zoho, 'acme')
+        assert pool['acme'] is acme and pool.orgs() == ['acme', 'globex'] and 'globex' in pool
+        assert acme.token_file_path == tmp_path / 'acme' / 'access_token.json'
+        assert acme.metadata.cache is not globex.metadata.cache
+        assert acme.governor is not None and globex.governor is None
+        assert acme.requests_session.get_adapter(fake_zoho.base_url).adapter is pool.adapter
+        assert globex.requests_session.get_adapter(fake_zoho.base_url).adapter is pool.adapter
+
+        counts = pool.map_orgs(lambda org, zoho_crm: len(zoho_crm.map_get_records(
+            [{'module_name': 'Contacts'}] * 3)[2]))
+        assert counts == {'acme': 450, 'globex': 450}
+        assert fake_zoho.count('GET', '/Contacts') == 18
+        pool.remove_org('globex')
+        assert pool.orgs() == ['acme']
+        assert len(acme.get_records_by_ids('Contacts', ['1000001'])) == 1
+
+
+def test_streamed_response_keeps_its_turn_until_closed(fake_zoho, tmp_path):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 10)
+    with ZohoClientPool(token_file_dir=tmp_path, max_connections=1) as pool:
+        acme = add_org(pool, fake_zoho, 'acme')
+        r = acme._send('GET', fake_zoho.base_url + 'Contacts', endpoint='{module}', stream=True)
+        fetched = []
+        thread = threading.Thread(target=lambda: fetched.append(acme.get_records_by_ids('Contacts', ['1000001'])))
+        thread.start()
+        deadline = time.monotonic() + 5
+        while not pool.scheduler.waiting() and time.monotonic() < deadline:
+            time.sleep(0.001)
+        assert pool.scheduler.waiting() == {'acme': 1}
+        assert r.json()['data']
+        r.close()
+        thread.join(timeout=5)
+        assert len(fetched) == 1 and len(fetched[0]) == 1
+        r.close()  # closing twice gives the turn back once
+        assert pool.scheduler.waiting() == {} and pool.scheduler._free == 1
+
+
+def test_busy_org_does_not_starve_small_org(fake_zoho, tmp_path):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 450)
+    fake_zoho.modules['Deals'] = make_records('Deals', 10)
+    fake_zoho.latency = 0.01
+
+    def sync(org, zoho_crm):
+        if org == 'busy':
+            return sum(len(records) for records in zoho_crm.map_get_records([{'module_name': 'Contacts'}] * 8))
+        return sum(len(zoho_crm.get_records_by_ids('Deals', ['1000001'])) for _ in range(4))
+
+    with ZohoClientPool(token_file_dir=tmp_path, max_connections=1) as pool:
+        add_org(pool, fake_zoho, 'busy', max_workers=8)
+        add_org(pool, fake_zoho, 'small')
+        assert pool.map_orgs(sync) == {'busy': 8 * 450, 'small': 4}
+    modules = ['Deals' if 'Deals' in path else 'Contacts' for method, path, params in fake_zoho.requests]
+    deals = [i for i, module in enumerate(modules) if module == 'Deals']
+    assert len(deals) == 4 and len(modules) == 4 + 8 * 3
+    # each of the small org's requests waits for at most a request or two of the busy org's, not for its queue
+    assert all(later - earlier <= 3 for earlier, later in zip(deals, deals[1:]))
+    assert deals[-1] < len(modules) - 8
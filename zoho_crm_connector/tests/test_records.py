@@ -0,0 +1,53 @@
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+import pytest
+
+from zoho_crm_connector.records import Record, record_class
+from zoho_crm_connector.tests.fake_zoho import make_records
+
+CONTACT_FIELDS = [
+    {'api_name': 'Last_Name', 'data_type': 'text'},
+    {'api_name': 'Modified_Time', 'data_type': 'datetime'},
+    {'api_name': 'Date_of_Birth', 'data_type': 'date'},
+    {'api_name': 'Amount', 'data_type': 'currency'},
+    {'api_name': 'Lead_Source', 'data_type': 'picklist'},
+    {'api_name': 'Owner', 'data_type': 'ownerlookup'},
+]
+
+
+def test_record_class_typed_and_dict_like():
+    cls = record_class('Contacts', CONTACT_FIELDS)
+    first, second = cls.from_dicts([
+        {'id': '1', 'Last_Name': 'Smith', 'Modified_Time': '2020-01-02T03:04:05+05:30', 'Date_of_Birth': '1990-02-03',
+         'Amount': 12.3, 'Lead_Source': 'Web', 'Owner': {'name': 'Jane', 'id': '9'}, '$approved': True,
+         'Not_In_Metadata': 'x'},
+        {'id': '2', 'Amount': None, 'Lead_Source': 'Web', 'Owner': {'name': 'Jane', 'id': '9'}},
+    ])
+    assert isinstance(first, Record) and not hasattr(first, '__dict__')
+    assert first.Modified_Time == datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=5, minutes=30)))
+    assert first.Date_of_Birth == date(1990, 2, 3) and first['Amount'] == Decimal('12.3')
+    assert first['$approved'] is True and first.Not_In_Metadata == first['Not_In_Metadata'] == 'x'
+    assert first.Owner is second.Owner and first.Lead_Source is second.Lead_Source
+    assert second.Last_Name is None and second.get('Last_Name') is None and 'Last_Name' not in second
+    with pytest.raises(KeyError):
+        second['Last_Name']
+    with pytest.raises(AttributeError):
+        second.Nonesuch
+    assert second == {'id': '2', 'Amount': None, 'Lead_Source': 'Web', 'Owner': {'name': 'Jane', 'id': '9'}}
+    assert list(first)[:2] == ['id', 'Last_Name'] and len(first) == 9
+    assert first.to_dict()['Not_In_Metadata'] == 'x'
+
+
+def test_iter_records_compact(fake_zoho, fake_zoho_crm):
+    fake_zoho.fields['Contacts'] = CONTACT_FIELDS
+    fake_zoho.modules['Contacts'] = [dict(record, Modified_Time='2021-05-06T07:08:09+00:00', Amount='1.50')
+                                     for record in make_records('Contacts', 450)]
+    for incremental in (False, True):
+        records = list(fake_zoho_crm.iter_records('Contacts', compact=True, incremental=incremental))
+        assert [r.id for r in records] == [r['id'] for r in fake_zoho.modules['Contacts']]
+        assert records[0].Modified_Time.year == 2021 and records[0].Amount == Decimal('1.50')
+    pages = list(fake_zoho_crm.yield_page_from_module('Contacts', fields=['Amount'], compact=True, prefetch=2))
+    assert [len(page) for page in pages] == [200, 200, 50]
+    assert type(pages[0][0]) is fake_zoho_crm.metadata.record_class('Contacts', ['Amount'])
+    assert fake_zoho.count('GET', 'settings/fields') == 1
@@ -0,0 +1,48 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from zoho_crm_connector import Zoho_crm
+from zoho_crm_connector.token_store import FileTokenStore, SQLiteTokenStore
+
+
+@pytest.fixture(params=['file', 'sqlite'])
+def make_store(request, tmp_path):
+    def make():
+        if request.param == 'file':
+            return FileTokenStore(tmp_path / 'access_token.json')
+        return SQLiteTokenStore(tmp_path / 'tokens.sqlite', key='org')
+    return make
+
+
+def test_single_flight_refresh_across_clients(fake_zoho, make_store):
+    """ Each client has its own store object, as separate processes would; they still refresh once."""
+    make_store().save({'access_token': 'expired', 'expires_at': time.time() - 1})
+    clients = [Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                        accounts_url=fake_zoho.accounts_url, token_store=make_store()) for _ in range(4)]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        tokens = list(executor.map(lambda i: clients[i % 4].current_token['access_token'], range(16)))
+    assert set(tokens) == {fake_zoho.access_token}
+    assert fake_zoho.count('POST', '/oauth/v2/token') == 1
+
+
+def test_rejected_token_refreshed_once(fake_zoho, make_store):
+    make_store().save({'access_token': 'revoked', 'expires_at': time.time() + 3600})
+    fake_zoho.modules['Accounts'] = [{'id': '1'}]
+    clients = [Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                        accounts_url=fake_zoho.accounts_url, token_store=make_store()) for _ in range(2)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        records = list(executor.map(lambda i: clients[i % 2].get_record_by_id('Accounts', '1'), range(8)))
+    assert all(r['id'] == '1' for r in records)
+    assert fake_zoho.count('POST', '/oauth/v2/token') == 1
+    assert make_store().load()['access_token'] == fake_zoho.access_token
+
+
+def test_file_store_reads_old_token_files(tmp_path):
+    with (tmp_path / 'access_token.json').open('w') as outfile:
+        json.dump({'access_token': 'old', 'expires_in': 3600}, outfile)
+    token = FileTokenStore(tmp_path / 'access_token.json').load()
+    assert token['access_token'] == 'old'
+    assert abs(token['expires_at'] - (time.time() + 3600)) < 60
@@ -0,0 +1,71 @@
+import gzip
+import json
+import time
+
+import pytest
+
+from zoho_crm_connector import RecordingAdapter, ReplayAdapter, Zoho_crm
+from zoho_crm_connector.bulk import BulkRead
+from zoho_crm_connector.tests.fake_zoho import make_records
+from zoho_crm_connector.transport import CassetteMiss
+
+
+def make_client(fake_zoho, token_dir, transport) -> Zoho_crm:
+    return Zoho_crm(refresh_token='my-refresh-token', client_id='my-client-id', client_secret='my-client-secret',
+                    base_url=fake_zoho.base_url, accounts_url=fake_zoho.accounts_url, token_file_dir=token_dir,
+                    transport=transport)
+
+
+def run_sync(zoho_crm: Zoho_crm):
+    contacts = [c for page in zoho_crm.yield_page_from_module('Contacts', prefetch=2) for c in page]
+    account = zoho_crm.get_record_by_id('Accounts', '1000001')
+    exported = list(BulkRead(zoho_crm, poll_interval=0).yield_records(module_name='Accounts'))
+    return contacts, account, exported
+
+
+def test_record_then_replay(fake_zoho, tmp_path):
+    fake_zoho.modules['Contacts'] = make_records('Contacts', 450)
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 3)
+    fake_zoho.bulk_read_pages['Accounts'] = [make_records('Accounts', 3)]
+    fake_zoho.latency = 0.02
+    cassette = tmp_path / 'sync.cassette.gz'
+    (tmp_path / 'recording').mkdir()
+    with make_client(fake_zoho, tmp_path / 'recording', RecordingAdapter(cassette)) as zoho_crm:
+        recorded = run_sync(zoho_crm)
+    assert len(recorded[0]) == 450 and len(recorded[2]) == 3
+
+    with gzip.open(str(cassette), 'rt') as cassette_file:
+        text = cassette_file.read()
+    for secret in ('my-refresh-token', 'my-client-id', 'my-client-secret', fake_zoho.access_token):
+        assert secret not in text
+    assert all('Authorization' not in json.loads(line)['headers'] for line in text.splitlines())
+
+    fake_zoho.stop()  # replay needs no server
+    (tmp_path / 'replaying').mkdir()
+    replay = ReplayAdapter(cassette)
+    with make_client(fake_zoho, tmp_path / 'replaying', replay) as zoho_crm:
+        assert run_sync(zoho_crm) == recorded
+        assert replay.remaining() == 0
+        with pytest.raises(CassetteMiss):
+            zoho_crm.get_record_by_id('Accounts', '1000001')
+
+    replay = ReplayAdapter(cassette, speed=1.0, allow_repeats=True)
+    with make_client(fake_zoho, tmp_path / 'replaying', replay) as zoho_crm:
+        started = time.monotonic()
+        zoho_crm.get_record_by_id('Accounts', '1000001')
+        zoho_crm.get_record_by_id('Accounts', '1000001')
+        assert time.monotonic() - started >= 0.04
+
+
+def test_replay_tells_posts_apart_by_body(fake_zoho, tmp_path):
+    fake_zoho.modules['Accounts'] = make_records('Accounts', 3)
+    cassette = tmp_path / 'coql.cassette.gz'
+    queries = [f"select Name from Accounts where id = {record_id}" for record_id in (1000000, 1000002)]
+    (tmp_path / 'recording').mkdir()
+    with make_client(fake_zoho, tmp_path / 'recording', RecordingAdapter(cassette)) as zoho_crm:
+        recorded = [zoho_crm.get_records_through_coql_query(query) for query in queries]
+
+    fake_zoho.stop()
+    (tmp_path / 'replaying').mkdir()
+    with make_client(fake_zoho, tmp_path / 'replaying', ReplayAdapter(cassette)) as zoho_crm:
+        assert [zoho_crm.get_records_through_coql_query(query) for query in reversed(queries)] == recorded[::-1]
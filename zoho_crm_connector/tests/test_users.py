@@ -0,0 +1,61 @@
+import time
+
+from zoho_crm_connector import Zoho_crm
+
+USERS = [
+    {'id': '1', 'full_name': 'Jane Smith', 'email': 'Jane@Example.com', 'status': 'active'},
+    {'id': '2', 'full_name': 'John Brown', 'email': 'john@example.com', 'status': 'inactive'},
+    {'id': '3', 'full_name': 'Ann Lee', 'email': 'ann@example.com', 'status': 'active'},
+]
+
+
+def make_client(fake_zoho, token_dir, **kwargs) -> Zoho_crm:
+    return Zoho_crm(refresh_token='refresh', client_id='id', client_secret='secret', base_url=fake_zoho.base_url,
+                    accounts_url=fake_zoho.accounts_url, token_file_dir=token_dir, default_zoho_user_name='Default',
+                    default_zoho_user_id='99', **kwargs)
+
+
+def test_user_lookups_are_indexed(fake_zoho, fake_token_dir):
+    fake_zoho.users = USERS
+    zoho_crm = make_client(fake_zoho, fake_token_dir)
+    assert zoho_crm.finduser_by_name('Jane Smith') == ('Jane Smith', '1')
+    assert zoho_crm.finduser_by_name('  jane   SMITH ') == ('  jane   SMITH ', '1')
+    assert zoho_crm.finduser_by_name('John Brown') == ('Default', '99')  # inactive
+    assert zoho_crm.finduser_by_name('Nobody') == ('Default', '99')
+    assert zoho_crm.finduser_by_names(['Ann Lee', 'Nobody']) == {'Ann Lee': ('Ann Lee', '3'),
+                                                                 'Nobody': ('Default', '99')}
+    assert zoho_crm.user_directory.by_email('jane@example.com')['id'] == '1'
+    assert zoho_crm.user_directory.by_id('3')['full_name'] == 'Ann Lee'
+    assert fake_zoho.count('GET', '/users') == 1
+
+
+def test_users_cached_per_type(fake_zoho, fake_token_dir):
+    fake_zoho.users = USERS
+    zoho_crm = make_client(fake_zoho, fake_token_dir)
+    assert len(zoho_crm.get_users()['users']) == 3
+    assert [u['id'] for u in zoho_crm.get_users('ActiveUsers')['users']] == ['1', '3']
+    assert [u['id'] for u in zoho_crm.get_users('DeactiveUsers')['users']] == ['2']
+    assert zoho_crm.get_users() is zoho_crm.zoho_user_cache
+    zoho_crm.zoho_user_cache = None
+    zoho_crm.get_users()
+    assert fake_zoho.count('GET', '/users') == 4
+    zoho_crm.zoho_user_cache = {'users': USERS[2:]}
+    assert zoho_crm.finduser_by_name('Ann Lee') == ('Ann Lee', '3')
+    assert zoho_crm.finduser_by_name('Jane Smith') == ('Default', '99')
+    assert fake_zoho.count('GET', '/users') == 4
+
+
+def test_users_refreshed_in_background(fake_zoho, fake_token_dir):
+    fake_zoho.users = USERS[:1]
+    zoho_crm = make_client(fake_zoho, fake_token_dir, user_cache_ttl=0.2)
+    assert zoho_crm.finduser_by_name('Ann Lee') == ('Default', '99')
+    fake_zoho.users = USERS
+    time.sleep(0.3)
+    fake_zoho.latency = 0.2
+    started = time.monotonic()
+    assert zoho_crm.finduser_by_name('Ann Lee') == ('Default', '99')  # the old users, without waiting
+    assert time.monotonic() - started < 0.1
+    time.sleep(0.5)
+    zoho_crm.user_directory.ttl = 60
+    assert zoho_crm.finduser_by_name('Ann Lee') == ('Ann Lee', '3')
+    assert fake_zoho.count('GET', '/users') == 2
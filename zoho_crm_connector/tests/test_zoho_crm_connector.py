@@ -80,6 +80,24 @@ def test_delete_accounts(zoho_crm):
     assert count_accounts_with_criteria(zoho_crm) == 0, "Could not delete all records"
 
 
+def test_delete_many_accounts(zoho_crm):
+    """ delete_many_from_module deletes in chunks, and says which ids were deleted"""
+    test_delete_accounts(zoho_crm)
+    zoho_account = {'Account_Name': 'GrowthPath Pty Ltd',
+                    'Description': '124',
+                    'Owner': {'name': 'Tim Richardson', 'id': zoho_crm.default_zoho_user_id}
+                    }
+    ids = []
+    for _ in range(2):
+        success, r = zoho_crm.upsert_zoho_module(module_name='Accounts', criteria=None, payload={'data': [zoho_account]})
+        assert success
+        ids.append(r['id'])
+    assert count_accounts_with_criteria(zoho_crm) == 2, "There should be two records now"
+
+    deleted = zoho_crm.delete_many_from_module(module_name='Accounts', ids=ids)
+    assert deleted == {record_id: True for record_id in ids}, "Could not delete a record"
+    assert count_accounts_with_criteria(zoho_crm) == 0, "Could not delete all records"
+
 
 def test_delete_and_upsert_account(zoho_crm):
     """ this tests searching, upsert and deleting"""
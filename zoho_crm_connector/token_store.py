@@ -0,0 +1,177 @@
+"""
+zoho_crm_connector.token_store
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Where access tokens are kept, so that many threads and processes using the same Zoho org can share one token.
+
+A refresh is single-flight: whoever needs a new token takes the store's lock, and then looks at the stored token
+again before asking Zoho for a new one. Anyone who was waiting for the lock finds the new token and uses it, so
+many workers which all see an expired token cause one refresh, not a refresh storm.
+
+FileTokenStore keeps the token in the JSON file Zoho_crm has always used, with a lock file beside it.
+SQLiteTokenStore keeps tokens in a SQLite database, keyed so one database can hold tokens for several orgs.
+Other stores (a database table, a cache server) can subclass TokenStore.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, ContextManager, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+    import msvcrt
+
+
+class TokenStore(ABC):
+    """ Base class for token stores. Subclasses implement load, save and _process_lock."""
+
+    def __init__(self):
+        self._thread_lock = threading.Lock()
+
+    @abstractmethod
+    def load(self) -> Optional[dict]:
+        """ The stored token, or None. Tokens have 'access_token' and 'expires_at' (seconds since the epoch)."""
+
+    @abstractmethod
+    def save(self, token: dict):
+        """ Store token for everyone else using the store."""
+
+    @abstractmethod
+    def _process_lock(self) -> ContextManager[None]:
+        """ An exclusive lock shared by every process using the store, as a context manager."""
+
+    def get_token(self, is_fresh: Callable[[Optional[dict]], bool], refresh: Callable[[], dict],
+                  stale_token: dict = None) -> dict:
+        """ Returns a usable token, calling refresh() only if no other thread or process has already done so.
+
+        The stored token is used if is_fresh(token) and it is not stale_token, the token Zoho just rejected.
+        Otherwise refresh() gets a new token, which is stored for everyone else."""
+        with self._thread_lock:
+            with self._process_lock():
+                token = self.load()
+                rejected = stale_token is not None and token is not None and \
+                    token.get('access_token') == stale_token.get('access_token')
+                if is_fresh(token) and not rejected:
+                    return token
+                token = refresh()
+                self.save(token)
+                return token
+
+
+@contextmanager
+def _locked_file(lock_path: Path) -> Iterator[None]:
+    with lock_path.open('a+b') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:  # pragma: no cover
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ten seconds
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:  # pragma: no cover
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileTokenStore(TokenStore):
+    """ Keeps the token in a JSON file, locked with a .lock file beside it.
+    The file is replaced atomically, so readers never see a partly written token."""
+
+    def __init__(self, token_file_path: Path):
+        super().__init__()
+        self.token_file_path = Path(token_file_path)
+        self.lock_file_path = self.token_file_path.with_name(self.token_file_path.name + '.lock')
+
+    def load(self) -> Optional[dict]:
+        """ Tokens saved by older versions have no expires_at; it is worked out from the file's modification time."""
+        try:
+            with self.token_file_path.open() as data_file:
+                token = json.load(data_file)
+            if 'access_token' not in token:
+                return None
+            if 'expires_at' not in token:
+                token['expires_at'] = self.token_file_path.stat().st_mtime + token.get('expires_in', 3600)
+            return token
+        except (ValueError, FileNotFoundError, IOError):
+            return None
+
+    def save(self, token: dict):
+        handle, temp_path = tempfile.mkstemp(dir=str(self.token_file_path.parent), prefix='.access_token')
+        try:
+            with os.fdopen(handle, 'w') as outfile:
+                json.dump(token, outfile)
+            os.replace(temp_path, str(self.token_file_path))
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @contextmanager
+    def _process_lock(self) -> Iterator[None]:
+        with _locked_file(self.lock_file_path):
+            yield
+
+
+class SQLiteTokenStore(TokenStore):
+    """ Keeps tokens in a SQLite database, one row per key (for example, one key per Zoho org).
+    The refresh lock is a write transaction on the database; other processes wait up to timeout seconds for it."""
+
+    def __init__(self, db_path: Path, key: str = 'default', timeout: float = 120):
+        super().__init__()
+        self.db_path = Path(db_path)
+        self.key = key
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS zoho_tokens (key TEXT PRIMARY KEY, token TEXT NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(str(self.db_path), timeout=self.timeout, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def load(self) -> Optional[dict]:
+        row = self._connection().execute("SELECT token FROM zoho_tokens WHERE key = ?", (self.key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, token: dict):
+        self._connection().execute("INSERT OR REPLACE INTO zoho_tokens (key, token) VALUES (?, ?)",
+                                   (self.key, json.dumps(token)))
+
+    @contextmanager
+    def _process_lock(self) -> Iterator[None]:
+        connection = self._connection()
+        started = time.monotonic()
+        while True:
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError:  # database is locked, and the busy timeout has passed
+                if time.monotonic() - started > self.timeout:
+                    raise
+        try:
+            yield
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        else:
+            connection.execute("COMMIT")
@@ -0,0 +1,186 @@
+"""
+zoho_crm_connector.transport
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+Record real Zoho traffic to a cassette file, and replay it later without a network.
+
+Both are requests transport adapters, given to Zoho_crm as its transport:
+
+    with Zoho_crm(..., transport=RecordingAdapter(Path('sync.cassette.gz'))) as zoho_crm:
+        run_sync(zoho_crm)
+
+    with Zoho_crm(..., transport=ReplayAdapter(Path('sync.cassette.gz'), speed=1.0)) as zoho_crm:
+        run_sync(zoho_crm)  # the same responses, with the recorded timing
+
+A cassette is gzipped JSON lines, one exchange per line: method, url, status, response headers and body,
+and how long Zoho took. Secrets are scrubbed before anything is written: Authorization and cookie headers are not
+recorded, the refresh token, client id and secret in token urls are replaced, and so are tokens in response bodies.
+
+On replay, each request is answered with the next recorded response for the same method, url and body
+(after the same scrubbing), so concurrent calls and different call orders replay correctly; POSTs to one url, such as
+COQL queries or upserts, are told apart by a hash of their body. Prefetching asks for pages past the end, and whether
+those speculative requests are made depends on timing, so remaining() doesn't count their unused responses.
+A request with no recorded response raises CassetteMiss. speed=None replays as fast as possible; speed=1.0 waits as
+long as Zoho took, speed=2.0 half as long, and so on.
+
+Replayed token responses hold a scrubbed access token, which is fine because nothing checks it. If the recording
+made no token request, the replaying client needs an unexpired token of any value in its token store.
+"""
+
+import base64
+import gzip
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+import urllib.parse
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3 import HTTPResponse
+
+from .zoho_crm_api import _retry_adapter
+
+SCRUBBED = '<scrubbed>'
+SCRUBBED_PARAMETERS = ('refresh_token', 'client_id', 'client_secret', 'code')
+UNRECORDED_HEADERS = ('Set-Cookie', 'Content-Encoding', 'Transfer-Encoding', 'Connection')
+_SECRET_JSON_VALUES = re.compile(r'"(access_token|refresh_token|id_token|client_secret)"(\s*:\s*)"[^"]*"')
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """ A replayed request has no recorded response."""
+
+
+def scrub_url(url: str, parameters: Iterable[str] = SCRUBBED_PARAMETERS) -> str:
+    """ The url with the values of secret query parameters replaced."""
+    parts = urllib.parse.urlsplit(url)
+    if not parts.query:
+        return url
+    query = [(k, SCRUBBED if k in parameters else v) for k, v in urllib.parse.parse_qsl(parts.query,
+                                                                                        keep_blank_values=True)]
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def scrub_body(body: bytes) -> bytes:
+    if b'token' not in body and b'secret' not in body:
+        return body
+    try:
+        text = body.decode('utf-8')
+    except UnicodeDecodeError:
+        return body
+    return _SECRET_JSON_VALUES.sub(lambda m: f'"{m.group(1)}"{m.group(2)}"{SCRUBBED}"', text).encode('utf-8')
+
+
+def body_hash(request: requests.PreparedRequest) -> Optional[str]:
+    """ A hash of the request body after scrubbing, or None if it has none. A multipart boundary is random,
+    so it is left out."""
+    body = request.body
+    if not body:
+        return None
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    boundary = re.search(r'boundary=([^;\s]+)', request.headers.get('Content-Type', ''))
+    if boundary:
+        body = body.replace(boundary.group(1).encode('ascii'), b'<boundary>')
+    return hashlib.sha256(scrub_body(body)).hexdigest()
+
+
+def _is_speculative(entry: dict) -> bool:
+    """ Whether the entry answered a request for a numbered page past the end, which prefetching may not repeat."""
+    return entry['status'] == 204 and 'page' in dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(entry['url']).query))
+
+
+class RecordingAdapter(BaseAdapter):
+    """ Sends requests through adapter (by default the connector's retrying HTTPAdapter) and appends each
+    exchange to the cassette. Responses are read in full, so that they can be recorded. Thread-safe."""
+
+    def __init__(self, cassette_path: Path, adapter: BaseAdapter = None):
+        super().__init__()
+        self.cassette_path = Path(cassette_path)
+        self.adapter = adapter or _retry_adapter()
+        self._lock = threading.Lock()
+        self._file = gzip.open(str(self.cassette_path), 'ab')
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        started = time.perf_counter()
+        response = self.adapter.send(request, **kwargs)
+        body = response.content  # the caller can still stream it; iter_content serves the read content
+        elapsed = time.perf_counter() - started
+        body = scrub_body(body)
+        headers = {k: v for k, v in response.headers.items() if k not in UNRECORDED_HEADERS}
+        if 'Content-Length' in response.headers:
+            headers['Content-Length'] = str(len(body))
+        try:
+            text, encoding = body.decode('utf-8'), 'utf-8'
+        except UnicodeDecodeError:
+            text, encoding = base64.b64encode(body).decode('ascii'), 'base64'
+        entry = {'method': request.method, 'url': scrub_url(request.url), 'body_hash': body_hash(request),
+                 'status': response.status_code,
+                 'reason': response.reason, 'headers': headers, 'body': text, 'body_encoding': encoding,
+                 'elapsed': round(elapsed, 4)}
+        line = json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self._lock:
+            self._file.write(line)
+        return response
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """ Answers requests from a cassette, without a network. Thread-safe.
+
+    speed: None to reply at once, or how many times faster than recorded to reply.
+    allow_repeats: when the responses recorded for a request have all been used, keep replying with the last one
+    (instead of raising CassetteMiss); useful when comparing a version of the connector which makes extra calls."""
+
+    def __init__(self, cassette_path: Path, speed: float = None, allow_repeats: bool = False):
+        super().__init__()
+        self.cassette_path = Path(cassette_path)
+        self.speed = speed
+        self.allow_repeats = allow_repeats
+        self._lock = threading.Lock()
+        self._responses = defaultdict(deque)  # type: Dict[Tuple[str, str, Optional[str]], Deque[dict]]
+        self._last = {}  # type: Dict[Tuple[str, str, Optional[str]], dict]
+        with gzip.open(str(self.cassette_path), 'rb') as cassette:
+            for line in cassette:
+                entry = json.loads(line)
+                self._responses[(entry['method'], entry['url'], entry.get('body_hash'))].append(entry)
+
+    def send(self, request: requests.PreparedRequest, stream=False, timeout=None, verify=True, cert=None,
+             proxies=None) -> requests.Response:
+        key = (request.method, scrub_url(request.url), body_hash(request))
+        with self._lock:
+            recorded = self._responses.get(key)
+            if recorded:
+                entry = self._last[key] = recorded.popleft()
+            elif self.allow_repeats and key in self._last:
+                entry = self._last[key]
+            else:
+                raise CassetteMiss(f"No recorded response for {request.method} {key[1]}", request=request)
+        if self.speed:
+            time.sleep(entry['elapsed'] / self.speed)
+        if entry['body_encoding'] == 'base64':
+            body = base64.b64decode(entry['body'])
+        else:
+            body = entry['body'].encode('utf-8')
+        raw = HTTPResponse(body=io.BytesIO(body), headers=entry['headers'], status=entry['status'],
+                           reason=entry['reason'], preload_content=False, decode_content=False)
+        return HTTPAdapter.build_response(self, request, raw)
+
+    def remaining(self) -> int:
+        """ How many recorded responses have not been replayed, leaving out speculative pages past the end."""
+        with self._lock:
+            return sum(not _is_speculative(entry) for responses in self._responses.values() for entry in responses)
+
+    def close(self):
+        pass
+
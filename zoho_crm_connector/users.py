@@ -0,0 +1,136 @@
+"""
+zoho_crm_connector.users
+~~~~~~~~~~~~~~~~~~~~~~~~
+
+An indexed, expiring cache of Zoho CRM users.
+
+Zoho_crm.user_directory keeps the users of each user type (AllUsers, ActiveUsers, ...) separately, with dict indexes
+by normalised full name, email and id, so finding a user costs a dict lookup rather than a scan of every user:
+
+    user = zoho_crm.user_directory.by_email('jane@example.com')
+    owners = zoho_crm.finduser_by_names(line['Sales_Rep'] for line in order_lines)
+
+Users are fetched when first needed. After ttl seconds they are refetched in a background thread, and lookups keep
+using the previous users until the new ones arrive, so a long import never waits for the refresh.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+logger = logging.getLogger()
+
+
+def normalize_name(name: str) -> str:
+    """ Case and repeated spaces don't matter when matching names."""
+    return ' '.join(name.split()).casefold()
+
+
+class _Users(NamedTuple):
+    response: dict  # {'users': [...]}, as returned by Zoho_crm.get_users
+    by_name: Dict[str, dict]
+    by_email: Dict[str, dict]
+    by_id: Dict[str, dict]
+    fetched_at: float
+
+
+def _index(users: List[dict]) -> _Users:
+    by_name, by_email = {}, {}
+    for user in users:
+        name = normalize_name(user.get('full_name') or '')
+        # if two users have the same name, prefer the active one
+        if name not in by_name or (by_name[name].get('status') != 'active' and user.get('status') == 'active'):
+            by_name[name] = user
+        if user.get('email'):
+            by_email.setdefault(user['email'].casefold(), user)
+    return _Users(response={'users': users}, by_name=by_name, by_email=by_email,
+                  by_id={str(user['id']): user for user in users}, fetched_at=time.time())
+
+
+class UserDirectory:
+    """ Users of each user type, indexed. Thread-safe.
+
+    fetch(user_type, per_page) returns the list of users of a type; Zoho_crm provides it.
+    ttl is how many seconds users are used before they are refetched (in the background)."""
+
+    def __init__(self, fetch: Callable[[str, int], List[dict]], ttl: float = 3600, per_page: int = 200):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.per_page = per_page
+        self._lock = threading.Lock()
+        self._fetch_locks = {}  # type: Dict[str, threading.Lock]
+        self._users = {}  # type: Dict[str, _Users]
+        self._refreshing = set()
+
+    def _get(self, user_type: str, per_page: int = None) -> _Users:
+        with self._lock:
+            users = self._users.get(user_type)
+            if users is not None:
+                if time.time() - users.fetched_at >= self.ttl and user_type not in self._refreshing:
+                    self._refreshing.add(user_type)
+                    threading.Thread(target=self._refresh_in_background, args=(user_type,),
+                                     name='zoho_user_refresh', daemon=True).start()
+                return users
+            fetch_lock = self._fetch_locks.setdefault(user_type, threading.Lock())
+        with fetch_lock:  # the first lookups of a type wait for one fetch
+            with self._lock:
+                if user_type in self._users:
+                    return self._users[user_type]
+            users = _index(self.fetch(user_type, per_page or self.per_page))
+            with self._lock:
+                self._users[user_type] = users
+            return users
+
+    def _refresh_in_background(self, user_type: str):
+        try:
+            self.refresh(user_type)
+        except Exception:
+            logger.exception(f"Refreshing Zoho {user_type} failed; the users already fetched are still used")
+        finally:
+            with self._lock:
+                self._refreshing.discard(user_type)
+
+    def refresh(self, user_type: str = 'AllUsers'):
+        """ Fetch the users of a type now."""
+        users = _index(self.fetch(user_type, self.per_page))
+        with self._lock:
+            self._users[user_type] = users
+
+    def set_users(self, user_type: str, users: List[dict]):
+        """ Use these users of a type, as if they had just been fetched."""
+        indexed = _index(users)
+        with self._lock:
+            self._users[user_type] = indexed
+
+    def invalidate(self, user_type: str = None):
+        """ Forget the users of a type, or of every type, so that the next lookup fetches them."""
+        with self._lock:
+            if user_type is None:
+                self._users.clear()
+            else:
+                self._users.pop(user_type, None)
+
+    def cached(self, user_type: str = 'AllUsers') -> Optional[dict]:
+        """ The users of a type already fetched, as {'users': [...]}, or None."""
+        with self._lock:
+            users = self._users.get(user_type)
+        return users.response if users else None
+
+    def users(self, user_type: str = 'AllUsers', per_page: int = None) -> dict:
+        """ {'users': [...]}, the users of a type; the same object is returned until the users are refetched."""
+        return self._get(user_type, per_page).response
+
+    def by_name(self, full_name: str, user_type: str = 'AllUsers') -> Optional[dict]:
+        return self._get(user_type).by_name.get(normalize_name(full_name))
+
+    def by_email(self, email: str, user_type: str = 'AllUsers') -> Optional[dict]:
+        return self._get(user_type).by_email.get(email.strip().casefold())
+
+    def by_id(self, user_id: str, user_type: str = 'AllUsers') -> Optional[dict]:
+        return self._get(user_type).by_id.get(str(user_id))
+
+    def resolve_names(self, full_names: Iterable[str], user_type: str = 'AllUsers') -> Dict[str, Optional[dict]]:
+        """ Look up many names at once: returns a dict of name: user (None when there is no such user)."""
+        users = self._get(user_type)
+        return {full_name: users.by_name.get(normalize_name(full_name)) for full_name in full_names}
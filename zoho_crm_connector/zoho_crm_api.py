@@ -7,7 +7,8 @@ zoho_crm_connector
 
 This library is based on Zoho's python sdk but is simplified, more pragmatic and modernised.
 
-No database dependency is included. Short-lived access tokens are written to a text file with no alternative at present.
+No database dependency is included. Short-lived access tokens are written to a text file by default;
+see token_store.py for a SQLite alternative and for sharing one token between processes.
 
 Multi-page requests are returned with yield (so they are generators).
 
@@ -24,32 +25,61 @@ but you will still need to enumerate. This is too complicated to put in the API.
 
 """
 
-import json
 import logging
+import queue
+import re
+import threading
 import time
 import urllib.parse
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Generator, List, Optional, Tuple
+from typing import Callable, Deque, Dict, Generator, Iterable, List, Optional, Tuple, TypeVar, Union
 
 import requests
-from requests.adapters import HTTPAdapter, Retry
+from requests.adapters import BaseAdapter, HTTPAdapter, Retry
+
+from . import export
+from .coql import (OFFSET_LIMIT, RangeValue, add_condition, ensure_order, extreme_query, page_query, query_after,
+                   range_conditions, range_value, split_limit)
+from .decoding import Decoder, PageParser, get_decoder, iter_page_records
+from .governor import CreditGovernor, estimate_cost
+from .metadata import MetadataCache, ModuleMetadata, org_key
+from .metrics import RequestEvent
+from .records import compact_pages
+from .token_store import FileTokenStore, TokenStore
+from .users import UserDirectory
 
 logger = logging.getLogger()
 
+T = TypeVar('T')
+_WORKER_PREFIX = 'zoho_crm_worker'
+
+
+API_HOST = {".COM": "www.zohoapis.com",
+            ".AU": "www.zohoapis.com.au",
+            ".EU": "www.zohoapis.eu",
+            ".IN": "www.zohoapis.in",
+            ".CN": "www.zohoapis.com.cn"
+            }
+DEFAULT_API_VERSION = 'v2'
+PAGE_TOKEN_VERSION = (2, 1)  # from v2.1, record lists return a next_page_token, and page= stops at 2000 records
+_API_VERSION_IN_URL = re.compile(r'/crm/v(\d+(?:\.\d+)*)/?$')
+
 
 class APIQuotaExceeded(Exception):
     pass
 
 
-def _requests_retry_session(
+def _retry_adapter(
         retries=10,
         backoff_factor=2,
         status_forcelist=(500, 502, 503, 504),
         # remove 429 here, the CRM retry functionality is a 24 hour rolling limit and can't be recovered by waiting for a minute or so
-        session=None,
-) -> requests.Session:
-    session = session or requests.Session()
+        pool_maxsize=10,
+        pool_block=False,
+) -> HTTPAdapter:
     """  A set of integer HTTP status codes that we should force a retry on.
         A retry is initiated if the request method is in ``method_whitelist``
         and the response status code is in ``status_forcelist``."""
@@ -60,7 +90,22 @@ def _requests_retry_session(
         backoff_factor=backoff_factor,
         status_forcelist=status_forcelist,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    return HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize, pool_block=pool_block)
+
+
+def _requests_retry_session(
+        retries=10,
+        backoff_factor=2,
+        status_forcelist=(500, 502, 503, 504),
+        session=None,
+        *,
+        pool_maxsize=10,
+        adapter: BaseAdapter = None,
+) -> requests.Session:
+    """ A session whose http and https requests go through adapter, by default a retrying HTTPAdapter."""
+    session = session or requests.Session()
+    adapter = adapter or _retry_adapter(retries=retries, backoff_factor=backoff_factor,
+                                        status_forcelist=status_forcelist, pool_maxsize=pool_maxsize)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     return session
@@ -79,6 +124,27 @@ def __hook(self, res, *args, **kwargs):
         return self.__session.send(res.request)
 
 
+def api_base_url(hosting: str = ".COM", api_version: str = DEFAULT_API_VERSION) -> str:
+    """ The REST API url for a data centre and API version, for example https://www.zohoapis.eu/crm/v2.1/ """
+    if hosting.upper() not in API_HOST:
+        raise RuntimeError(f"Zoho hosting {hosting} is not implemented")
+    return f"https://{API_HOST[hosting.upper()]}/crm/{api_version}/"
+
+
+def with_api_version(base_url: str, api_version: str) -> str:
+    """ base_url with its API version replaced: https://sandbox.zohoapis.com/crm/v2/ becomes .../crm/v2.1/ """
+    new_url, substitutions = _API_VERSION_IN_URL.subn(f'/crm/{api_version}/', base_url)
+    if not substitutions:
+        raise RuntimeError(f"Can't find the API version in the base url {base_url}")
+    return new_url
+
+
+def api_version_of(base_url: str) -> Tuple[int, ...]:
+    """ The API version in a base url as a tuple, (2, 1) for .../crm/v2.1/; (2,) when the url doesn't show it."""
+    match = _API_VERSION_IN_URL.search(base_url)
+    return tuple(int(part) for part in match.group(1).split('.')) if match else (2,)
+
+
 def escape_zoho_characters_v2(input_string) -> str:
     """ Note: this is only needed for searching, as in the yield_from_page method.
     This is an example
@@ -93,6 +159,11 @@ def escape_zoho_characters_v2(input_string) -> str:
         return input_string.translate(table)
 
 
+def _page_parameters(parameters: dict, page: int, page_token: str = None) -> dict:
+    """ parameters plus the page wanted: by its page_token if there is one, otherwise by number."""
+    return dict(parameters, page_token=page_token) if page_token else dict(parameters, page=page)
+
+
 def convert_datetime_to_zoho_crm_time(dt: datetime) -> str:
     # iso format but no fractional seconds
     return datetime.strftime(dt, "%Y-%m-%dT%H:%M:%S%z")
@@ -105,7 +176,7 @@ class Zoho_crm:
 
     Access tokens are obtained when needed.
 
-    The base_url defaults to the live API for US usage;
+    The base_url defaults to the live API for the hosting data centre, version api_version (v2 unless given);
         another base_url can be provided (for the sandbox API, for instance)"""
 
     ACCOUNTS_HOST = {".COM": "accounts.zoho.com",
@@ -115,46 +186,267 @@ class Zoho_crm:
                      ".CN": "accounts.zoho.com.cn"
                      }
 
-    def __init__(self, refresh_token: str, client_id: str, client_secret: str, token_file_dir: Path,
+    def __init__(self, refresh_token: str, client_id: str, client_secret: str, token_file_dir: Path = None,
                  base_url=None,
                  hosting=".COM",
                  default_zoho_user_name: str = None,
                  default_zoho_user_id: str = None,
+                 token_refresh_margin: float = 300,
+                 accounts_url: str = None,
+                 token_store: TokenStore = None,
+                 max_workers: int = 8,
+                 governor: CreditGovernor = None,
+                 request_hooks: List[Callable[[RequestEvent], None]] = None,
+                 transport: BaseAdapter = None,
+                 metadata_cache: MetadataCache = None,
+                 user_cache_ttl: float = 3600,
+                 api_version: str = None,
+                 json_decoder: Union[str, Decoder] = None,
                  ):
         """ Initialise a Zoho CRM connection by providing authentication details including a refresh token.
-        Access tokens are obtained when needed. The base_url defaults to the live API for US usage;
-        another base_url can be provided (for the sandbox API, for instance)
+        Access tokens are obtained when needed. The base_url defaults to the live API of the hosting data centre
+        (https://www.zohoapis.com/crm/v2/ for .COM); another base_url can be provided (for the sandbox API, for instance)
+        api_version (for example 'v2.1') sets the API version of either. From v2.1, module scans follow Zoho's
+        page_token cursor, so they are not limited to 2000 records.
+
+        The access token is kept in memory with its expiry time, and refreshed token_refresh_margin seconds
+        before it expires, or when Zoho rejects it. Construction makes no network calls.
+        accounts_url overrides the Zoho accounts server (e.g. https://accounts.zoho.com) worked out from hosting.
+
+        Tokens are kept in token_file_dir/access_token.json, unless a token_store is given
+        (see token_store.py). Processes and threads sharing a store share one token, and only one of them refreshes it.
+
+        A Zoho_crm can be shared by many threads. max_workers sizes its connection pool, and the thread pool used by
+        the batch methods and the map_ helpers, so call close() (or use it as a context manager) when finished.
+
+        A governor (see governor.py) paces calls to a credit budget and a concurrency limit.
+        Each of request_hooks is called with a RequestEvent after every API call (see metrics.py).
+        transport is a requests adapter to send requests through instead of the usual retrying HTTPAdapter,
+        for example one which records or replays traffic (see transport.py).
+        Module metadata is cached (see metadata.py) in a metadata_cache shared by every client for the same org,
+        kept in token_file_dir by default. Users are cached for user_cache_ttl seconds (see users.py).
+        Responses are decoded with json_decoder: 'orjson', 'msgspec', 'json', or a function of bytes;
+        by default the fastest installed (see decoding.py).
         """
         token_file_name = 'access_token.json'
-        self.requests_session = _requests_retry_session()
+        self.max_workers = max_workers
+        self.requests_session = _requests_retry_session(pool_maxsize=max(max_workers, 10), adapter=transport)
+        # token refreshes fail fast, as they always have: a refresh which can't reach Zoho is not retried
+        self.token_session = _requests_retry_session(retries=0, pool_maxsize=1, adapter=transport)
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+        self._executor_lock = threading.Lock()
         self.refresh_token = refresh_token
         self.client_id = client_id
         self.client_secret = client_secret
-        self.base_url = base_url or "https://www.zohoapis.com/crm/v2/"
         self.hosting = hosting.upper() or ".COM"
-        self.zoho_user_cache = None  # type: Optional[dict]
+        if base_url is None:
+            base_url = api_base_url(self.hosting, api_version or DEFAULT_API_VERSION)
+        elif api_version:
+            base_url = with_api_version(base_url, api_version)
+        self.base_url = base_url
+        self.api_version = api_version_of(base_url)  # type: Tuple[int, ...]
+        self.user_directory = UserDirectory(fetch=self._fetch_users, ttl=user_cache_ttl)
         self.default_zoho_user_name = default_zoho_user_name
         self.default_zoho_user_id = default_zoho_user_id
-        self.token_file_path = token_file_dir / token_file_name
-        # self.current_token = self._load_access_token()
-        self.token_timestamp = time.time()  #this is a safe default
+        if token_store is None:
+            if token_file_dir is None:
+                raise RuntimeError("Provide a token_file_dir or a token_store")
+            token_store = FileTokenStore(token_file_dir / token_file_name)
+        self.token_store = token_store
+        self.token_file_path = getattr(token_store, 'token_file_path', None)  # type: Optional[Path]
+        self.token_refresh_margin = token_refresh_margin
+        self.accounts_url = accounts_url
+        self.governor = governor
+        self.request_hooks = list(request_hooks or [])
+        self.decode_json = get_decoder(json_decoder)
+        self._thread_state = threading.local()  # counts token refreshes made by each thread, for request hooks
+        if metadata_cache is None:
+            metadata_cache = MetadataCache.for_org(org_key(self.base_url, client_id, refresh_token),
+                                                   cache_dir=token_file_dir)
+        self.metadata = ModuleMetadata(self, metadata_cache)
         self.__token = self._load_access_token()
 
+    def __enter__(self) -> 'Zoho_crm':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """ Shut down the thread pool and close pooled connections. """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        self.requests_session.close()
+        self.token_session.close()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """ The thread pool shared by the batch methods and the map_ helpers, with max_workers threads."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=_WORKER_PREFIX)
+            return self._executor
+
+    def map(self, fn: Callable[..., T], *iterables) -> List[T]:
+        """ Like the builtin map, but fn runs on the client's thread pool; results are in input order.
+
+        If called from one of the pool's own threads, fn runs in the calling thread instead,
+        so nested calls cannot deadlock by waiting for workers that are all busy waiting."""
+        if threading.current_thread().name.startswith(_WORKER_PREFIX):
+            return list(map(fn, *iterables))
+        return list(self.executor.map(fn, *iterables))
+
+    def map_get_records(self, queries: Iterable[dict]) -> List[List[dict]]:
+        """ Runs several yield_page_from_module queries at once, for example over different modules.
+        Each query is a dict of yield_page_from_module arguments; each result is the list of all matching records.
+
+            accounts, contacts = zoho_crm.map_get_records([{'module_name': 'Accounts'},
+                                                           {'module_name': 'Contacts', 'criteria': '(Last_Name:equals:Smith)'}])
+        """
+        def get_records(query: dict) -> List[dict]:
+            return list(self.iter_records(**query))
+
+        return self.map(get_records, list(queries))
+
+    def map_related_records(self, parent_module_name: str, child_module_name: str, parent_ids: Iterable[str],
+                            modified_since: datetime = None) -> Dict[str, List[Dict]]:
+        """ get_related_records for many parents at once. Returns a dict of parent id: related records
+        (an empty list when there are none)."""
+        parent_ids = list(parent_ids)
+
+        def get_related(parent_id: str) -> List[Dict]:
+            success, records = self.get_related_records(parent_module_name=parent_module_name,
+                                                        child_module_name=child_module_name, parent_id=parent_id,
+                                                        modified_since=modified_since)
+            return records or []
+
+        return dict(zip(parent_ids, self.map(get_related, parent_ids)))
+
+    def _yield_concurrently(self, streams: List[Callable[[], Iterable[T]]], workers: int) -> Generator[T, None, None]:
+        """ Runs each stream (a function returning an iterable) in a worker, at most workers at once, and yields
+        their items as they arrive. Each stream's items stay in order. A bounded queue keeps the workers from getting
+        far ahead of the caller; closing the generator stops them after the item they are fetching."""
+        items = queue.Queue(maxsize=2 * workers)
+        stop = threading.Event()
+
+        def put(entry: tuple):
+            while not stop.is_set():
+                try:
+                    items.put(entry, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def run(stream: Callable[[], Iterable[T]]):
+            iterator = None
+            try:
+                if stop.is_set():
+                    return
+                iterator = iter(stream())
+                for item in iterator:
+                    put(('item', item))
+                    if stop.is_set():
+                        return
+            except Exception as e:
+                put(('error', e))
+            finally:
+                if hasattr(iterator, 'close'):
+                    iterator.close()
+                put(('done', None))
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=_WORKER_PREFIX)
+        for stream in streams:
+            executor.submit(run, stream)
+        running = len(streams)
+        try:
+            while running:
+                kind, value = items.get()
+                if kind == 'done':
+                    running -= 1
+                elif kind == 'error':
+                    raise value
+                else:
+                    yield value
+        finally:
+            stop.set()
+            executor.shutdown(wait=True)
 
     @property
-    def current_token(self):
-        if time.time() - self.token_timestamp > 50 * 60 or not self.__token:
-            self.__token = self._load_access_token()
-            self.token_timestamp = time.time()
+    def current_token(self) -> dict:
+        """ The access token, refreshed if it expires within token_refresh_margin seconds."""
+        if not self._token_is_fresh(self.__token):
+            self.__token = self._refresh_access_token()
         return self.__token
 
+    def _send(self, method: str, url: str, endpoint: str = None, headers: dict = None, **kwargs) -> requests.Response:
+        """ Send a request with the current access token.
+        If Zoho rejects the token (401) it is refreshed and the request is sent once more.
+        endpoint is the url's template, such as '{module}/search', which the governor uses to weigh the call."""
+        started = time.perf_counter()
+        refreshes_before = getattr(self._thread_state, 'token_refreshes', 0)
+        token = self.current_token
+        request_headers = dict(headers or {})
+        request_headers['Authorization'] = 'Zoho-oauthtoken ' + token['access_token']
+        r = self._request(method, url, endpoint, request_headers, kwargs)
+        if r.status_code == 401:
+            logger.info('Access token rejected, refreshing')
+            r.close()  # a streamed response holds its pooled connection until closed
+            token = self._refresh_access_token(stale_token=token)
+            request_headers['Authorization'] = 'Zoho-oauthtoken ' + token['access_token']
+            for file in (kwargs.get('files') or {}).values():  # uploads have to be read again
+                file_object = file[1] if isinstance(file, tuple) else file
+                if hasattr(file_object, 'seek'):
+                    file_object.seek(0)
+            r = self._request(method, url, endpoint, request_headers, kwargs)
+        if self.request_hooks:
+            refreshes = getattr(self._thread_state, 'token_refreshes', 0) - refreshes_before
+            self._call_request_hooks(method, endpoint, r, latency=time.perf_counter() - started,
+                                     token_refreshes=refreshes, kwargs=kwargs)
+        return r
+
+    def _call_request_hooks(self, method: str, endpoint: Optional[str], r: requests.Response, latency: float,
+                            token_refreshes: int, kwargs: dict):
+        body = r.request.body
+        if kwargs.get('stream'):
+            bytes_in = int(r.headers.get('Content-Length') or 0)  # the body hasn't been read yet
+        else:
+            bytes_in = len(r.content or b'')
+        retries = getattr(getattr(r.raw, 'retries', None), 'history', None) or ()
+        if self.governor is not None:
+            credits = self.governor.cost(method, endpoint, json=kwargs.get('json'), params=kwargs.get('params'))
+        else:
+            credits = estimate_cost(method, endpoint, json=kwargs.get('json'), params=kwargs.get('params'))
+        event = RequestEvent(method=method, endpoint=endpoint or '', url=r.url, status=r.status_code, latency=latency,
+                             bytes_out=len(body) if isinstance(body, (bytes, str)) else 0, bytes_in=bytes_in,
+                             retries=len(retries), token_refreshes=token_refreshes, credits=credits)
+        for hook in self.request_hooks:
+            try:
+                hook(event)
+            except Exception:
+                logger.exception(f"Request hook {hook!r} failed")
+
+    def _request(self, method: str, url: str, endpoint: Optional[str], headers: dict,
+                 kwargs: dict) -> requests.Response:
+        if self.governor is None:
+            return self.requests_session.request(method, url, headers=headers, **kwargs)
+        cost = self.governor.cost(method, endpoint, json=kwargs.get('json'), params=kwargs.get('params'))
+        with self.governor.slot(cost):
+            r = self.requests_session.request(method, url, headers=headers, **kwargs)
+        self.governor.update_from_response(r.status_code, r.headers)
+        return r
+
+    def _json(self, r: requests.Response):
+        """ The response's JSON body, decoded from bytes with decode_json."""
+        return self.decode_json(r.content)
+
     def _validate_response(self, r: requests.Response) -> Optional[dict]:
-        """ Called internally to deal with Zoho API responses. Will fetch a new access token if necessary.
-        Not all errors are explicity handled; errors not handled here have no recovery option anyway,
-        so an exception is raised."""
+        """ Called internally to deal with Zoho API responses. Not all errors are explicity handled;
+        errors not handled here have no recovery option anyway, so an exception is raised."""
         # https://www.zoho.com/crm/help/api/v2/#HTTP-Status-Codes
         if r.status_code == 200:
-            return r.json()
+            return self._json(r)
         elif r.status_code == 201:
             return {'result': True}  # insert succeeded
         elif r.status_code == 202:  # multiple insert succeeded
@@ -164,15 +456,9 @@ class Zoho_crm:
         elif r.status_code == 304:  # nothing changed since the requested modified-since timestamp
             return None
         elif r.status_code == 401:
-            # assume invalid token
-            self._refresh_access_token()
-            # retry the request somehow
-            # probably should use a 'retry' exception?
-            orig_request = r.request
-            orig_request.headers['Authorization'] = 'Zoho-oauthtoken ' + self.current_token['access_token']
-            new_resp = self.requests_session.send(orig_request)
-
-            return new_resp.json()
+            # _send has already refreshed the token and sent the request once more, so the rejection stands
+            raise RuntimeError(
+                f"Access token rejected by Zoho, status code: {r.status_code} and text {r.text}, attempted url was: {r.url}")
         elif r.status_code == 429:
             raise APIQuotaExceeded("API Quota exceeded, error 429")
         # assume invalid token
@@ -181,8 +467,9 @@ class Zoho_crm:
                 f"API failure trying: {r.reason} and status code: {r.status_code} and text {r.text}, attempted url was: {r.url}, unquoted is: {urllib.parse.unquote(r.url)}")
 
     def yield_page_from_module(self, module_name: str, criteria: str = None,
-                               parameters: dict = None, modified_since: datetime = None) -> Generator[
-        List[dict], None, None]:
+                               parameters: dict = None, modified_since: datetime = None,
+                               prefetch: int = 0, fields: List[str] = None,
+                               compact: bool = False) -> Generator[List[dict], None, None]:
         """ Yields a page of results, each page being a list of dicts.
 
         For use of the criteria parameter, please see search documentation: https://www.zoho.com/crm/help/api-diff/searchRecords.html
@@ -195,93 +482,298 @@ class Zoho_crm:
         (({apiname}:{starts_with|equals}:{value}) and ({apiname}:{starts_with|equals}:{value}))
 
         You can search a maximum of 10 criteria (with same or different columns) with equals and starts_with conditions as shown above.'
+
+        prefetch is opt-in: with prefetch=k, background workers fetch the next k pages while you process the current
+        one, and at most k pages are fetched ahead. Each speculative page past the end still costs an API call.
+
+        fields limits the fields returned (the id is always included), which makes pages of wide modules much smaller.
+
+        With API v2.1 or later (see api_version), a scan without criteria follows Zoho's page_token cursor, so it
+        can go past the 2000 records that numbered pages are limited to. Searches are still numbered.
+
+        With compact=True records are compact, typed Record objects made from the module's field metadata rather than
+        dicts (see records.py); they take a fraction of the memory.
         """
-        page = 1
+        url, endpoint, headers, parameters = self._module_query(module_name, criteria, parameters, modified_since,
+                                                                fields)
+        pages = self._yield_pages(url=url, endpoint=endpoint, headers=headers, parameters=parameters,
+                                  prefetch=prefetch)
+        if compact:
+            return compact_pages(pages, self.metadata.record_class(module_name, fields))
+        return pages
+
+    def _module_query(self, module_name: str, criteria: Optional[str], parameters: Optional[dict],
+                      modified_since: Optional[datetime], fields: Optional[List[str]]) -> Tuple[str, str, dict, dict]:
+        """ The url, endpoint template, headers and parameters to list or search a module."""
         if not criteria:
             url = self.base_url + module_name
+            endpoint = '{module}'
         else:
             url = self.base_url + f'{module_name}/search'
+            endpoint = '{module}/search'
 
-        headers = {'Authorization': 'Zoho-oauthtoken ' + self.current_token['access_token']}
-        parameters = parameters or {}
+        headers = {}
+        parameters = dict(parameters or {})
         if criteria:
             parameters['criteria'] = criteria
+        if fields:
+            parameters['fields'] = ','.join(fields)
         if modified_since:
             # headers['If-Modified-Since'] = modified_since.isoformat()
             headers['If-Modified-Since'] = convert_datetime_to_zoho_crm_time(
                 modified_since)  # ensure no fractional seconds
+        return url, endpoint, headers, parameters
+
+    def iter_records(self, module_name: str, criteria: str = None, parameters: dict = None,
+                     modified_since: datetime = None, prefetch: int = 0,
+                     fields: List[str] = None, incremental: bool = False,
+                     compact: bool = False) -> Generator[dict, None, None]:
+        """ Like yield_page_from_module, but yields one record at a time. Pages are still fetched as needed.
+
+        With incremental=True each page is parsed while it downloads, and its records are yielded as they arrive
+        (see decoding.py). It can't be combined with prefetch."""
+        if incremental:
+            if prefetch:
+                raise ValueError("incremental parsing can't be combined with prefetch")
+            url, endpoint, headers, parameters = self._module_query(module_name, criteria, parameters,
+                                                                    modified_since, fields)
+            records = self._iter_streamed_records(url, endpoint, headers, parameters)
+            if compact:
+                from_dict = self.metadata.record_class(module_name, fields).from_dict
+                records = (from_dict(record) for record in records)
+            yield from records
+            return
+        for page in self.yield_page_from_module(module_name=module_name, criteria=criteria, parameters=parameters,
+                                                modified_since=modified_since, prefetch=prefetch, fields=fields,
+                                                compact=compact):
+            yield from page
+
+    def _iter_streamed_records(self, url: str, endpoint: str, headers: dict, parameters: dict) -> Generator[
+        dict, None, None]:
+        """ The records of each page, decoded while the page downloads, until Zoho says there are no more records."""
+        page = 1
+        page_token = None
         while True:
-            parameters['page'] = page
-            r = self.requests_session.get(url=url, headers=headers, params=urllib.parse.urlencode(parameters))
+            page_parameters = _page_parameters(parameters, page, page_token)
+            r = self._send('GET', url, endpoint=endpoint, headers=headers,
+                           params=urllib.parse.urlencode(page_parameters), stream=True)
+            with r:
+                if r.status_code != 200:
+                    self._validate_response(r)  # raises for errors; no content or not modified ends the scan
+                    return None
+                parser = PageParser(self.decode_json)
+                yield from iter_page_records(r.iter_content(chunk_size=65536), parser)
+                rest = parser.finish()
+            if not parser.has_data:
+                raise RuntimeError(
+                    f"Did not receive the expected data format in the returned json when: url={url} parameters={page_parameters}")
+            info = rest.get('info') or {}
+            if not info.get('more_records'):
+                return None
+            page += 1
+            page_token = info.get('next_page_token')
+
+    def _get_page(self, url: str, endpoint: str, headers: dict, parameters: dict, page: int,
+                  page_token: str = None) -> Optional[dict]:
+        """ Fetch one page: the one page_token points to, if given, otherwise the numbered page.
+        Returns None when there is no page (no content, or not modified)."""
+        page_parameters = _page_parameters(parameters, page, page_token)
+        r = self._send('GET', url, endpoint=endpoint, headers=headers, params=urllib.parse.urlencode(page_parameters))
+        r_json = self._validate_response(r)
+        if r_json and 'data' not in r_json:
+            raise RuntimeError(
+                f"Did not receive the expected data format in the returned json when: url={url} parameters={page_parameters}")
+        return r_json
 
-            r_json = self._validate_response(r)
+    def _pages_by_token(self, endpoint: str) -> bool:
+        """ Whether Zoho links the pages of this endpoint by next_page_token, rather than just numbering them."""
+        return endpoint == '{module}' and self.api_version >= PAGE_TOKEN_VERSION
+
+    def _yield_pages(self, url: str, endpoint: str, headers: dict, parameters: dict, prefetch: int = 0) -> Generator[
+        List[dict], None, None]:
+        """ Yields the data of each page until Zoho says there are no more records.
+
+        When a page's info has a next_page_token (record lists, from API v2.1), the next page is requested with it;
+        otherwise pages are requested by number.
+
+        With prefetch > 0, the next prefetch pages are requested by a pool of workers while the caller
+        is still processing the current page. No more than prefetch pages are requested ahead of the caller.
+        Pages past the end are requested speculatively and then discarded, so prefetching
+        can cost up to prefetch extra API calls per scan. Closing the generator early cancels the pages not yet
+        requested and waits for those already in flight. Pages linked by token can't be requested before the page
+        holding the token arrives, so then only the next page is fetched ahead, and never speculatively."""
+        if prefetch > 0 and self._pages_by_token(endpoint):
+            yield from self._yield_token_pages(url=url, endpoint=endpoint, headers=headers, parameters=parameters)
+            return
+        if prefetch > 0:
+            yield from self._yield_prefetched_pages(url=url, endpoint=endpoint, headers=headers, parameters=parameters,
+                                                    prefetch=prefetch)
+            return
+        page = 1
+        page_token = None
+        while True:
+            r_json = self._get_page(url=url, endpoint=endpoint, headers=headers, parameters=parameters, page=page,
+                                    page_token=page_token)
             if not r_json:
                 return None
-            if 'data' in r_json:
-                yield r_json['data']
-            else:
-                raise RuntimeError(
-                    f"Did not receive the expected data format in the returned json when: url={url} parameters={parameters}")
-            if 'info' in r_json:
-                if not r_json['info']['more_records']:
-                    break
-            else:
+            yield r_json['data']
+            if 'info' not in r_json or not r_json['info']['more_records']:
                 break
             page += 1
+            page_token = r_json['info'].get('next_page_token')
+
+    def _yield_token_pages(self, url: str, endpoint: str, headers: dict, parameters: dict) -> Generator[
+        List[dict], None, None]:
+        """ Pages linked by next_page_token, each requested by a worker as soon as the page before it arrives."""
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='zoho_prefetch')
+        future = executor.submit(self._get_page, url, endpoint, headers, parameters, 1)  # type: Optional[Future]
+        page = 1
+        try:
+            while future is not None:
+                r_json = future.result()
+                future = None
+                if not r_json:
+                    return None
+                info = r_json.get('info') or {}
+                if info.get('more_records'):
+                    page += 1
+                    future = executor.submit(self._get_page, url, endpoint, headers, parameters, page,
+                                             info.get('next_page_token'))
+                yield r_json['data']
+        finally:
+            if future is not None:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def _yield_prefetched_pages(self, url: str, endpoint: str, headers: dict, parameters: dict,
+                                prefetch: int) -> Generator[
+        List[dict], None, None]:
+        executor = ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix='zoho_prefetch')
+        pending = deque()  # type: Deque[Future]
+        next_page = 1
+        try:
+            while True:
+                while len(pending) < prefetch:
+                    pending.append(executor.submit(self._get_page, url, endpoint, headers, parameters, next_page))
+                    next_page += 1
+                r_json = pending.popleft().result()
+                if not r_json:
+                    return None
+                if 'info' in r_json and r_json['info']['more_records']:
+                    # keep the workers busy while the caller has this page
+                    pending.append(executor.submit(self._get_page, url, endpoint, headers, parameters, next_page))
+                    next_page += 1
+                    yield r_json['data']
+                else:
+                    yield r_json['data']
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+            # wait for pages already in flight, so no requests outlive the generator or run on the credit budget
+            executor.shutdown(wait=True)
 
-    def get_users(self, user_type: str = None, per_page:int=200) -> dict:
+    def get_users(self, user_type: str = None, per_page: int = None) -> dict:
         """
         Get zoho users, filtering by a Zoho CRM user type. The default value of None is mapped to 'AllUsers'
         user_type is documented: https://www.zoho.com/crm/developer/docs/api/v6/get-users.html
 
+        Users are cached separately for each user type, for user_cache_ttl seconds; see users.py.
         """
-        if self.zoho_user_cache is None:
-            user_type = user_type or 'AllUsers'
-            data = []
-            page = 0
-            while page < 999:
-                page += 1
-                url = self.base_url + f"users?type={user_type}&page={page}&per_page={per_page}"
-                headers = {'Authorization': 'Zoho-oauthtoken ' + self.current_token['access_token']}
-
-                r = self.requests_session.get(url=url, headers=headers)
-                validated_response = self._validate_response(r)
-                data.extend(validated_response['users'])
-                if not validated_response['info']['more_records']:
-                    break
-            self.zoho_user_cache = {"users": data}
-        return self.zoho_user_cache
+        return self.user_directory.users(user_type or 'AllUsers', per_page=per_page)
+
+    def _fetch_users(self, user_type: str, per_page: int) -> List[dict]:
+        data = []
+        page = 0
+        while page < 999:
+            page += 1
+            url = self.base_url + f"users?type={user_type}&page={page}&per_page={per_page}"
+            r = self._send('GET', url, endpoint='users')
+            validated_response = self._validate_response(r)
+            if not validated_response:  # no (more) users
+                break
+            data.extend(validated_response['users'])
+            if not validated_response['info']['more_records']:
+                break
+        return data
+
+    @property
+    def zoho_user_cache(self) -> Optional[dict]:
+        """ The users fetched by get_users(), or None. Set it to None to forget them, or to {'users': [...]}
+        to use those users instead of fetching them."""
+        return self.user_directory.cached('AllUsers')
+
+    @zoho_user_cache.setter
+    def zoho_user_cache(self, value: Optional[dict]):
+        if value is None:
+            self.user_directory.invalidate()
+        else:
+            self.user_directory.set_users('AllUsers', value['users'])
 
     def finduser_by_name(self, full_name: str) -> Tuple[str, str]:
         """ Tries to reutn the user as a tuple(full_name,Zoho user id), using the full full_name provided.
             The user must be active. If no such user is found, return the default user provided
-            at initialisation of the Zoho_crm object."""
-        users = self.get_users()
+            at initialisation of the Zoho_crm object.
+            Names are matched ignoring case and extra spaces."""
+        return self._user_or_default(full_name, self.user_directory.by_name(full_name))
+
+    def finduser_by_names(self, full_names: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+        """ finduser_by_name for many names at once: returns a dict of name: (full_name, Zoho user id)."""
+        return {full_name: self._user_or_default(full_name, user)
+                for full_name, user in self.user_directory.resolve_names(full_names).items()}
+
+    def _user_or_default(self, full_name: str, user: Optional[dict]) -> Tuple[str, str]:
         default_user_name = self.default_zoho_user_name
         default_user_id = self.default_zoho_user_id
-        for user in users['users']:
-            if user['full_name'] == full_name.strip():
-                if user['status'] == 'active':
-                    return full_name, user['id']
-                else:
-                    logger.debug(f"User is inactive in zoho crm: {full_name}")
-                    return default_user_name, default_user_id
-
-        # not found
-        logger.info(f"User not found in zoho: {full_name}")
-        return default_user_name, default_user_id
+        if user is None:
+            logger.info(f"User not found in zoho: {full_name}")
+            return default_user_name, default_user_id
+        if user['status'] != 'active':
+            logger.debug(f"User is inactive in zoho crm: {full_name}")
+            return default_user_name, default_user_id
+        return full_name, user['id']
 
     def get_record_by_id(self, module_name, id) -> dict:
         """ Call the get record endpoint with an id"""
 
         url = self.base_url + f'{module_name}/{id}'
-        headers = {'Authorization': 'Zoho-oauthtoken ' + self.current_token['access_token']}
-        r = self.requests_session.get(url=url, headers=headers)
+        r = self._send('GET', url, endpoint='{module}/{id}')
         r_json = self._validate_response(r)
         return r_json['data'][0]
 
+    def get_records_by_ids(self, module_name: str, ids: List[str], fields: List[str] = None) -> List[dict]:
+        """ Fetch many records by id, 100 ids per call with the ids parameter, running calls at once on the thread pool.
+
+        fields optionally limits the fields returned. Records are returned in the order of ids;
+        ids that are not found are left out."""
+        url = self.base_url + module_name
+
+        def get_chunk(chunk: List[str]) -> List[dict]:
+            parameters = {'ids': ','.join(chunk)}
+            if fields:
+                parameters['fields'] = ','.join(fields)
+            r = self._send('GET', url, endpoint='{module}', params=urllib.parse.urlencode(parameters))
+            r_json = self._validate_response(r)
+            return r_json['data'] if r_json else []
+
+        pages = self.map(get_chunk, [ids[i:i + 100] for i in range(0, len(ids), 100)])
+        records_by_id = {record['id']: record for page in pages for record in page}
+        return [records_by_id[record_id] for record_id in ids if record_id in records_by_id]
+
+    def _written_records(self, module_name: str, r_json: dict, returns: str) -> List[Dict]:
+        """ What the write methods return for returns='details' or returns='records' """
+        results = r_json.get('data', [])
+        if returns == 'details':
+            return [result.get('details', {}) for result in results]
+        elif returns == 'records':
+            record_ids = [result['details']['id'] for result in results if result.get('status') == 'success']
+            return self.get_records_by_ids(module_name=module_name, ids=record_ids)
+        else:
+            raise ValueError(f"returns must be 'details' or 'records', not {returns}")
+
     def yield_deleted_records_from_module(self, module_name: str, type: str = 'all',
-                                          modified_since: datetime = None) -> Generator[List[dict], None, None]:
+                                          modified_since: datetime = None,
+                                          prefetch: int = 0) -> Generator[List[dict], None, None]:
         """ Yields a page of deleted record results.
 
         Args:
@@ -291,70 +783,79 @@ class Zoho_crm:
                 'recycle': To get the list of deleted records from recycle bin.
                 'permanent': To get the list of permanently deleted records.
             modified_since (datetime.datetime): Return records deleted after this date.
+            prefetch (int): Number of pages to fetch ahead in the background, see yield_page_from_module.
         Returns:
             A generator that yields pages of deleted records as a list of dictionaries.
 
         """
-        page = 1
         url = self.base_url + f'{module_name}/deleted'
 
-        headers = {'Authorization': 'Zoho-oauthtoken ' + self.current_token['access_token']}
+        headers = {}
         parameters = {'type': type}
         if modified_since:
             headers['If-Modified-Since'] = modified_since.isoformat()
-        while True:
-            parameters['page'] = page
-            r = self.requests_session.get(url=url, headers=headers, params=urllib.parse.urlencode(parameters))
-
-            r_json = self._validate_response(r)
-            if not r_json:
-                return None
-            if 'data' in r_json:
-                yield r_json['data']
-            else:
-                raise RuntimeError(
-                    f"Did not receive the expected data format in the returned json when: url={url} parameters={parameters}")
-            if 'info' in r_json:
-                if not r_json['info']['more_records']:
-                    break
-            else:
-                break
-            page += 1
+        return self._yield_pages(url=url, endpoint='{module}/deleted', headers=headers, parameters=parameters,
+                                 prefetch=prefetch)
 
     def delete_from_module(self, module_name: str, record_id: str) -> Tuple[bool, dict]:
         """ deletes from a named Zoho CRM module"""
 
         url = self.base_url + f"{module_name}"
-        headers = {'Authorization': 'Zoho-oauthtoken ' + self.current_token['access_token']}
-        r = self.requests_session.delete(url=url, headers=headers, params={'ids': record_id})
+        r = self._send('DELETE', url, endpoint='{module}', params={'ids': record_id})
 
         if r.ok and r.status_code == 200:
-            return True, r.json()
+            return True, self._json(r)
         else:
-            return False, r.json()
+            return False, self._json(r)
+
+    def delete_many_from_module(self, module_name: str, ids: List[str], wf_trigger: bool = True) -> Dict[str, bool]:
+        """ Deletes many records, 100 ids per call, running calls at once on the thread pool.
+
+        wf_trigger is passed to Zoho: set it False to delete without running workflow rules.
+        Returns a dict of record id: True if that record was deleted."""
+        url = self.base_url + f"{module_name}"
+
+        def delete_chunk(chunk: List[str]) -> Dict[str, bool]:
+            parameters = {'ids': ','.join(chunk), 'wf_trigger': 'true' if wf_trigger else 'false'}
+            r = self._send('DELETE', url, endpoint='{module}', params=parameters)
+            if r.status_code == 429:
+                raise APIQuotaExceeded("API Quota exceeded, error 429")
+            else:
+                r_json = self._json(r) if r.content else {}
+            deleted = {record_id: False for record_id in chunk}
+            for result in (r_json or {}).get('data', []):
+                record_id = result.get('details', {}).get('id')
+                if record_id in deleted:
+                    deleted[record_id] = result.get('status') == 'success'
+            return deleted
+
+        results = {}  # type: Dict[str, bool]
+        for deleted in self.map(delete_chunk, [ids[i:i + 100] for i in range(0, len(ids), 100)]):
+            results.update(deleted)
+        return results
 
     def update_zoho_module(self, module_name: str,
-                           payload: Dict[str, List[Dict]]
+                           payload: Dict[str, List[Dict]],
+                           returns: str = None,
                            ) -> Tuple[bool, Dict]:
         """Update, modified from upsert
+
+        By default the json reply is returned. returns='details' returns the list of per-record write details instead,
+        and returns='records' returns the updated records, re-fetched in batches with get_records_by_ids.
         """
         url = self.base_url + module_name
-        headers = {
-            'Authorization':
-                'Zoho-oauthtoken ' + self.current_token['access_token']
-        }
         if 'trigger' not in payload:
             payload['trigger'] = []
-        r = self.requests_session.put(url=url,
-                                      headers=headers,
-                                      json=payload)
+        r = self._send('PUT', url, endpoint='{module}', json=payload)
         if r.ok:
-            return True, r.json()
+            if returns:
+                return True, self._written_records(module_name=module_name, r_json=self._json(r), returns=returns)
+            return True, self._json(r)
         else:
-            return False, r.json()
+            return False, self._json(r)
 
     def upsert_zoho_module(self, module_name: str, payload: Dict[str, List[Dict]],
-                           criteria: str = None, ) -> Tuple[bool, Dict]:
+                           criteria: str = None, returns: str = None) -> Tuple[bool, Dict]:
         """creation is done with the Record API and module "Accounts".
         Zoho does not make mandatory fields such as Account_Name unique.
         But here, a criteria string can be passed to identify a 'unique' record:
@@ -372,6 +873,10 @@ class Zoho_crm:
 
         If unsuccessful, it returns the json result in the API reply.
         See https://www.zoho.com/crm/help/api/v2/#create-specify-records
+
+        Re-fetching the record costs another call. returns='details' skips it and returns the list of per-record
+        write details instead; returns='records' returns every written record (not just the first),
+        re-fetched in batches with get_records_by_ids.
         """
 
         update_existing_record = False  # by default, always insert
@@ -388,33 +893,70 @@ class Zoho_crm:
                 update_existing_record = True
 
         url = self.base_url + f'{module_name}'
-        headers = {'Authorization': 'Zoho-oauthtoken ' + self.current_token['access_token']}
         if 'trigger' not in payload:
             payload['trigger'] = []
         if update_existing_record:
-            r = self.requests_session.put(url=url, headers=headers, json=payload)
+            r = self._send('PUT', url, endpoint='{module}', json=payload)
         else:
-            r = self.requests_session.post(url=url, headers=headers, json=payload)
+            r = self._send('POST', url, endpoint='{module}', json=payload)
         if r.ok:
             if r.status_code == 202:  # could be duplicate
-                return False, r.json()
+                return False, self._json(r)
+            elif returns:
+                return True, self._written_records(module_name=module_name, r_json=self._json(r), returns=returns)
             else:
                 try:
-                    record_id = r.json()['data'][0]['details']['id']
+                    record_id = self._json(r)['data'][0]['details']['id']
                     return True, self.get_record_by_id(module_name=module_name, id=record_id)
                 except Exception as e:
                     raise e
         else:
-            return False, r.json()
+            return False, self._json(r)
+
+    def upsert_many_zoho_module(self, module_name: str, records: List[Dict], duplicate_check_fields: List[str],
+                                trigger: List[str] = None, batch_size: int = 100) -> List[Tuple[str, Dict]]:
+        """ Insert or update any number of records with Zoho's native upsert, batch_size (at most 100) records per call.
+
+        Zoho matches existing records on duplicate_check_fields (for example ['Account_Name']) and updates the match,
+        or inserts a new record. Unlike upsert_zoho_module with a criteria, there is no search per record,
+        so N records cost about N/100 calls.
+
+        Returns one (outcome, result) tuple per record, in the order of the input records.
+        outcome is 'inserted', 'updated' or 'failed', and result is Zoho's result for that record
+        (its 'details' include the record id). Workflow triggers are off unless trigger is given, as elsewhere.
+        See https://www.zoho.com/crm/developer/docs/api/v2/upsert-records.html
+        """
+        url = self.base_url + f'{module_name}/upsert'
+        outcomes = []  # type: List[Tuple[str, Dict]]
+        for start in range(0, len(records), batch_size):
+            chunk = records[start:start + batch_size]
+            payload = {'data': chunk, 'duplicate_check_fields': duplicate_check_fields, 'trigger': trigger or []}
+            r = self._send('POST', url, endpoint='{module}/upsert', json=payload)
+            if r.status_code == 429:
+                raise APIQuotaExceeded("API Quota exceeded, error 429")
+            else:
+                r_json = self._json(r) if r.content else {}
+            results = (r_json or {}).get('data')
+            if not results or len(results) != len(chunk):
+                outcomes.extend(('failed', r_json) for _ in chunk)
+                continue
+            for result in results:
+                if result.get('status') != 'success':
+                    outcomes.append(('failed', result))
+                elif result.get('action') == 'update':
+                    outcomes.append(('updated', result))
+                else:
+                    outcomes.append(('inserted', result))
+        return outcomes
 
     def get_related_records(self, parent_module_name: str, child_module_name: str, parent_id: str,
                             modified_since: datetime = None) \
             -> Tuple[bool, Optional[List[Dict]]]:
         url = self.base_url + f'{parent_module_name}/{parent_id}/{child_module_name}'
-        headers = {'Authorization': 'Zoho-oauthtoken ' + self.current_token['access_token']}
+        headers = {}
         if modified_since:
             headers['If-Modified-Since'] = modified_since.isoformat()
-        r = self.requests_session.get(url=url, headers=headers)
+        r = self._send('GET', url, endpoint='{module}/{id}/{related_module}', headers=headers)
 
         r_json = self._validate_response(r)
         if r.ok and r_json is not None:
@@ -425,65 +967,143 @@ class Zoho_crm:
             return False, r_json
 
     def get_records_through_coql_query(self, query: str) -> List[Dict]:
-        url = self.base_url + "coql"
-        headers = {'Authorization': 'Zoho-oauthtoken ' + self.current_token['access_token']}
-        r = self.requests_session.post(url=url, headers=headers, json={"select_query": query})
-        r_json = self._validate_response(r)
-        if r.ok:
-            return r_json['data']
-        else:
-            return []
+        """ All the records a COQL query selects, fetched a page at a time (see yield_coql_pages).
+        A LIMIT in the query is respected."""
+        return [record for page in self.yield_coql_pages(query) for record in page]
+
+    def yield_coql_pages(self, query: str, page_size: int = None, windows: int = 1, window_field: str = 'id',
+                         max_workers: int = None) -> Generator[List[dict], None, None]:
+        """ Yields the pages of records a COQL query selects, advancing LIMIT offset, count until Zoho says
+        there are no more records. See coql.py.
+
+        page_size is the count asked for with each call: by default the most Zoho allows, 2000 (200 before v2.1).
+        A query without an ORDER BY is ordered by id, so that offsets are stable, and so that paging can go on after
+        the last id fetched instead of past Zoho's offset limit (a query with its own ORDER BY raises RuntimeError
+        there). A LIMIT in the query is respected. Errors, such as a page_size Zoho refuses, raise.
+
+        windows > 1 splits the query into that many disjoint ranges of window_field (id, or a datetime field such as
+        Modified_Time), which are paged concurrently by up to max_workers workers (by default, one per window up to
+        the client's max_workers). Pages from different windows are interleaved. A query with a LIMIT can't be split.
+        """
+        query, offset, count = split_limit(query)
+        page_size = page_size or self._coql_page_size()
+        if windows <= 1:
+            yield from self._yield_coql_query_pages(query, offset, count, page_size)
+            return
+        if count is not None or offset:
+            raise ValueError("A COQL query with a LIMIT can't be split into windows")
+        conditions = self._coql_windows(query, window_field, windows)
+        streams = [lambda window_query=add_condition(query, condition):
+                   self._yield_coql_query_pages(window_query, 0, None, page_size)
+                   for condition in conditions]
+        if streams:
+            yield from self._yield_concurrently(streams, workers=max_workers or min(len(streams), self.max_workers))
+
+    def iter_coql_records(self, query: str, page_size: int = None, windows: int = 1, window_field: str = 'id',
+                          max_workers: int = None) -> Generator[dict, None, None]:
+        """ Like yield_coql_pages, but yields one record at a time."""
+        for page in self.yield_coql_pages(query, page_size=page_size, windows=windows, window_field=window_field,
+                                          max_workers=max_workers):
+            yield from page
+
+    def export_module(self, module_name: str, partitions: int = 8, workers: int = None,
+                      partition_by: str = 'Modified_Time', fields: List[str] = None) -> Generator[dict, None, None]:
+        """ Yields every record of a module, fetched as partitions disjoint slices by up to workers workers at once
+        (by default, one per slice up to max_workers). See export.py.
+
+        partition_by is a datetime field (Modified_Time, Created_Time, ...) whose ranges are fetched with searches,
+        sized by counting with COQL; or 'id', for id ranges read with COQL and fetched 100 ids at a time.
+        fields limits the fields returned. Records come in no particular order, each once."""
+        return export.export_module(self, module_name, partitions=partitions, workers=workers,
+                                    partition_by=partition_by, fields=fields)
+
+    def _coql_page_size(self) -> int:
+        """ The most records one COQL call can return."""
+        return 2000 if self.api_version >= PAGE_TOKEN_VERSION else 200
+
+    def _coql_query(self, query: str) -> Optional[dict]:
+        """ The response to a COQL query; None if it selects nothing. Errors raise."""
+        r = self._send('POST', self.base_url + "coql", endpoint='coql', json={"select_query": query})
+        return self._validate_response(r)
+
+    def _yield_coql_query_pages(self, query: str, offset: int, count: Optional[int], page_size: int) -> Generator[
+        List[dict], None, None]:
+        """ The pages of a query without a LIMIT, from offset on, up to count records. Before a page would pass
+        OFFSET_LIMIT, paging starts again after the last id fetched (see coql.query_after)."""
+        page_base = ensure_order(query)
+        fetched = 0
+        last_id = None
+        while count is None or fetched < count:
+            size = page_size if count is None else min(page_size, count - fetched)
+            if offset + size > OFFSET_LIMIT:
+                page_base, offset = query_after(query, last_id), 0
+            r_json = self._coql_query(page_query(page_base, offset, size))
+            if not r_json or not r_json.get('data'):
+                return None
+            yield r_json['data']
+            fetched += len(r_json['data'])
+            offset += len(r_json['data'])
+            last_id = r_json['data'][-1].get('id')
+            if not (r_json.get('info') or {}).get('more_records'):
+                return None
 
-    def get_module_field_api_names(self, module_name: str) -> List[str]:
-        """ uses Fields Meta Data but just returns a list of field API names """
-        url = self.base_url + f"settings/fields?module={module_name}"
-        headers = {'Authorization': 'Zoho-oauthtoken ' + self.current_token['access_token']}
-        r = self.requests_session.get(url=url, headers=headers)
-        r_json = self._validate_response(r)
-        if r.ok and r_json is not None:
-            field_list = [f["api_name"] for f in r_json["fields"]]
-            return field_list
-        else:
-            raise RuntimeError(f"did not receive valid data for get_module_field_names {module_name}")
+    def _coql_bounds(self, query: str, field: str) -> Optional[Tuple[RangeValue, RangeValue]]:
+        """ The lowest and highest values of field among the records the query selects; None if it selects none."""
+        lowest = self._coql_query(extreme_query(query, field))
+        highest = self._coql_query(extreme_query(query, field, descending=True))
+        if not lowest or not lowest.get('data') or not highest or not highest.get('data'):
+            return None
+        return range_value(lowest['data'][0][field]), range_value(highest['data'][0][field])
 
-    def _load_access_token(self) -> dict:
-        try:
-            with self.token_file_path.open() as data_file:
-                data_loaded = json.load(data_file)
-                # validate it
-                url = self.base_url + f"users?type='AllUsers'"
-                headers = {'Authorization': 'Zoho-oauthtoken ' + data_loaded['access_token']}
-                r = self.requests_session.get(url=url, headers=headers)
-                r = self.requests_session.post(url=url)
-                if r.status_code == 401:
-                    data_loaded = self._refresh_access_token()
-
-                return data_loaded
-        except (KeyError, FileNotFoundError, IOError) as e:
-            new_token = self._refresh_access_token()
-            return new_token
+    def _coql_windows(self, query: str, field: str, windows: int) -> List[str]:
+        """ Conditions splitting the records the query selects into disjoint ranges of field; none if it selects none."""
+        bounds = self._coql_bounds(query, field)
+        return range_conditions(field, *bounds, windows) if bounds else []
+
+    def get_module_field_api_names(self, module_name: str) -> List[str]:
+        """ uses Fields Meta Data but just returns a list of field API names.
+        The field metadata is cached; see self.metadata for the rest of it. """
+        return self.metadata.field_api_names(module_name)
+
+    def _load_access_token(self) -> Optional[dict]:
+        """ Reads the access token saved by an earlier refresh, without any network calls.
+        Returns None if there is no saved token."""
+        return self.token_store.load()
+
+    def _token_is_fresh(self, token: Optional[dict]) -> bool:
+        return bool(token) and time.time() < token.get('expires_at', 0) - self.token_refresh_margin
+
+    def _refresh_access_token(self, stale_token: dict = None) -> dict:
+        """ Get a fresh token: current_token calls this shortly before the token expires,
+        and _send calls it with the rejected token if Zoho replies 401.
+        The token store makes this single-flight: if another thread or process has already refreshed,
+        its token is used and Zoho is not asked again."""
+        self.__token = self.token_store.get_token(is_fresh=self._token_is_fresh, refresh=self._request_new_token,
+                                                  stale_token=stale_token)
+        return self.__token
 
-    def _refresh_access_token(self) -> dict:
-        """ This forces a new token so it should only be called
-        after we know we need a new token.
-        Use load_access_token to get a token, it will call this if it needs to."""
-        auth_host = self.ACCOUNTS_HOST[self.hosting]
-        if not auth_host:
-            raise RuntimeError(f"Zoho hosting {self.hosting} is not implemented")
-        url = (f"https://{auth_host}/oauth/v2/token?refresh_token="
+    def _request_new_token(self) -> dict:
+        """ Ask Zoho for a new access token. Use _refresh_access_token, which stores it and avoids duplicate requests."""
+        if self.accounts_url:
+            accounts_url = self.accounts_url.rstrip('/')
+        else:
+            auth_host = self.ACCOUNTS_HOST[self.hosting]
+            if not auth_host:
+                raise RuntimeError(f"Zoho hosting {self.hosting} is not implemented")
+            accounts_url = f"https://{auth_host}"
+        url = (f"{accounts_url}/oauth/v2/token?refresh_token="
                f"{self.refresh_token}&client_id={self.client_id}&"
                f"client_secret={self.client_secret}&grant_type=refresh_token")
-        r = requests.post(url=url)
+        requested_at = time.time()
+        self._thread_state.token_refreshes = getattr(self._thread_state, 'token_refreshes', 0) + 1
+        r = self.token_session.post(url=url)
         if r.status_code == 200:
-            new_token = r.json()
-            logger.info(f"New token: {new_token}")
+            new_token = self._json(r)
+            logger.info(f"New access token, expires in {new_token.get('expires_in')} seconds")
             if 'access_token' not in new_token:
                 logger.error(f"Token is not valid")
                 raise RuntimeError(f"Zoho refresh token is not valid: {new_token}")
-            else:
-                self.__token = new_token
-                with self.token_file_path.open('w') as outfile:
-                    json.dump(new_token, outfile)
-                return new_token
+            new_token['expires_at'] = requested_at + new_token.get('expires_in', 3600)
+            return new_token
         else:
             raise RuntimeError(f"API failure trying to get access token: {r.reason}")